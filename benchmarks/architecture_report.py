@@ -0,0 +1,276 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+
+import numpy as np
+
+sys.path.append('../src/')
+
+from bench_utils import measure, peak_memory_mb
+
+"""
+Accuracy/latency trade-off of SCSS-Net architecture variants (model_scss_net.scss_net() options) on CPU.
+
+For every variant and event it reports number of parameters, FLOPs of one 256x256 image, CPU latency of model with and
+without folded batch normalization and Dice/IoU on test set. Variant is trained on training set of event (or fine-tuned,
+when its weights from older run exist) and weights are saved to --weights-dir, so next report reuses them. Baseline
+starts from trained weights of event (--ch-weights, --ar-weights) if provided. Without training data accuracy of
+variants without weights is not reported, so latency and FLOPs can be compared quickly.
+Every variant runs in its own process with GPU hidden, so latency is measured on CPU and memory is not shared.
+
+example (run from benchmarks folder):
+    python architecture_report.py --events CH AR --epochs 30 --fine-tune-epochs 5
+        --ch-weights ../modeling/ch_model.h5 --ar-weights ../modeling/ar_model.h5 --output results/architectures.json
+    python architecture_report.py --events CH --epochs 0 --variants baseline separable_bilinear_0.5
+"""
+
+# arguments of scss_net() used in this project, variants change only the rest of them
+BASE = {"filters": 32, "layers": 4, "batch_norm": True, "drop_prob": 0.5}
+VARIANTS = {
+    "baseline": {},
+    "width_0.5": {"width_multiplier": 0.5},
+    "separable": {"separable": True},
+    "bilinear": {"decoder": "bilinear"},
+    "separable_bilinear": {"separable": True, "decoder": "bilinear"},
+    "separable_bilinear_0.5": {"separable": True, "decoder": "bilinear", "width_multiplier": 0.5},
+}
+IMG_SIZE = 256
+
+
+def count_flops(model):
+    """
+    FLOPs of one image, multiply-add is 2 operations. Convolutions and batch normalization are counted, other layers
+    (activations, pooling, upsampling) are negligible.
+    :param tf.keras.Model model: model
+    :return int: number of floating point operations
+    """
+    flops = 0
+    for layer in model.layers:
+        name = type(layer).__name__
+        if name not in ("Conv2D", "Conv2DTranspose", "SeparableConv2D", "BatchNormalization"):
+            continue
+        _, height, width, c_out = layer.output.shape
+        c_in = layer.input.shape[-1]
+        if name == "BatchNormalization":
+            flops += 2 * height * width * c_out
+            continue
+        kernel = layer.kernel_size[0] * layer.kernel_size[1]
+        if name == "SeparableConv2D":
+            # depthwise convolution of every input channel, then 1x1 convolution over channels
+            channels = c_in * layer.depth_multiplier
+            flops += 2 * height * width * (channels * kernel + channels * c_out)
+        else:
+            flops += 2 * height * width * kernel * c_in * c_out
+    return int(flops)
+
+
+def _load_test(pattern_imgs, pattern_masks, n_imgs):
+    from data_pipeline import pair_paths
+    from image_loader import load_batch, normalize
+
+    img_paths, mask_paths = pair_paths(pattern_imgs, pattern_masks)
+    img_paths, mask_paths = img_paths[:n_imgs], mask_paths[:n_imgs]
+    if not img_paths:
+        return None, None
+    # full decode, the same inputs as in training and inference
+    x = normalize(load_batch(img_paths, IMG_SIZE, reduce=False))[..., None]
+    y = normalize(load_batch(mask_paths, IMG_SIZE, reduce=False))[..., None]
+    return x, y
+
+
+def _train(model, config, epochs, weights_path):
+    # returns False when there is no training data
+    from keras.callbacks import ModelCheckpoint
+    from data_pipeline import pair_paths, train_val_datasets
+    from metrics import dice, iou
+
+    img_paths, mask_paths = pair_paths(config["train_imgs"], config["train_masks"])
+    if not img_paths:
+        return False
+    train_ds, val_ds = train_val_datasets(img_paths, mask_paths, batch_size=config["batch_size"])
+
+    model.compile(optimizer="adam", loss="binary_crossentropy", metrics=[iou, dice])
+    callback_checkpoint = ModelCheckpoint(weights_path, monitor="val_loss", save_best_only=True,
+                                          save_weights_only=True)
+    model.fit(train_ds, validation_data=val_ds, epochs=epochs, callbacks=[callback_checkpoint], verbose=2)
+    model.load_weights(weights_path)
+    return True
+
+
+def _predict(model, x, batch_size=16):
+    return np.concatenate([np.asarray(model.predict_on_batch(x[i:i + batch_size])) for i in range(0, len(x), batch_size)])
+
+
+def _run_variant(config, queue):
+    # latency is measured on CPU, like on servers without GPU
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+    import tensorflow as tf
+    from evaluation import per_image_scores
+    from model_scss_net import fold_batch_norm, scss_net
+
+    if config["threads"]:
+        tf.config.threading.set_intra_op_parallelism_threads(config["threads"])
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    model = scss_net((IMG_SIZE, IMG_SIZE, 1), **BASE, **VARIANTS[config["variant"]])
+
+    # weights of this variant from older run, trained weights of event for baseline
+    weights_path = os.path.join(config["weights_dir"], f"{config['event']}_{config['variant']}.h5")
+    initial = weights_path if os.path.exists(weights_path) else config["initial_weights"]
+    if initial:
+        model.load_weights(initial)
+    epochs = config["fine_tune_epochs"] if initial else config["epochs"]
+    used_weights = initial
+    if epochs and _train(model, config, epochs, weights_path):
+        used_weights = weights_path
+
+    folded = fold_batch_norm(model)
+    result = {
+        "variant": config["variant"],
+        "event": config["event"],
+        "options": VARIANTS[config["variant"]],
+        "weights": used_weights,
+        "params": int(model.count_params()),
+        "params_folded": int(folded.count_params()),
+        "flops": count_flops(model),
+        "flops_folded": count_flops(folded),
+    }
+
+    x_test, y_test = _load_test(config["test_imgs"], config["test_masks"], config["n_imgs"])
+    if x_test is None:
+        x_test = np.random.default_rng(0).random((max(config["batch_sizes"]), IMG_SIZE, IMG_SIZE, 1), dtype=np.float32)
+    y_pred = _predict(model, x_test)
+    # folding changes only rounding of float operations
+    result["max_abs_diff_folded"] = float(np.max(np.abs(_predict(folded, x_test) - y_pred)))
+
+    if used_weights and y_test is not None:
+        scores = per_image_scores(y_test, y_pred)
+        result["dice"] = float(np.mean(scores["dice"]))
+        result["iou"] = float(np.mean(scores["iou"]))
+        result["n_test_imgs"] = len(y_test)
+
+    result["latency"] = {}
+    for name, latency_model in [("unfolded", model), ("folded", folded)]:
+        result["latency"][name] = {}
+        for batch_size in config["batch_sizes"]:
+            batch = np.resize(x_test, (batch_size,) + x_test.shape[1:])
+            latency = measure(lambda: latency_model.predict_on_batch(batch), config["repeats"])
+            result["latency"][name][batch_size] = {**latency, "imgs_per_s": batch_size / latency["median_s"]}
+
+    result["peak_memory_mb"] = peak_memory_mb()
+    queue.put(result)
+
+
+def _run(config, poll_s=5.0):
+    # variant which crashed (eg. out of memory) is recorded as failed, report continues with next variant
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_variant, args=(config, results))
+    process.start()
+    while True:
+        try:
+            result = results.get(timeout=poll_s)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                # result could be put right before process ended
+                try:
+                    result = results.get(timeout=poll_s)
+                    break
+                except queue.Empty:
+                    result = {"variant": config["variant"], "event": config["event"],
+                              "options": VARIANTS[config["variant"]], "failed": True,
+                              "error": f"process exited with code {process.exitcode}"}
+                    break
+    process.join()
+    return result
+
+
+def run(events=("CH", "AR"), variants=None, data="../data/train_test_data/", weights=None, weights_dir="weights",
+        epochs=30, fine_tune_epochs=0, batch_size=20, n_imgs=200, batch_sizes=(1, 8), repeats=5, threads=None):
+    """
+    Trains (or loads) every variant for every event and measures it.
+    :param tuple events: events to report
+    :param list variants: names of variants from VARIANTS, None for all
+    :param str data: folder with <event>_train_imgs, <event>_train_masks, <event>_test_imgs and <event>_test_masks
+    :param dict weights: event -> trained weights of baseline
+    :param str weights_dir: folder where weights of variants are saved and loaded from
+    :param int epochs: epochs of variants without weights, 0 disables training
+    :param int fine_tune_epochs: epochs of variants with weights
+    :param int batch_size: batch size of training
+    :param int n_imgs: maximal number of test images
+    :param tuple batch_sizes: batch sizes of latency benchmark
+    :param int repeats: number of measured calls
+    :param int threads: tensorflow threads, None for all cores
+    :return list: results as list of dicts
+    """
+    variants = list(VARIANTS) if variants is None else variants
+    weights = weights or {}
+    os.makedirs(weights_dir, exist_ok=True)
+
+    results = []
+    for event in events:
+        patterns = {f"{split}_{kind}": os.path.join(data, f"{event}_{split}_{kind}", "*.png")
+                    for split in ("train", "test") for kind in ("imgs", "masks")}
+        for variant in variants:
+            config = {**patterns, "event": event, "variant": variant, "weights_dir": weights_dir,
+                      "initial_weights": weights.get(event) if variant == "baseline" else None, "epochs": epochs,
+                      "fine_tune_epochs": fine_tune_epochs, "batch_size": batch_size, "n_imgs": n_imgs,
+                      "batch_sizes": list(batch_sizes), "repeats": repeats, "threads": threads}
+            results.append(_run(config))
+            _print_row(results[-1])
+    return results
+
+
+def _print_header(batch_sizes):
+    latency = " ".join(f"{f'bs{bs} ms':>9} {f'folded':>7}" for bs in batch_sizes)
+    print(f"{'event':<5} {'variant':<24} {'params M':>9} {'GFLOPs':>7} {'dice':>7} {'iou':>7} {latency}")
+
+
+def _print_row(result):
+    if result.get("failed"):
+        print(f"{result['event']:<5} {result['variant']:<24} failed: {result['error']}")
+        return
+    dice = f"{result['dice']:>7.4f}" if "dice" in result else f"{'-':>7}"
+    iou = f"{result['iou']:>7.4f}" if "iou" in result else f"{'-':>7}"
+    latency = " ".join(f"{unfolded['median_s'] * 1000:>9.1f} {result['latency']['folded'][bs]['median_s'] * 1000:>7.1f}"
+                       for bs, unfolded in result["latency"]["unfolded"].items())
+    print(f"{result['event']:<5} {result['variant']:<24} {result['params'] / 1e6:>9.2f} "
+          f"{result['flops_folded'] / 1e9:>7.2f} {dice} {iou} {latency}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy/latency report of SCSS-Net architecture variants")
+    parser.add_argument("--events", nargs="+", choices=["CH", "AR"], default=["CH", "AR"])
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=None)
+    parser.add_argument("--data", default="../data/train_test_data/", help="folder with train and test images")
+    parser.add_argument("--ch-weights", default=None, help="trained .h5 weights of CH baseline")
+    parser.add_argument("--ar-weights", default=None, help="trained .h5 weights of AR baseline")
+    parser.add_argument("--weights-dir", default="weights", help="folder with weights of trained variants")
+    parser.add_argument("--epochs", type=int, default=30, help="epochs of variants without weights")
+    parser.add_argument("--fine-tune-epochs", type=int, default=0, help="epochs of variants with weights")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--n-imgs", type=int, default=200, help="maximal number of test images")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None, help="tensorflow threads")
+    parser.add_argument("--output", default=None, help="json file to save results")
+    args = parser.parse_args()
+
+    _print_header(args.batch_sizes)
+    results = run(args.events, args.variants, args.data, {"CH": args.ch_weights, "AR": args.ar_weights},
+                  args.weights_dir, args.epochs, args.fine_tune_epochs, args.batch_size, args.n_imgs,
+                  args.batch_sizes, args.repeats, args.threads)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+sys.path.append('../src/')
+
+from bench_utils import measure, peak_memory_mb
+
+"""
+Parity check and latency benchmark of SCSS-Net backends (keras .h5 and TensorFlow Lite models from export_model.py).
+
+For every backend it reports Dice/IoU against ground truth masks of test split, drift of Dice/IoU against predictions
+of keras model, latency and throughput for several batch sizes and peak memory. Every backend runs in its own process.
+
+example (run from benchmarks folder):
+    python backend_benchmark.py --weights ../modeling/ch_model.h5
+        --backends ../modeling/ch_model_fp16.tflite ../modeling/ch_model_int8.tflite
+        --test-imgs "../data/train_test_data/CH_test_imgs/*.png" --test-masks "../data/train_test_data/CH_test_masks/*.png"
+"""
+
+
+def _run_backend(config, queue):
+    from export_model import load_images, load_model
+    from metrics import dice_np, iou_np
+
+    x_test = load_images(config["test_imgs"], config["n_imgs"])
+    y_test = load_images(config["test_masks"], config["n_imgs"])
+    reference = np.load(config["reference"]) if config["reference"] else None
+
+    model = load_model(config["path"])
+
+    y_pred = np.concatenate([np.asarray(model.predict_on_batch(x_test[i:i + 16])) for i in range(0, len(x_test), 16)])
+    if config["save_predictions"]:
+        np.save(config["save_predictions"], y_pred)
+
+    result = {
+        "backend": os.path.basename(config["path"]),
+        "size_mb": os.path.getsize(config["path"]) / 1024 ** 2,
+        "dice": float(np.mean([dice_np(y_t, y_p) for y_t, y_p in zip(y_test, y_pred)])),
+        "iou": float(np.mean([iou_np(y_t, y_p) for y_t, y_p in zip(y_test, y_pred)])),
+    }
+
+    if reference is not None:
+        # agreement with keras predictions, 1.0 means no drift
+        result["dice_vs_keras"] = float(np.mean([dice_np(y_r, y_p) for y_r, y_p in zip(reference, y_pred)]))
+        result["iou_vs_keras"] = float(np.mean([iou_np(y_r, y_p) for y_r, y_p in zip(reference, y_pred)]))
+        result["max_abs_diff"] = float(np.max(np.abs(reference - y_pred)))
+
+    result["latency"] = {}
+    for batch_size in config["batch_sizes"]:
+        batch = x_test[:batch_size]
+        if len(batch) < batch_size:
+            batch = np.resize(x_test, (batch_size,) + x_test.shape[1:])
+        latency = measure(lambda: model.predict_on_batch(batch), config["repeats"])
+        result["latency"][batch_size] = {**latency, "imgs_per_s": batch_size / latency["median_s"]}
+
+    result["peak_memory_mb"] = peak_memory_mb()
+    queue.put(result)
+
+
+def _run(config):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_backend, args=(config, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def run(weights, backends, test_imgs, test_masks, n_imgs=100, batch_sizes=(1, 8, 32), repeats=5, workdir="."):
+    """
+    Runs parity check and benchmark of keras model and all provided backends.
+    :param str weights: path to .h5 weights, reference backend
+    :param list backends: paths to .tflite models
+    :param str test_imgs: glob pattern of test images
+    :param str test_masks: glob pattern of test masks
+    :param int n_imgs: number of test images
+    :param tuple batch_sizes: batch sizes of latency benchmark
+    :param int repeats: number of measured calls
+    :param str workdir: folder where reference predictions are stored
+    :return list: results as list of dicts, first is keras model
+    """
+    reference = os.path.join(workdir, "keras_predictions.npy")
+    config = {"test_imgs": test_imgs, "test_masks": test_masks, "n_imgs": n_imgs, "batch_sizes": list(batch_sizes),
+              "repeats": repeats}
+
+    results = [_run({**config, "path": weights, "reference": None, "save_predictions": reference})]
+    for backend in backends:
+        results.append(_run({**config, "path": backend, "reference": reference, "save_predictions": None}))
+
+    os.remove(reference)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and latency of SCSS-Net backends")
+    parser.add_argument("--weights", required=True, help="path to .h5 weights")
+    parser.add_argument("--backends", nargs="*", default=[], help="paths to .tflite models")
+    parser.add_argument("--test-imgs", required=True)
+    parser.add_argument("--test-masks", required=True)
+    parser.add_argument("--n-imgs", type=int, default=100)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=None, help="json file to save results")
+    args = parser.parse_args()
+
+    results = run(args.weights, args.backends, args.test_imgs, args.test_masks, args.n_imgs, args.batch_sizes,
+                  args.repeats)
+
+    print(f"{'backend':<28} {'MB':>6} {'dice':>7} {'iou':>7} {'dice drift':>11} {'peak mem':>9}  imgs/s per batch size")
+    for result in results:
+        drift = 1 - result["dice_vs_keras"] if "dice_vs_keras" in result else 0.0
+        throughput = ", ".join(f"{bs}: {lat['imgs_per_s']:.1f}" for bs, lat in result["latency"].items())
+        print(f"{result['backend']:<28} {result['size_mb']:>6.1f} {result['dice']:>7.4f} {result['iou']:>7.4f} "
+              f"{drift:>11.4f} {result['peak_memory_mb']:>9.0f}  {throughput}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
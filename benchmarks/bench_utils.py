@@ -0,0 +1,41 @@
+import resource
+import sys
+import time
+
+import numpy as np
+
+"""
+Helpers shared by benchmark scripts.
+"""
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory of current process.
+    :return float: peak memory in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def measure(function, repeats=5, warmup=1):
+    """
+    Measures wall time of function.
+    :param callable function: function without arguments
+    :param int repeats: number of measured calls
+    :param int warmup: number of calls before measurement (graph build, caches)
+    :return dict: median, min and max time in seconds
+    """
+    for _ in range(warmup):
+        function()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return {
+        "median_s": float(np.median(latencies)),
+        "min_s": float(np.min(latencies)),
+        "max_s": float(np.max(latencies)),
+    }
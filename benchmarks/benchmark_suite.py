@@ -0,0 +1,295 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.append('../src/')
+sys.path.append('../preprocesing/')
+sys.path.append('../webapp/')
+
+import synthetic_data
+from bench_utils import measure, peak_memory_mb
+
+"""
+Offline benchmark suite of hot paths of preprocessing, evaluation, webapp and inference. Everything runs on synthetic
+data generated from fixed seeds (see synthetic_data.py), so it needs no network, no SOHO images and no GPU.
+Results are saved as json together with commit and environment, --compare prints speedup against older result.
+
+    margin_table      - preprocesing/crop_functions.margin_table() for 1996 - 2021
+    get_mask_margin   - crop_functions.get_mask_margin() for every date of archive
+    crop_sun          - crop_functions.crop_sun() of 1024 px images
+    crop_limb         - prep_utils.crop_limb() of 1024 px RGB image (numpy and PIL input)
+    create_contours   - utils.create_contours() of 256 px prediction drawn at 1024 px
+    dice_np           - metrics.dice_np() of 256 px masks
+    find_image        - image lookup of webapp.find_image() (image_catalog) over archive tree with thousands of dated files,
+                        index build and glob scan of the original find_image() are reported for comparison
+    scss_net_predict  - predict_on_batch() of SCSS-Net with random weights at several batch sizes
+
+Benchmarks whose dependencies are missing (eg. tensorflow) are reported as skipped.
+
+example (run from benchmarks folder):
+    python benchmark_suite.py --output results/baseline.json
+    python benchmark_suite.py --only crop_sun find_image --compare results/baseline.json
+"""
+
+SEED = 0
+
+
+def _per_item(latency, n_items):
+    return {**latency, "n_items": n_items, "per_item_ms": latency["median_s"] / n_items * 1000}
+
+
+def bench_margin_table(context):
+    from crop_functions import margin_table
+
+    latency = measure(lambda: margin_table(132, 142, 143, 132), context["repeats"])
+    return _per_item(latency, len(margin_table(132, 142, 143, 132)))
+
+
+def bench_get_mask_margin(context):
+    from crop_functions import get_mask_margin, margin_table
+
+    table = margin_table(132, 142, 143, 132)
+    days = [f"{date:%Y/%m/%d}" for date in synthetic_data.dates(context["n_dates"])]
+    latency = measure(lambda: [get_mask_margin(table, day) for day in days], context["repeats"])
+    return _per_item(latency, len(days))
+
+
+def bench_crop_sun(context):
+    from crop_functions import crop_sun
+
+    paths = sorted(glob.glob(os.path.join(context["archive"][("CH", False)][0], "*.jpg")))[:context["n_images"]]
+    output = os.path.join(context["workdir"], "cropped") + "/"
+    os.makedirs(output, exist_ok=True)
+
+    def run():
+        for path in paths:
+            crop_sun(path, output, 132, 142, 143, 132)
+
+    return _per_item(measure(run, context["repeats"]), len(paths))
+
+
+def bench_crop_limb(context):
+    from prep_utils import crop_limb, limb_mask
+
+    img = np.stack([synthetic_data.sun_image(1024, seed=SEED)] * 3, axis=-1)
+    mask = limb_mask((1024, 1024), radius=374)
+    pil_img = Image.fromarray(img)
+
+    return {
+        "numpy": measure(lambda: crop_limb(img.copy(), mask), context["repeats"]),
+        "pil": measure(lambda: crop_limb(pil_img, mask), context["repeats"]),
+    }
+
+
+def _prediction(seed):
+    # soft prediction: ground truth blurred by noise
+    mask = synthetic_data.event_mask(256, seed=seed).astype(np.float32) / 255
+    noise = np.random.default_rng(seed).normal(0, 0.1, mask.shape).astype(np.float32)
+    return np.clip(mask + noise, 0, 1)[:, :, None]
+
+
+def bench_create_contours(context):
+    from utils import create_contours
+
+    y_pred = _prediction(SEED)
+    return {
+        approximation: measure(lambda a=approximation: create_contours(y_pred, (1024, 1024), approximation=a),
+                               context["repeats"])
+        for approximation in ("none", "simple")
+    }
+
+
+def bench_dice_np(context):
+    from metrics import dice_np
+
+    y_true = synthetic_data.event_mask(256, seed=SEED).astype(np.float32)[:, :, None] / 255
+    y_pred = _prediction(SEED)
+    return measure(lambda: dice_np(y_true, y_pred), context["repeats"])
+
+
+def bench_find_image(context):
+    import image_catalog
+
+    archive = context["archive"]
+    days = synthetic_data.dates(context["n_dates"])
+    queries = [days[i] for i in np.random.default_rng(SEED).integers(0, len(days), 200)]
+
+    def build():
+        # new index file every time, so all archives are scanned (first lookup of archive scans it)
+        index_path = os.path.join(context["workdir"], f"catalog_{time.perf_counter_ns()}.json")
+        new_catalog = image_catalog.ImageCatalog(archive, index_path)
+        for event, cropped in archive:
+            new_catalog.lookup(days[0], event, cropped)
+        return new_catalog
+
+    catalog = build()
+
+    def lookup():
+        for date in queries:
+            catalog.lookup(date, "CH", cropped=True)
+
+    directory, extension = archive[("CH", True)]
+
+    def glob_scan():
+        # original find_image(), glob of whole archive and scan of all paths on every call
+        date_str = queries[0].strftime("%Y%m%d")
+        path_to_img = ""
+        for path in glob.glob(f"{directory}*{extension}"):
+            if date_str in path:
+                path_to_img = path
+        return path_to_img
+
+    return {
+        "index_build": measure(build, context["repeats"]),
+        "lookup": _per_item(measure(lookup, context["repeats"]), len(queries)),
+        "glob_scan": measure(glob_scan, context["repeats"]),
+    }
+
+
+def bench_scss_net_predict(context):
+    from model_scss_net import scss_net
+
+    model = scss_net((256, 256, 1), filters=32, layers=4, batch_norm=True, drop_prob=0.5)
+    results = {}
+    for batch_size in context["batch_sizes"]:
+        x = np.stack([_prediction(SEED + i) for i in range(batch_size)])
+        latency = measure(lambda: model.predict_on_batch(x), context["repeats"])
+        results[str(batch_size)] = _per_item(latency, batch_size)
+    return results
+
+
+BENCHMARKS = {
+    "margin_table": bench_margin_table,
+    "get_mask_margin": bench_get_mask_margin,
+    "crop_sun": bench_crop_sun,
+    "crop_limb": bench_crop_limb,
+    "create_contours": bench_create_contours,
+    "dice_np": bench_dice_np,
+    "find_image": bench_find_image,
+    "scss_net_predict": bench_scss_net_predict,
+}
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names=None, n_dates=9000, n_images=8, batch_sizes=(1, 4, 16), repeats=5, workdir=None):
+    """
+    Runs benchmarks on synthetic data.
+    :param list names: names of benchmarks from BENCHMARKS, None runs all
+    :param int n_dates: number of dated files in every synthetic archive
+    :param int n_images: number of real 1024 px images (used by crop_sun)
+    :param tuple batch_sizes: batch sizes of scss_net_predict
+    :param int repeats: number of measured runs of every benchmark
+    :param str workdir: folder for synthetic data, temporary folder if None
+    :return dict: results with environment
+    """
+    names = list(BENCHMARKS) if names is None else names
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = workdir or tmp
+        start = time.perf_counter()
+        archive = synthetic_data.make_archive(os.path.join(workdir, "imgs"), n_dates, n_images, seed=SEED)
+        context = {"workdir": workdir, "archive": archive, "n_dates": n_dates, "n_images": n_images,
+                   "batch_sizes": list(batch_sizes), "repeats": repeats}
+        generation_s = time.perf_counter() - start
+
+        results = {}
+        for name in names:
+            try:
+                results[name] = BENCHMARKS[name](context)
+            except ImportError as e:
+                results[name] = {"skipped": str(e)}
+            print(f"{name}: {_short(results[name])}")
+
+    return {
+        "commit": _commit(),
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpu_count": os.cpu_count(),
+        "config": {"n_dates": n_dates, "n_images": n_images, "batch_sizes": list(batch_sizes), "repeats": repeats,
+                   "seed": SEED},
+        "data_generation_s": generation_s,
+        "peak_memory_mb": peak_memory_mb(),
+        "results": results,
+    }
+
+
+def _medians(result, prefix=""):
+    # flattens nested results to {"name/sub": median_s}
+    if "median_s" in result:
+        return {prefix: result["median_s"]}
+    medians = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            medians.update(_medians(value, f"{prefix}/{key}" if prefix else key))
+    return medians
+
+
+def _short(result):
+    if "skipped" in result:
+        return f"skipped ({result['skipped']})"
+    return ", ".join(f"{key or 'median'}={value * 1000:.2f} ms" for key, value in _medians(result).items())
+
+
+def compare(new, old):
+    """
+    Prints speedup of new results against old results, >1 means new commit is faster.
+    :param dict new: results of run()
+    :param dict old: results of run() loaded from json
+    """
+    print(f"\n{'benchmark':<40} {'old ms':>10} {'new ms':>10} {'speedup':>8}   ({old['commit']} -> {new['commit']})")
+    for name, result in new["results"].items():
+        old_medians = _medians(old["results"].get(name, {}), name)
+        for key, median in _medians(result, name).items():
+            if key in old_medians:
+                print(f"{key:<40} {old_medians[key] * 1000:>10.2f} {median * 1000:>10.2f} "
+                      f"{old_medians[key] / median:>7.2f}x")
+            else:
+                print(f"{key:<40} {'-':>10} {median * 1000:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite on synthetic solar images")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=None, help="benchmarks to run")
+    parser.add_argument("--n-dates", type=int, default=9000, help="number of dated files in synthetic archives")
+    parser.add_argument("--n-images", type=int, default=8, help="number of real 1024 px synthetic images")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--workdir", default=None, help="folder for synthetic data, reused between runs")
+    parser.add_argument("--output", default=None, help="json file to save results")
+    parser.add_argument("--compare", default=None, help="json file with older results")
+    args = parser.parse_args()
+
+    results = run(args.only, args.n_dates, args.n_images, args.batch_sizes, args.repeats, args.workdir)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+sys.path.append('../src/')
+
+import image_loader
+from bench_utils import measure
+
+"""
+Throughput of image_loader against the old idiom np.array(Image.open(p).convert("L").resize((IMG_SIZE, IMG_SIZE))).
+
+If no images are provided, synthetic 1024x1024 JPEG and PNG images are generated. Besides images/second it reports
+largest and mean difference of reduced decode against old idiom in gray levels.
+
+example (run from benchmarks folder):
+    python image_loader_benchmark.py --images "../data/imgs/imgs_195_96-21/*.jpg" --n-imgs 200
+    python image_loader_benchmark.py --synthetic-format png
+"""
+
+
+def synthetic_images(directory, n_imgs, img_format="jpg", size=1024, seed=0):
+    """
+    Writes synthetic images of bright disk with smooth structures and noise.
+    :param str directory: output folder
+    :param int n_imgs: number of images
+    :param str img_format: "jpg" or "png"
+    :param int size: size of images
+    :param int seed: seed of noise
+    :return list: paths to images
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    disk = (xx - size / 2) ** 2 + (yy - size / 2) ** 2 < (size * 0.37) ** 2
+    paths = []
+    for i in range(n_imgs):
+        structure = np.sin(xx / (20 + i % 7)) * np.cos(yy / (30 + i % 5)) * 40
+        img = np.where(disk, 140 + structure, 10) + rng.normal(0, 8, (size, size))
+        img = np.clip(img, 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"{i:05d}.{img_format}")
+        Image.fromarray(np.stack([img] * 3, axis=-1)).save(path)
+        paths.append(path)
+    return paths
+
+
+def legacy_load(paths, img_size):
+    imgs_list = []
+    for image in paths:
+        imgs_list.append(np.array(Image.open(image).convert("L").resize((img_size, img_size))))
+    return np.asarray(imgs_list, dtype=np.float32) / 255
+
+
+def run(paths, img_size=256, repeats=3, workers=(1, 4)):
+    """
+    :param list paths: paths to images
+    :param int img_size: size of model input
+    :param int repeats: number of measured runs
+    :param tuple workers: numbers of decoding threads
+    :return list: results, one dict per loader configuration
+    """
+    reference = legacy_load(paths, img_size)
+
+    configs = [("legacy idiom", lambda: legacy_load(paths, img_size))]
+    for n_workers in workers:
+        for reduce in (False, True):
+            configs.append((f"load_batch workers={n_workers} reduce={reduce}",
+                            lambda n=n_workers, r=reduce: image_loader.normalize(
+                                image_loader.load_batch(paths, img_size, workers=n, reduce=r))))
+
+    results = []
+    for name, function in configs:
+        latency = measure(function, repeats, warmup=1)
+        diff = np.abs(function().reshape(reference.shape) - reference) * 255
+        results.append({
+            "loader": name,
+            "imgs_per_s": len(paths) / latency["median_s"],
+            "max_diff": float(diff.max()),
+            "mean_diff": float(diff.mean()),
+            **latency,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of image_loader against the old loading idiom")
+    parser.add_argument("--images", default=None, help="glob pattern of images, synthetic images if not provided")
+    parser.add_argument("--n-imgs", type=int, default=100)
+    parser.add_argument("--synthetic-format", choices=["jpg", "png"], default="jpg")
+    parser.add_argument("--img-size", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--output", default=None, help="json file to save results")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.images:
+            paths = sorted(glob.glob(args.images))[:args.n_imgs]
+        else:
+            paths = synthetic_images(directory, args.n_imgs, args.synthetic_format)
+        results = run(paths, args.img_size, args.repeats, args.workers)
+
+    print(f"{'loader':<38} {'imgs/s':>8} {'speedup':>8} {'max diff':>9} {'mean diff':>10}")
+    for result in results:
+        speedup = result["imgs_per_s"] / results[0]["imgs_per_s"]
+        print(f"{result['loader']:<38} {result['imgs_per_s']:>8.1f} {speedup:>7.2f}x {result['max_diff']:>9.1f} "
+              f"{result['mean_diff']:>10.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append('../src/')
+
+from inference_server import InferenceClient
+
+"""
+Load test of inference server (src/inference_server.py). For every concurrency level, that many client threads send
+single-image requests (like webapp sessions) for fixed time, throughput and p50/p99 latency are reported together with
+mean batch size the server formed.
+
+Server is started from this script with --ch/--ar arguments, or already running server is used with --url.
+
+example (run from benchmarks folder):
+    python inference_load_benchmark.py --ch random --concurrency 1 2 4 8 16 --duration 10 --max-latency-ms 10
+    python inference_load_benchmark.py --url http://127.0.0.1:8765 --event AR
+"""
+
+
+def _wait_for_server(client, timeout):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            return client.stats()
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def run_level(client, event, concurrency, duration, batch_size=1, seed=0):
+    """
+    Sends requests from concurrent threads for duration seconds.
+    :param InferenceClient client: client of server
+    :param str event: "CH" or "AR"
+    :param int concurrency: number of client threads
+    :param float duration: duration of level in seconds
+    :param int batch_size: number of images in one request
+    :param int seed: seed of random images
+    :return dict: throughput, latency percentiles and mean batch size formed by server
+    """
+    x = np.random.default_rng(seed).random((batch_size, 256, 256, 1), dtype=np.float32)
+    latencies = [[] for _ in range(concurrency)]
+    errors = []
+    stop = time.perf_counter() + duration
+
+    def worker(i):
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                client.predict(event, x)
+            except Exception as e:
+                errors.append(repr(e))
+                return
+            latencies[i].append(time.perf_counter() - start)
+
+    before = client.stats()[event]
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    after = client.stats()[event]
+
+    all_latencies = np.concatenate([np.asarray(thread_latencies) for thread_latencies in latencies]) * 1000
+    batches = after["batches"] - before["batches"]
+    p50, p99 = np.percentile(all_latencies, [50, 99]) if len(all_latencies) else (np.nan, np.nan)
+    return {
+        "concurrency": concurrency,
+        "requests": len(all_latencies),
+        "imgs_per_s": len(all_latencies) * batch_size / elapsed,
+        "p50_ms": float(p50),
+        "p99_ms": float(p99),
+        "mean_batch_size": (after["images"] - before["images"]) / batches if batches else 0.0,
+        "errors": errors[:5],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of SCSS-Net inference server")
+    parser.add_argument("--url", default=None, help="url of running server, if not set server is started")
+    parser.add_argument("--ch", default=None, help='CH model for started server, .h5, .tflite or "random"')
+    parser.add_argument("--ar", default=None, help='AR model for started server, .h5, .tflite or "random"')
+    parser.add_argument("--port", type=int, default=8766, help="port of started server")
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-latency-ms", type=float, default=10.0)
+    parser.add_argument("--event", default=None, help="event to test, defaults to first served event")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of every concurrency level")
+    parser.add_argument("--output", default=None, help="json file to save results")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        if not (args.ch or args.ar):
+            parser.error("--url or at least one of --ch and --ar is required")
+        command = [sys.executable, "../src/inference_server.py", "--port", str(args.port),
+                   "--max-batch-size", str(args.max_batch_size), "--max-latency-ms", str(args.max_latency_ms)]
+        command += (["--ch", args.ch] if args.ch else []) + (["--ar", args.ar] if args.ar else [])
+        # server imports its modules relative to src folder
+        server = subprocess.Popen(command, cwd="../src/")
+        url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        client = InferenceClient(url)
+        stats = _wait_for_server(client, timeout=300)
+        event = args.event or next(iter(stats))
+
+        results = []
+        print(f"{'concurrency':>11} {'requests':>9} {'imgs/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'batch':>6}")
+        for concurrency in args.concurrency:
+            result = run_level(client, event, concurrency, args.duration)
+            results.append(result)
+            print(f"{concurrency:>11} {result['requests']:>9} {result['imgs_per_s']:>8.1f} {result['p50_ms']:>8.1f} "
+                  f"{result['p99_ms']:>8.1f} {result['mean_batch_size']:>6.2f}")
+            if result["errors"]:
+                print(f"errors: {result['errors']}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"url": url, "event": event, "max_batch_size": args.max_batch_size,
+                       "max_latency_ms": args.max_latency_ms, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.append('../src/')
+
+import disk_geometry
+
+"""
+Synthetic SOHO-like data for benchmarks, so they run without network and real EIT images. Everything is generated
+from fixed seeds, the same arguments give the same images on every machine.
+
+    sun_image()     - grayscale image of Sun's disk with limb darkening, dark coronal holes, bright active regions and noise
+    event_mask()    - mask of coronal holes or active regions of sun_image() with the same seed
+    make_archive()  - directory tree like data/imgs/ with dated filenames (YYYYMMDD_HHMM_eit195_1024.jpg, ...)
+"""
+
+START_DATE = datetime.date(1996, 1, 1)
+
+
+def _regions(seed, n_holes=3, n_active=6):
+    rng = np.random.default_rng(seed)
+    # (x, y, radius) relative to disk radius, x and y in (-0.7; 0.7)
+    holes = np.column_stack([rng.uniform(-0.7, 0.7, (n_holes, 2)), rng.uniform(0.08, 0.25, n_holes)])
+    active = np.column_stack([rng.uniform(-0.7, 0.7, (n_active, 2)), rng.uniform(0.03, 0.08, n_active)])
+    return holes, active
+
+
+def _region_mask(xx, yy, regions):
+    mask = np.zeros(xx.shape, dtype=bool)
+    for x, y, radius in regions:
+        mask |= (xx - x) ** 2 + (yy - y) ** 2 < radius ** 2
+    return mask
+
+
+def _grid(size, radius):
+    coords = (np.arange(size) - size / 2 + 0.5) / radius
+    return np.meshgrid(coords, coords)
+
+
+def sun_image(size=1024, date=START_DATE, seed=0, noise=6.0):
+    """
+    Grayscale image of Sun's disk, radius of disk follows Sun's distance on date like in real images.
+    :param int size: size of image
+    :param datetime.date date: date of image
+    :param int seed: seed of regions and noise
+    :param float noise: standard deviation of gaussian noise
+    :return numpy.array: uint8 array of shape (size, size)
+    """
+    radius = disk_geometry.disk_radius(date, size)
+    xx, yy = _grid(size, radius)
+    r2 = xx ** 2 + yy ** 2
+    disk = r2 < 1
+
+    # limb darkening, brighter corona ring just above limb
+    mu = np.sqrt(np.clip(1 - r2, 0, 1))
+    img = np.where(disk, 70 + 80 * mu, 25 * np.exp(-np.clip(np.sqrt(r2) - 1, 0, None) * 8))
+
+    holes, active = _regions(seed)
+    img[_region_mask(xx, yy, holes) & disk] *= 0.3
+    img[_region_mask(xx, yy, active) & disk] = 235
+
+    img += np.random.default_rng(seed + 1).normal(0, noise, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def event_mask(size=256, date=START_DATE, seed=0, event="CH"):
+    """
+    Ground truth mask of sun_image() with the same date and seed.
+    :param int size: size of mask
+    :param datetime.date date: date of image
+    :param int seed: seed of regions
+    :param str event: "CH" (coronal holes) or "AR" (active regions)
+    :return numpy.array: uint8 array of shape (size, size) with values 0 and 255
+    """
+    radius = disk_geometry.disk_radius(date, size)
+    xx, yy = _grid(size, radius)
+    holes, active = _regions(seed)
+    mask = _region_mask(xx, yy, holes if event == "CH" else active) & (xx ** 2 + yy ** 2 < 1)
+    return mask.astype(np.uint8) * 255
+
+
+def dates(n_dates, start=START_DATE, step_days=1):
+    """
+    :param int n_dates: number of dates
+    :param datetime.date start: first date
+    :param int step_days: days between dates
+    :return list: list of datetime.date
+    """
+    return [start + datetime.timedelta(days=i * step_days) for i in range(n_dates)]
+
+
+def filename(date, wavelength=195, extension=".jpg", time_of_day="0113"):
+    """
+    :return str: filename in format of archive, eg. 20020131_0113_eit195_1024.jpg
+    """
+    return f"{date:%Y%m%d}_{time_of_day}_eit{wavelength}_1024{extension}"
+
+
+def make_archive(root, n_dates=9000, n_images=0, size=1024, start=START_DATE, seed=0):
+    """
+    Creates directory tree of image archives used by webapp (uncropped 195A, cropped 195A and 171A images).
+    Only first n_images dates get real images, other files are empty, so lookups over thousands of dated filenames
+    can be measured without generating gigabytes of images.
+    :param str root: root folder
+    :param int n_dates: number of dates in every archive
+    :param int n_images: number of dates with real images
+    :param int size: size of real images
+    :param datetime.date start: first date
+    :param int seed: seed of images
+    :return dict: (event, cropped) -> (directory, extension), the same structure as image_catalog.ARCHIVES
+    """
+    archives = {
+        ("CH", False): (os.path.join(root, "imgs_195_96-21") + "/", ".jpg", 195),
+        ("CH", True): (os.path.join(root, "imgs_195_cropped_96-21") + "/", ".png", 195),
+        ("AR", False): (os.path.join(root, "imgs_171_96-21") + "/", ".png", 171),
+    }
+    for directory, extension, wavelength in archives.values():
+        os.makedirs(directory, exist_ok=True)
+        for i, date in enumerate(dates(n_dates, start)):
+            path = os.path.join(directory, filename(date, wavelength, extension))
+            if os.path.exists(path):
+                continue
+            if i < n_images:
+                img = Image.fromarray(sun_image(size, date, seed + i))
+                img.convert("RGB").save(path)
+            else:
+                open(path, "w").close()
+    return {key: (directory, extension) for key, (directory, extension, _) in archives.items()}
@@ -0,0 +1,108 @@
+import argparse
+import json
+import multiprocessing
+import sys
+
+import numpy as np
+
+sys.path.append('../src/')
+
+from bench_utils import measure, peak_memory_mb
+
+"""
+Compares latency and peak memory of 256 px inference with tiled inference on 1024 and 2048 px images.
+Every configuration runs in its own process, so peak memory of one configuration does not affect the others.
+Weights do not change latency or memory, so random weights are used when --weights is not provided.
+
+example (run from benchmarks folder):
+    python tiled_inference_benchmark.py --sizes 256 1024 2048 --tile-size 256 --overlap 64 --batch-size 8
+"""
+
+
+def _run_config(config, queue):
+    import tiled_inference
+    from model_scss_net import scss_net
+
+    size = config["size"]
+    image = np.random.rand(size, size, 1).astype(np.float32)
+    baseline_memory = peak_memory_mb()
+
+    if size == 256:
+        # current path of webapp, whole disk downscaled to 256 px
+        model = scss_net((256, 256, 1), filters=32, layers=4, batch_norm=True, drop_prob=0.5)
+        if config["weights"]:
+            model.load_weights(config["weights"])
+
+        def predict():
+            return model.predict_on_batch(image[None])
+    else:
+        tile_size = config["tile_size"]
+        if config["weights"]:
+            model = tiled_inference.build_tiled_model(config["weights"], tile_size)
+        else:
+            model = scss_net((tile_size, tile_size, 1), filters=32, layers=4, batch_norm=True, drop_prob=0.5)
+
+        def predict():
+            return tiled_inference.tiled_predict(model, image, tile_size, config["overlap"], config["batch_size"])
+
+    # first call builds graph, it is not counted
+    latency = measure(predict, config["repeats"])
+
+    queue.put({
+        **config,
+        "latency_median_s": latency["median_s"],
+        "latency_min_s": latency["min_s"],
+        "peak_memory_mb": peak_memory_mb(),
+        "baseline_memory_mb": baseline_memory,
+    })
+
+
+def run(sizes, tile_size=256, overlap=64, batch_size=8, repeats=5, weights=None):
+    """
+    Runs benchmark of every size in separate process.
+    :param list sizes: sizes of images, 256 means the current (not tiled) path
+    :param int tile_size: size of tile
+    :param int overlap: overlap of tiles
+    :param int batch_size: number of tiles in one predict call
+    :param int repeats: number of measured runs
+    :param str weights: optional path to .h5 weights
+    :return list: results as list of dicts
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in sizes:
+        config = {"size": size, "tile_size": tile_size, "overlap": overlap, "batch_size": batch_size,
+                  "repeats": repeats, "weights": weights}
+        queue = context.Queue()
+        process = context.Process(target=_run_config, args=(config, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and memory of 256 px vs tiled SCSS-Net inference")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1024, 2048])
+    parser.add_argument("--tile-size", type=int, default=256)
+    parser.add_argument("--overlap", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--weights", default=None)
+    parser.add_argument("--output", default=None, help="json file to save results")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.tile_size, args.overlap, args.batch_size, args.repeats, args.weights)
+
+    print(f"{'size':>6} {'median [s]':>12} {'min [s]':>10} {'peak mem [MB]':>14}")
+    for result in results:
+        print(f"{result['size']:>6} {result['latency_median_s']:>12.3f} {result['latency_min_s']:>10.3f} "
+              f"{result['peak_memory_mb']:>14.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
 import numpy as np
-import ephem
 from datetime import datetime
 import pandas as pd
-from scipy.interpolate import interp1d
-from PIL import Image, ImageDraw
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+from concurrent.futures import ProcessPoolExecutor
 import glob
+import os
+import sys
+import time
 from tqdm.notebook import tqdm, trange
 
+sys.path.append('../src/')
 
-def crop_and_save(path, path_to_save, base_margin_top, base_margin_right, base_margin_bottom, base_margin_left):
+import disk_geometry
+from disk_geometry import FIRST_DATE, LAST_DATE
+from prep_utils import apply_limb_mask, disk_mask
+
+
+def crop_and_save(path, path_to_save, base_margin_top, base_margin_right, base_margin_bottom, base_margin_left, workers=None,
+                  overwrite=False):
     """this is main function for croping sun's disk on EIT 195A images. Size of sun's disk is different troughtout year,
     because distance between SOHO and sun is different all around year.
 
@@ -20,7 +30,8 @@ def crop_and_save(path, path_to_save, base_margin_top, base_margin_right, base_m
     
     Thirdly we use get_mask_margin() and get margins on how big sun's disk is and how big our pieclise in white foreground should be.
 
-    Lastly we use crop_sun() that crops sun and saves that cropped sun to file
+    Lastly we use crop_sun() that crops sun and saves that cropped sun to file. Images are cropped in parallel in process pool,
+    images which were already cropped with the same margins are skipped.
 
     Args:
         path (string): path to folder where are images of sun for one whole year (or more years, it does not really matter)
@@ -34,6 +45,10 @@ def crop_and_save(path, path_to_save, base_margin_top, base_margin_right, base_m
         base_margin_bottom (int): base margin is number of pixels from top bottom of image to the bottom edge of sun disk on first image of the year
 
         base_margin_left (int): base margin is number of pixels from left end of image to the left edge of sun disk on first image of the year
+
+        workers (int, optional): number of processes. Defaults to None (number of CPU cores).
+
+        overwrite (bool, optional): crop all images again, even if they are up to date. Defaults to False.
     """
 
     df = map(path, base_margin_top, base_margin_right, base_margin_bottom, base_margin_left)
@@ -41,16 +56,85 @@ def crop_and_save(path, path_to_save, base_margin_top, base_margin_right, base_m
     imgs_paths = glob.glob(path)
     imgs_paths = sorted(imgs_paths)
 
-    for original_img in tqdm(imgs_paths):
+    tasks = []
+    for original_img in imgs_paths:
         date = get_date(original_img)
 
         mt, mr, mb, ml = get_mask_margin(df, date)
 
-        crop_sun(original_img, path_to_save, mt, mr, mb, ml)
+        if overwrite or not is_up_to_date(original_img, path_to_save, mt, mr, mb, ml):
+            tasks.append((original_img, path_to_save, mt, mr, mb, ml))
+
+    print(f"{len(imgs_paths) - len(tasks)} images are up to date, cropping {len(tasks)} images")
+
+    start = time.perf_counter()
+    # images are sorted by date, so neighbouring images in one chunk share margins and therefore also mask
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for _ in tqdm(executor.map(_crop_sun_task, tasks, chunksize=32), total=len(tasks)):
+            pass
+    elapsed = time.perf_counter() - start
+
+    if tasks:
+        print(f"cropped {len(tasks)} images in {elapsed:.1f} s ({len(tasks) / elapsed:.1f} images/s)")
+
+
+def _crop_sun_task(task):
+    crop_sun(*task)
+
+
+def get_save_path(image_name, save_path):
+    """get path where cropped image is saved
+
+    Args:
+        image_name (string): path to original image
+
+        save_path (string): path to folder where cropped images are saved
+
+    Returns:
+        string: path to cropped png image
+    """
+    image_name_clean = image_name[-29:]
+    return save_path + image_name_clean[:len(image_name_clean) - 3] + "png"
+
+
+def is_up_to_date(image_name, save_path, mask_top, mask_right, mask_bottom, mask_left):
+    """check if cropped image exists, is newer than original image and was cropped with same margins.
+    Margins are stored in png metadata by crop_sun(), so images are cropped again after margin calibration change.
+
+    Args:
+        image_name (string): path to original image
+
+        save_path (string): path to folder where cropped images are saved
+
+        mask_top (int): margin of pieslice from top
+
+        mask_right (int): margin of pieslice from right
+
+        mask_bottom (int): margin of pieslice from bottom
+
+        mask_left (int): margin of pieslice from left
+
+    Returns:
+        bool: True if image does not have to be cropped again
+    """
+    download_path = get_save_path(image_name, save_path)
+    try:
+        if os.path.getmtime(download_path) < os.path.getmtime(image_name):
+            return False
+        # only header is read, text chunks are before image data
+        with Image.open(download_path) as cropped:
+            return cropped.info.get("margins") == _margins_text(mask_top, mask_right, mask_bottom, mask_left)
+    except OSError:
+        return False
+
+
+def _margins_text(mask_top, mask_right, mask_bottom, mask_left):
+    return f"{mask_top},{mask_right},{mask_bottom},{mask_left}"
 
 
 def get_mask_margin(dataframe, date):
-    """get margins for pieslice in crop_sun() from dataframe, which comes from map()
+    """get margins for pieslice in crop_sun() from dataframe, which comes from map() or margin_table().
+    Dataframe is indexed by date, so lookup does not depend on number of rows.
 
     Args:
         dataframe (pandas.Dataframe): dataframe contains margins for each day in year
@@ -61,34 +145,27 @@ def get_mask_margin(dataframe, date):
         int: margin_top, margin_right, margin_bottom, margin_left 
     """
 
-    margin_top = 0.0
-    margin_right = 0.0
-    margin_bottom = 0.0
-    margin_left = 0.0
-
-    for i in range(dataframe.shape[0]):
-        if dataframe.time[i] == date:
+    if date not in dataframe.index:
+        return 0, 0, 0, 0
 
-            margin_top = dataframe.mask_top[i]
-            margin_right = dataframe.mask_right[i]
-            margin_bottom = dataframe.mask_bottom[i]
-            margin_left = dataframe.mask_left[i]
+    row = dataframe.loc[date]
 
-    margin_top = int(margin_top)
-    margin_right = int(margin_right)
-    margin_bottom = int(margin_bottom)
-    margin_left = int(margin_left)
+    margin_top = int(row.mask_top)
+    margin_right = int(row.mask_right)
+    margin_bottom = int(row.mask_bottom)
+    margin_left = int(row.mask_left)
 
     return margin_top, margin_right, margin_bottom, margin_left
 
 
-def map(path, base_margin_top, base_margin_right, base_margin_bottom, base_margin_left):
-    """ size of sun's disk is different troughtout year, because distance between SOHO and sun is different all around year.
-    We have to map those distances to margins for pieslice in crop_sun()
+def margin_table(base_margin_top, base_margin_right, base_margin_bottom, base_margin_left, start=FIRST_DATE, end=LAST_DATE,
+                 path=None):
+    """computes sun's distance and margins for pieslice in crop_sun() for every day in range at once.
+    Distances come from table precomputed with ephem in disk_geometry, margins are interpolated for all days in one numpy call.
+    Calibrated growth of margins is disk_geometry.margin_growth(), disk_geometry.disk_radius() is fitted to the same
+    calibration, so disk of AR coverage is the disk of cropped CH images.
 
     Args:
-        path (string): path to folder that contains uncropped images of sundisk
-
         base_margin_top (int): base margin is number of pixels from top end of image to the top edge of sun disk on first image of the year
 
         base_margin_right (int): base margin is number of pixels from right end of image to the right edge of sun disk on first image of the year
@@ -97,69 +174,84 @@ def map(path, base_margin_top, base_margin_right, base_margin_bottom, base_margi
 
         base_margin_left (int): base margin is number of pixels from left end of image to the left edge of sun disk on first image of the year
 
+        start (datetime.date, optional): first day of table. Defaults to 1996/01/01.
+
+        end (datetime.date, optional): last day of table. Defaults to 2021/12/31.
+
+        path (string, optional): csv file where table is saved, if file exists and was made with the same base margins, start and end,
+            table is loaded from it, otherwise it is computed again and overwritten. Defaults to None (table is not saved).
+
     Returns:
-        pandas.Dataframe: dataframe, that contains info about mapped margins for each day in year. 
-        Dataframe has following colummns:
+        pandas.Dataframe: dataframe indexed by day in format %Y/%m/%d with colummns:
 
-        day | margin_top | margin_right | margint_bottom | margin_left
+        time | distance | mask_top | mask_right | mask_bottom | mask_left
     """
-    time = []
-    earthsun = []
+    # parameters are saved in first line of csv, table of other parameters is not reused
+    params = f"# margins={_margins_text(base_margin_top, base_margin_right, base_margin_bottom, base_margin_left)} " \
+             f"start={start:%Y-%m-%d} end={end:%Y-%m-%d}"
+    if path is not None and os.path.exists(path):
+        with open(path) as f:
+            if f.readline().strip() == params:
+                return pd.read_csv(f, index_col=0)
 
-    imgs_paths = glob.glob(path)
+    days = pd.date_range(start, end, freq="D").strftime("%Y/%m/%d")
+    earthsun = disk_geometry.distances(start, end)
+
+    df = pd.DataFrame({"time": days, "distance": earthsun}, index=days)
+
+    growth = disk_geometry.margin_growth(earthsun)
+    for column, base_margin in [("mask_top", base_margin_top), ("mask_right", base_margin_right),
+                                ("mask_bottom", base_margin_bottom), ("mask_left", base_margin_left)]:
+        df[column] = np.round(base_margin + growth, 4)
 
-    #length = len(path) - 29
+    if path is not None:
+        with open(path, "w", newline="") as f:
+            f.write(params + "\n")
+            df.to_csv(f)
 
-    for img in imgs_paths:
-        date = get_date(img)
-        time.append(date)
+    return df
 
-    time.sort(key=lambda date: datetime.strptime(date, "%Y/%m/%d"))
 
-    sun = ephem.Sun()
+def map(path, base_margin_top, base_margin_right, base_margin_bottom, base_margin_left):
+    """ size of sun's disk is different troughtout year, because distance between SOHO and sun is different all around year.
+    We have to map those distances to margins for pieslice in crop_sun()
+
+    Args:
+        path (string): path to folder that contains uncropped images of sundisk
+
+        base_margin_top (int): base margin is number of pixels from top end of image to the top edge of sun disk on first image of the year
 
-    # find sun to earth distance
-    for thetime in time:
-        sun.compute(ephem.Date(thetime))
-        earthsun.append(sun.earth_distance)
+        base_margin_right (int): base margin is number of pixels from right end of image to the right edge of sun disk on first image of the year
 
-    time_distance = list(zip(time, earthsun))
-    df_distances = pd.DataFrame(time_distance, columns=['time', 'distance'])
+        base_margin_bottom (int): base margin is number of pixels from top bottom of image to the bottom edge of sun disk on first image of the year
 
-    m_top = interp1d([0.9831, 1.0168], [base_margin_top, base_margin_top + 14])
-    m_right = interp1d([0.9831, 1.0168], [base_margin_right, base_margin_right + 14])
-    m_bottom = interp1d([0.9831, 1.0168], [base_margin_bottom, base_margin_bottom + 14])
-    m_left = interp1d([0.9831, 1.0168], [base_margin_left, base_margin_left + 14])
+        base_margin_left (int): base margin is number of pixels from left end of image to the left edge of sun disk on first image of the year
 
-    namapovane_top_arr = []
-    namapovane_right_arr = []
-    namapovane_bottom_arr = []
-    namapovane_left_arr = []
+    Returns:
+        pandas.Dataframe: dataframe indexed by day, that contains info about mapped margins for each day of images. 
+        Dataframe has following colummns:
 
+        time | distance | mask_top | mask_right | mask_bottom | mask_left
+    """
+    imgs_paths = glob.glob(path)
 
-    for item in df_distances.distance:
-        namapovane_top = float(m_top(item))
-        namapovane_right = float(m_right(item))
-        namapovane_bottom = float(m_bottom(item))
-        namapovane_left = float(m_left(item))
+    dates = sorted({get_date(img) for img in imgs_paths})
+    if not dates:
+        return margin_table(base_margin_top, base_margin_right, base_margin_bottom, base_margin_left).iloc[:0]
 
-        namapovane_top_arr.append(round(namapovane_top, 4))
-        namapovane_right_arr.append(round(namapovane_right, 4))
-        namapovane_bottom_arr.append(round(namapovane_bottom, 4))
-        namapovane_left_arr.append(round(namapovane_left, 4))
+    start = datetime.strptime(dates[0], "%Y/%m/%d").date()
+    end = datetime.strptime(dates[-1], "%Y/%m/%d").date()
 
-    df_distances["mask_top"] = namapovane_top_arr
-    df_distances["mask_right"] = namapovane_right_arr
-    df_distances["mask_bottom"] = namapovane_bottom_arr
-    df_distances["mask_left"] = namapovane_left_arr
+    df = margin_table(base_margin_top, base_margin_right, base_margin_bottom, base_margin_left, start, end)
 
-    return df_distances
+    return df.loc[dates]
 
 
 # save path musi koncit na /.
 def crop_sun(image_name, save_path, mask_top, mask_right, mask_bottom, mask_left):
     """creates white background on image. This preprocesing is needed for 195A images to semgent coronal holes.
-    White "background" is created by putting white color in front sun's disk image and draw transparent pieslice on it with suns size.
+    White "background" is created by putting white color on pixels out of pieslice with suns size.
+    Mask of sun's disk comes from cache in prep_utils, so it is created only once for all images with the same margins.
 
     Args:
         image_name (string): path to image
@@ -174,22 +266,19 @@ def crop_sun(image_name, save_path, mask_top, mask_right, mask_bottom, mask_left
 
         mask_left (int): margin of pieslice from left
     """
-    img = Image.open(image_name)
-    h, w = img.size
+    img = np.array(Image.open(image_name).convert("RGBA"))
+    h, w = img.shape[:2]
 
-    # creating mask
-    mask = Image.new('L', [h, w], 0)
-    draw = ImageDraw.Draw(mask)
-    draw.pieslice([mask_left, mask_top, w - mask_right, w - mask_bottom], 0, 360, fill=255)
+    mask = disk_mask((w, h), (mask_left, mask_top, w - mask_right, h - mask_bottom))
 
-    # white foreground
-    white_bg = Image.new("RGBA", [h, w], "WHITE")
+    # white foreground out of sun's disk
+    apply_limb_mask(img, mask, 255)
 
-    image_name_clean = image_name[-29:]
-    download_path = save_path + image_name_clean[:len(image_name_clean) - 3] + "png"
+    # margins are saved to metadata, is_up_to_date() checks them
+    info = PngInfo()
+    info.add_text("margins", _margins_text(mask_top, mask_right, mask_bottom, mask_left))
 
-    # glue original image, white_background, and transparent mask togheter
-    Image.composite(img, white_bg, mask).save(download_path)
+    Image.fromarray(img, "RGBA").save(get_save_path(image_name, save_path), pnginfo=info)
 
 
 def get_date(path):
@@ -202,5 +291,5 @@ def get_date(path):
         string: string in format %Y/%m/%d
     """
     date_str = path.split("/")[-1].split("_")[0]
-    dt = datetime.datetime.strptime(date_str, "%Y%m%d")
+    dt = datetime.strptime(date_str, "%Y%m%d")
     return dt.strftime("%Y/%m/%d")
@@ -0,0 +1,423 @@
+import argparse
+import datetime
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+"""
+Batched and cached download of SPoCA annotations from HEK (Heliophysics Event Knowledgebase), replaces per-image
+Fido.search() of extractHEK.ipynb.
+
+HEK is queried once per fixed time window (eg. 30 days) instead of once per image, windows are downloaded in thread pool
+with bounded number of concurrent requests and raw responses are saved to local cache, so rerun does not touch network.
+Events of image are selected from its window by time, chain codes of whole window are parsed at once with numpy and
+masks are rasterized directly at target resolution.
+
+Cache folder is also set of recorded fixtures: with offline=True missing window raises error instead of request, and
+base_url can point to local stand-in server with the same API.
+
+example (run from preprocesing folder):
+    python hek_annotations.py --event AR --images "../data/imgs/imgs_171_96-21/*.png" --output ../data/ar_spoca/
+"""
+
+HEK_URL = "https://www.lmsal.com/hek/her"
+CACHE_DIR = "../data/cache/hek/"
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# SPoCA coordinates are in arcsec from center of Sun's disk, 1 arcsec is 1 pixel of 2656x2656 image
+REFERENCE_SIZE = 2656
+REFERENCE_CENTER = 1328
+# width of polygon outline drawn at REFERENCE_SIZE in extractHEK.ipynb
+REFERENCE_OUTLINE = 5
+
+WINDOW_EPOCH = datetime.datetime(1996, 1, 1)
+
+
+def image_time(path):
+    """gets time of observation from filename, example: 20020131_0113_eit195_1024.jpg
+
+    Args:
+        path (string): path to image
+
+    Returns:
+        datetime.datetime: time of observation
+    """
+    name = os.path.basename(path)
+    return datetime.datetime.strptime(name[:13], "%Y%m%d_%H%M")
+
+
+def window_of(observed, window_days=30):
+    """windows are aligned to WINDOW_EPOCH, so the same time is always in the same window and cached windows are reused
+    by runs over different images
+
+    Args:
+        observed (datetime.datetime): time of observation
+
+        window_days (int, optional): length of window. Defaults to 30.
+
+    Returns:
+        tuple: (start, end) of window containing time of observation
+    """
+    index = (observed - WINDOW_EPOCH) // datetime.timedelta(days=window_days)
+    start = WINDOW_EPOCH + index * datetime.timedelta(days=window_days)
+    return start, start + datetime.timedelta(days=window_days)
+
+
+def parse_chaincodes(chaincodes):
+    """parses "POLYGON((x y,x y,...))" strings of many events at once, all numbers are converted by one numpy call
+
+    Args:
+        chaincodes (list): bound_chaincode strings, empty strings are allowed
+
+    Returns:
+        list: for every chain code float32 array of shape (n_points, 2) with x and y in arcsec, empty array for empty
+        or malformed string
+    """
+    if not chaincodes:
+        return []
+
+    counts = []
+    values = []
+    for chaincode in chaincodes:
+        start = chaincode.find("((")
+        body = chaincode[start + 2:chaincode.rfind("))")] if start >= 0 else ""
+        count = body.count(",") + 1 if body.strip() else 0
+        event_values = body.replace(",", " ").split()
+        # point without both coordinates (eg. trailing comma) would shift points of all following events
+        if len(event_values) != 2 * count:
+            print(f"skipping malformed chain code {chaincode[:60]!r}")
+            count, event_values = 0, []
+        counts.append(count)
+        values.extend(event_values)
+
+    points = np.array(values, dtype=np.float32).reshape(-1, 2)
+    return np.split(points, np.cumsum(counts)[:-1])
+
+
+def to_pixels(points, size):
+    """converts arcsec coordinates to pixels of image of provided size, the same mapping as get_coords() in extractHEK.ipynb
+    followed by resize from 2656 px
+
+    Args:
+        points (numpy.array): array of shape (n_points, 2) from parse_chaincodes()
+
+        size (int): width (and height) of image
+
+    Returns:
+        numpy.array: float32 array of shape (n_points, 2)
+    """
+    scale = size / REFERENCE_SIZE
+    pixels = np.empty_like(points)
+    pixels[:, 0] = (REFERENCE_CENTER + points[:, 0]) * scale
+    pixels[:, 1] = (REFERENCE_CENTER - points[:, 1]) * scale
+    return pixels
+
+
+def rasterize(polygons, size=1024):
+    """draws filled polygons directly at target resolution
+
+    Args:
+        polygons (list): arrays of arcsec coordinates from parse_chaincodes()
+
+        size (int, optional): width (and height) of mask. Defaults to 1024.
+
+    Returns:
+        Image: black and white mask of mode "L"
+    """
+    img = Image.new("L", (size, size), color=0)
+    draw = ImageDraw.Draw(img)
+    width = max(1, round(REFERENCE_OUTLINE * size / REFERENCE_SIZE))
+    for polygon in polygons:
+        if len(polygon) < 2:
+            continue
+        draw.polygon(to_pixels(polygon, size).ravel().tolist(), outline=255, width=width, fill=255)
+    return img
+
+
+class HEKClient:
+    """client of HEK search API with cache of raw responses. Every window is one gzipped json file with all pages
+    of response, file is written only when all pages are downloaded, so interrupted download is repeated.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, base_url=HEK_URL, offline=False, max_concurrency=4, timeout=60.0, retries=3,
+                 result_limit=500):
+        """
+        Args:
+            cache_dir (string, optional): folder of cached responses. Defaults to CACHE_DIR.
+
+            base_url (string, optional): url of HEK search API or of local stand-in server. Defaults to HEK_URL.
+
+            offline (bool, optional): only cached responses are used, missing window raises LookupError. Defaults to False.
+
+            max_concurrency (int, optional): maximal number of concurrent requests. Defaults to 4.
+
+            timeout (float, optional): timeout of one request in seconds. Defaults to 60.0.
+
+            retries (int, optional): number of attempts of one request. Defaults to 3.
+
+            result_limit (int, optional): number of events in one page of response. Defaults to 500.
+        """
+        self.cache_dir = cache_dir
+        self.base_url = base_url
+        self.offline = offline
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.result_limit = result_limit
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def cache_path(self, event, start, end):
+        """
+        Args:
+            event (string): "CH" or "AR"
+
+            start (datetime.datetime): start of window
+
+            end (datetime.datetime): end of window
+
+        Returns:
+            string: path to cached response of window
+        """
+        return os.path.join(self.cache_dir, event, f"{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.json.gz")
+
+    def query_params(self, event, start, end, page):
+        """
+        Args:
+            event (string): "CH" or "AR"
+
+            start (datetime.datetime): start of window
+
+            end (datetime.datetime): end of window
+
+            page (int): page of response, starts at 1
+
+        Returns:
+            dict: parameters of HEK search request, the same request as sunpy's HEK client makes for a.Time and a.hek.EventType
+        """
+        return {
+            "cosec": 2,
+            "cmd": "search",
+            "type": "column",
+            "event_type": event,
+            "event_starttime": start.strftime(TIME_FORMAT),
+            "event_endtime": end.strftime(TIME_FORMAT),
+            "event_coordsys": "helioprojective",
+            "x1": -5000, "x2": 5000, "y1": -5000, "y2": 5000,
+            "result_limit": self.result_limit,
+            "page": page,
+            "return": "event_starttime,event_endtime,bound_chaincode,frm_name",
+        }
+
+    def _get(self, params):
+        url = f"{self.base_url}?{urllib.parse.urlencode(params)}"
+        for attempt in range(self.retries):
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    body = response.read()
+                with self._lock:
+                    self.requests += 1
+                return json.loads(body)
+            except (urllib.error.URLError, OSError, ValueError):
+                if attempt == self.retries - 1:
+                    raise
+                # HEK is often overloaded, next attempt waits longer
+                time.sleep(2 ** attempt)
+
+    def fetch_window(self, event, start, end):
+        """returns raw response of window, from cache or from HEK
+
+        Args:
+            event (string): "CH" or "AR"
+
+            start (datetime.datetime): start of window
+
+            end (datetime.datetime): end of window
+
+        Returns:
+            list: pages of response, every page is dict with "result" list of events
+        """
+        path = self.cache_path(event, start, end)
+        if os.path.exists(path):
+            with gzip.open(path, "rt") as f:
+                return json.load(f)
+        if self.offline:
+            raise LookupError(f"window {start} - {end} of {event} is not in cache {self.cache_dir}")
+
+        pages = []
+        page = 1
+        while True:
+            response = self._get(self.query_params(event, start, end, page))
+            pages.append(response)
+            # HEK sets overmax when more events match than one page holds
+            if not response.get("overmax") or not response.get("result"):
+                break
+            page += 1
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt") as f:
+            json.dump(pages, f)
+        os.replace(tmp_path, path)
+        return pages
+
+    def fetch_windows(self, event, windows):
+        """fetches windows in thread pool, at most max_concurrency requests run at once
+
+        Args:
+            event (string): "CH" or "AR"
+
+            windows (list): list of (start, end)
+
+        Returns:
+            dict: (start, end) -> EventTable of window
+        """
+        windows = sorted(set(windows))
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            responses = executor.map(lambda window: self.fetch_window(event, *window), windows)
+            return {window: EventTable.from_pages(pages) for window, pages in zip(windows, responses)}
+
+
+class EventTable:
+    """events of one window as columns, polygons of all events are parsed at once
+    """
+
+    def __init__(self, starts, ends, polygons, frm_names):
+        """
+        Args:
+            starts (numpy.array): datetime64 start times of events
+
+            ends (numpy.array): datetime64 end times of events
+
+            polygons (list): arrays of arcsec coordinates from parse_chaincodes()
+
+            frm_names (numpy.array): names of feature recognition methods
+        """
+        self.starts = starts
+        self.ends = ends
+        self.polygons = polygons
+        self.frm_names = frm_names
+
+    @classmethod
+    def from_pages(cls, pages):
+        """
+        Args:
+            pages (list): raw response from HEKClient.fetch_window()
+
+        Returns:
+            EventTable: events with non empty chain code, duplicates from more pages are removed
+        """
+        rows = {}
+        for page in pages:
+            for row in page.get("result", []):
+                if row.get("bound_chaincode"):
+                    key = (row["event_starttime"], row["event_endtime"], row["bound_chaincode"])
+                    rows[key] = row
+        rows = list(rows.values())
+        return cls(
+            np.array([row["event_starttime"] for row in rows], dtype="datetime64[s]"),
+            np.array([row["event_endtime"] for row in rows], dtype="datetime64[s]"),
+            parse_chaincodes([row["bound_chaincode"] for row in rows]),
+            np.array([row.get("frm_name", "") for row in rows]),
+        )
+
+    def at(self, observed, frm_name=None):
+        """polygons of events that last at time of observation, like Fido.search(a.Time(t, t), ...)
+
+        Args:
+            observed (datetime.datetime): time of observation
+
+            frm_name (string, optional): only events of this feature recognition method, eg. "SPoCA". Defaults to None.
+
+        Returns:
+            list: arrays of arcsec coordinates
+        """
+        moment = np.datetime64(observed, "s")
+        selected = (self.starts <= moment) & (self.ends >= moment)
+        if frm_name is not None:
+            selected &= self.frm_names == frm_name
+        return [self.polygons[i] for i in np.flatnonzero(selected)]
+
+
+def make_masks(paths, save_path, event, size=1024, window_days=30, frm_name=None, client=None, overwrite=False):
+    """finds annotations of all images and saves black and white masks of event, images without annotation are skipped
+    like in make_spoca_imgs() of extractHEK.ipynb
+
+    Args:
+        paths (list): paths to images, filenames start with time of observation
+
+        save_path (string): folder where masks are saved as png with the same name as image
+
+        event (string): "CH" for coronal holes or "AR" for active regions
+
+        size (int, optional): size of masks. Defaults to 1024.
+
+        window_days (int, optional): length of one HEK query. Defaults to 30.
+
+        frm_name (string, optional): only events of this feature recognition method, eg. "SPoCA". Defaults to None (all).
+
+        client (HEKClient, optional): client of HEK. Defaults to None (HEKClient with default cache).
+
+        overwrite (bool, optional): create masks which already exist again. Defaults to False.
+
+    Returns:
+        int: number of saved masks
+    """
+    client = HEKClient() if client is None else client
+    os.makedirs(save_path, exist_ok=True)
+
+    tasks = []
+    for path in sorted(paths):
+        mask_path = os.path.join(save_path, os.path.splitext(os.path.basename(path))[0] + ".png")
+        if overwrite or not os.path.exists(mask_path):
+            tasks.append((image_time(path), mask_path))
+
+    start = time.perf_counter()
+    tables = client.fetch_windows(event, [window_of(observed, window_days) for observed, _ in tasks])
+    print(f"{len(tables)} windows of {event} annotations ready in {time.perf_counter() - start:.1f} s, "
+          f"{client.requests} requests sent to HEK")
+
+    saved = 0
+    for observed, mask_path in tasks:
+        polygons = tables[window_of(observed, window_days)].at(observed, frm_name)
+        if not polygons:
+            continue
+        rasterize(polygons, size).save(mask_path)
+        saved += 1
+
+    print(f"{saved} masks of {len(tasks)} images saved to {save_path}")
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Masks of SPoCA annotations from HEK")
+    parser.add_argument("--event", choices=["CH", "AR"], required=True)
+    parser.add_argument("--images", required=True, help='glob pattern of images, eg. "../data/imgs/imgs_171_96-21/*.png"')
+    parser.add_argument("--output", required=True, help="folder of masks")
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--window-days", type=int, default=30)
+    parser.add_argument("--frm-name", default=None, help='only events of this method, eg. "SPoCA"')
+    parser.add_argument("--cache", default=CACHE_DIR, help="folder of cached HEK responses")
+    parser.add_argument("--url", default=HEK_URL, help="HEK search API or local stand-in server")
+    parser.add_argument("--offline", action="store_true", help="use only cached responses")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximal number of concurrent requests")
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    client = HEKClient(args.cache, args.url, args.offline, args.concurrency)
+    make_masks(glob.glob(args.images), args.output, args.event, args.size, args.window_days, args.frm_name, client,
+               args.overwrite)
+
+
+if __name__ == "__main__":
+    main()
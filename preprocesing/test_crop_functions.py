@@ -0,0 +1,45 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import disk_geometry
+from crop_functions import margin_table
+
+"""
+Cropped disk of CH images (margin_table()) and disk of AR coverage (disk_geometry) must be the same disk.
+
+run from preprocesing folder:
+    python -m pytest test_crop_functions.py
+"""
+
+BASE_MARGINS = (132, 142, 143, 132)
+SIZE = 1024
+
+
+def test_crop_disk_agrees_with_disk_geometry():
+    table = margin_table(*BASE_MARGINS)
+    dates = [datetime.date(1996, 1, 1) + datetime.timedelta(days=i) for i in range(len(table))]
+
+    radius_x = (SIZE - table.mask_left - table.mask_right).to_numpy() / 2
+    radius_y = (SIZE - table.mask_top - table.mask_bottom).to_numpy() / 2
+    expected = np.array([disk_geometry.disk_radius(date, SIZE) for date in dates])
+
+    # base margins give box 750 x 749 px, REFERENCE_RADIUS is its mean radius
+    assert np.abs(radius_x - expected).max() <= 0.25 + 1e-3
+    assert np.abs(radius_y - expected).max() <= 0.25 + 1e-3
+    # coverage of CH and AR is divided by areas which differ less than 0.1 %
+    assert np.abs(radius_x * radius_y / expected ** 2 - 1).max() < 1e-3
+
+
+def test_margins_keep_calibration():
+    table = margin_table(*BASE_MARGINS, start=datetime.date(2012, 1, 1), end=datetime.date(2012, 12, 31))
+
+    perihelion, aphelion = table.distance.idxmin(), table.distance.idxmax()
+    for column, base in zip(["mask_top", "mask_right", "mask_bottom", "mask_left"], BASE_MARGINS):
+        assert abs(table.loc[perihelion, column] - base) < 0.1
+        # calibrated growth of margins is 14 px at 1.0168 AU
+        assert 13.5 < table.loc[aphelion, column] - base < 14
@@ -0,0 +1,118 @@
+import gzip
+import json
+import os
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from hek_annotations import HEKClient, make_masks, parse_chaincodes
+
+"""
+Tests of hek_annotations.py without access to HEK, on small window of AR annotations in format of HEK response
+(fixtures/hek/AR/, 2012-01-07 - 2012-02-06, two pages, one malformed chain code).
+
+run from preprocesing folder:
+    python -m pytest test_hek_annotations.py
+"""
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "hek")
+WINDOW = "20120107T000000_20120206T000000.json.gz"
+SIZE = 256
+IMAGES = ["20120126_0113_eit171_1024.png", "20120126_0800_eit171_1024.png", "20120129_0100_eit171_1024.png"]
+
+
+def pixel(x, y):
+    # arcsec to (row, column) of mask, see hek_annotations.to_pixels()
+    scale = SIZE / 2656
+    return int((1328 - y) * scale), int((1328 + x) * scale)
+
+
+def test_parse_chaincodes_drops_malformed():
+    polygons = parse_chaincodes(["POLYGON((1 2,3 4,))", "POLYGON((5 6,7 8))", "", "POLYGON((1 2 3,4 5))"])
+
+    assert [len(polygon) for polygon in polygons] == [0, 2, 0, 0]
+    np.testing.assert_array_equal(polygons[1], [[5, 6], [7, 8]])
+
+
+def check_masks(save_path):
+    assert sorted(os.listdir(save_path)) == ["20120126_0113_eit171_1024.png", "20120126_0800_eit171_1024.png"]
+
+    night = np.asarray(Image.open(os.path.join(save_path, "20120126_0113_eit171_1024.png")))
+    morning = np.asarray(Image.open(os.path.join(save_path, "20120126_0800_eit171_1024.png")))
+    # events lasting at time of observation
+    assert night[pixel(-300, 200)] == 255 and morning[pixel(-300, 200)] == 255
+    assert night[pixel(250, -350)] == 255 and morning[pixel(250, -350)] == 0
+    # malformed chain code is dropped and event of other method is filtered out
+    assert night[pixel(440, -70)] == 0
+    assert night[pixel(0, 0)] == 0
+
+
+def test_make_masks_offline(tmp_path):
+    client = HEKClient(FIXTURES, offline=True)
+
+    saved = make_masks(IMAGES, str(tmp_path), "AR", size=SIZE, frm_name="SPoCA", client=client)
+
+    assert saved == 2
+    assert client.requests == 0
+    check_masks(str(tmp_path))
+
+
+def test_make_masks_offline_missing_window(tmp_path):
+    client = HEKClient(FIXTURES, offline=True)
+
+    with pytest.raises(LookupError):
+        make_masks(["20130101_0000_eit171_1024.png"], str(tmp_path), "AR", size=SIZE, client=client)
+
+
+@pytest.fixture
+def stub_server():
+    # stand-in of HEK search API, serves pages of fixture window
+    with gzip.open(os.path.join(FIXTURES, "AR", WINDOW), "rt") as f:
+        pages = json.load(f)
+    queries = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+            queries.append(query)
+            body = json.dumps(pages[int(query["page"]) - 1]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/hek/her", queries
+    server.shutdown()
+    server.server_close()
+
+
+def test_make_masks_stub_server(tmp_path, stub_server):
+    url, queries = stub_server
+    cache_dir = str(tmp_path / "cache")
+    client = HEKClient(cache_dir, url)
+
+    saved = make_masks(IMAGES, str(tmp_path / "masks"), "AR", size=SIZE, frm_name="SPoCA", client=client)
+
+    assert saved == 2
+    # one window of two pages
+    assert client.requests == 2
+    assert [query["page"] for query in queries] == ["1", "2"]
+    assert queries[0]["event_type"] == "AR"
+    assert queries[0]["event_starttime"] == "2012-01-07T00:00:00"
+    check_masks(str(tmp_path / "masks"))
+
+    # downloaded window is cached, rerun does not touch server
+    offline = HEKClient(cache_dir, url, offline=True)
+    assert make_masks(IMAGES, str(tmp_path / "masks_cached"), "AR", size=SIZE, frm_name="SPoCA", client=offline) == 2
+    assert len(queries) == 2
@@ -0,0 +1,386 @@
+import argparse
+import csv
+import datetime
+import glob
+import json
+import multiprocessing
+import os
+
+import numpy as np
+from PIL import Image
+
+import disk_geometry
+import image_pyramid
+from export_model import weights_hash
+
+"""
+Command line batch inference of SCSS-Net over archive of images (eg. 1996 - 2021).
+
+Images are streamed through fixed-size batches, so memory does not grow with length of date range. Archive is split
+into chunks that are processed in a process pool, each worker builds the model only once. For every image mask, polygons
+and coverage are written immediately and every chunk has its own append-only progress file, so interrupted run
+continues where it stopped.
+
+example (run from src folder):
+    python batch_inference.py --event AR --images "../data/imgs/imgs_171_96-21/*.png" --weights ../modeling/ar_model.h5
+        --output ../data/predictions_ar/ --workers 4
+    python batch_inference.py --event AR --images "../data/imgs/imgs_171_96-21/*.png" --server-url http://127.0.0.1:8765
+        --output ../data/predictions_ar/ --workers 4
+"""
+
+IMG_SIZE = 256
+PROGRESS_FIELDS = ["name", "date", "area_coverage", "disk_area"]
+
+_model = None
+_options = None
+
+
+def get_date(path):
+    """
+    Get date from filename, example: 20020131_0113_eit195_1024.jpg
+    :param str path: path to image
+    :return datetime.date: date of image
+    """
+    return datetime.datetime.strptime(os.path.basename(path)[:8], "%Y%m%d").date()
+
+
+def list_images(pattern, start=None, end=None):
+    """
+    Lists images in date range sorted by date.
+    :param str pattern: glob pattern of images
+    :param datetime.date start: first date, if None all images from beginning
+    :param datetime.date end: last date, if None all images to end
+    :return list: sorted paths to images
+    """
+    paths = []
+    for path in sorted(glob.glob(pattern)):
+        date = get_date(path)
+        if (start is None or date >= start) and (end is None or date <= end):
+            paths.append(path)
+    return paths
+
+
+def iter_batches(paths, batch_size, img_size=IMG_SIZE, pyramid=image_pyramid.PYRAMID_DIR):
+    """
+    Generator of normalized image batches, one preallocated buffer is reused for all batches.
+    :param list paths: paths to images
+    :param int batch_size: size of batch
+    :param int img_size: images are resized to (img_size, img_size)
+    :param str pyramid: root folder of image pyramid, model inputs are read from it when they are up to date
+    :return: generator of (list of paths, numpy.array of shape (n, img_size, img_size, 1))
+    """
+    buffer = np.empty((batch_size, img_size, img_size, 1), dtype=np.float32)
+    for i in range(0, len(paths), batch_size):
+        batch_paths = paths[i:i + batch_size]
+        for j, path in enumerate(batch_paths):
+            img = image_pyramid.load_model_input(path, pyramid, img_size)
+            buffer[j, :, :, 0] = np.asarray(img, dtype=np.float32) / 255
+        yield batch_paths, buffer[:len(batch_paths)]
+
+
+def read_progress(output):
+    """
+    Reads names of already processed images from progress files.
+    :param str output: output folder of run
+    :return set: names of processed images
+    """
+    done = set()
+    for progress_file in glob.glob(os.path.join(output, "progress", "*.csv")):
+        with open(progress_file, newline="") as f:
+            for row in csv.DictReader(f):
+                done.add(row["name"])
+    return done
+
+
+class _RemoteModel:
+    # model of inference server (inference_server.py) with the same interface as local model
+
+    def __init__(self, url, event):
+        from inference_server import InferenceClient
+
+        self.client = InferenceClient(url)
+        self.event = event
+
+    def predict_on_batch(self, x):
+        return self.client.predict(self.event, x)
+
+
+def check_run(output, model_id):
+    """
+    Checks that results already in output folder were made with the same weights, so resumed run does not mix models.
+    :param str output: output folder of event
+    :param str model_id: identity of weights of this run, see export_model.weights_hash()
+    """
+    run_path = os.path.join(output, "run.json")
+    if os.path.exists(run_path):
+        with open(run_path) as f:
+            recorded = json.load(f).get("weights")
+        if recorded != model_id:
+            raise ValueError(f"{output} contains results of other weights ({recorded}), use new output folder")
+
+
+def record_run(output, event, model_id):
+    """
+    Writes run.json with identity of weights, segmentation_archive.import_batch_run() records it in archive.
+    :param str output: output folder of event
+    :param str event: "CH" or "AR"
+    :param str model_id: identity of weights, see export_model.weights_hash()
+    """
+    with open(os.path.join(output, "run.json"), "w") as f:
+        json.dump({"event": event, "weights": model_id}, f)
+
+
+def _init_worker(options):
+    global _model, _options
+
+    _options = options
+    if options["server_url"]:
+        # model runs in inference server, worker only decodes images and writes results
+        _model = _RemoteModel(options["server_url"], options["event"])
+        return
+
+    import tensorflow as tf
+    from export_model import load_model
+
+    if options["threads"]:
+        tf.config.threading.set_intra_op_parallelism_threads(options["threads"])
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    # .h5 weights or .tflite model exported with export_model.py
+    _model = load_model(options["weights"], num_threads=options["threads"])
+
+
+def _process_chunk(chunk):
+    chunk_id, paths = chunk
+    from utils import create_contours_batch
+
+    output = _options["output"]
+    progress_path = os.path.join(output, "progress", f"chunk_{chunk_id:05d}.csv")
+    new_file = not os.path.exists(progress_path)
+
+    with open(progress_path, "a", newline="") as progress:
+        writer = csv.DictWriter(progress, fieldnames=PROGRESS_FIELDS)
+        if new_file:
+            writer.writeheader()
+
+        for batch_paths, x in iter_batches(paths, _options["batch_size"], pyramid=_options["pyramid"]):
+            y_pred = np.asarray(_model.predict_on_batch(x))
+            batch_polygons = create_contours_batch(y_pred, _options["target_size"], threshold=_options["threshold"],
+                                                   approximation="simple", epsilon=_options["epsilon"])
+
+            for path, img, prediction, polygons in zip(batch_paths, x, y_pred, batch_polygons):
+                row = save_result(output, path, img, prediction, polygons, _options["threshold"], _options["cropped"])
+
+                if _options["overlay_src"]:
+                    _save_overlay(row["name"], polygons)
+
+                writer.writerow(row)
+
+            progress.flush()
+            os.fsync(progress.fileno())
+
+    return len(paths)
+
+
+def save_result(output, path, img, prediction, polygons, threshold=0.1, cropped=False):
+    """
+    Writes mask and polygons of one image to output folder and computes its coverage. Mask and polygons are written
+    before the row is added to progress file, so every image in progress file is complete.
+    :param str output: output folder of run
+    :param str path: path to segmented image
+    :param numpy.array img: normalized model input of shape (256, 256, 1)
+    :param numpy.array prediction: prediction of shape (256, 256, 1)
+    :param list polygons: contours of prediction
+    :param float threshold: probability threshold of mask
+    :param bool cropped: image has white background out of disk
+    :return dict: row of progress file
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    date = get_date(path)
+
+    mask = (prediction[:, :, 0] > threshold).astype(np.uint8) * 255
+    Image.fromarray(mask).save(os.path.join(output, "masks", name + ".png"))
+
+    with open(os.path.join(output, "polygons", name + ".json"), "w") as f:
+        json.dump([polygon.round(1).tolist() for polygon in polygons], f)
+
+    if cropped:
+        # white background of cropped image is everything out of Sun's disk
+        disk = int(np.count_nonzero(img < 0.95))
+    else:
+        disk = disk_geometry.disk_area(date, IMG_SIZE)
+    area_coverage = disk_geometry.area_coverage(prediction, disk, threshold=threshold)
+
+    return {"name": name, "date": date.isoformat(), "area_coverage": area_coverage, "disk_area": disk}
+
+
+def _save_overlay(name, polygons):
+    from utils import draw_contours
+
+    src = os.path.join(_options["overlay_src"], name + _options["overlay_ext"])
+    if _options["target_size"] == (image_pyramid.DISPLAY_SIZE, image_pyramid.DISPLAY_SIZE):
+        img = image_pyramid.open_display(src, _options["pyramid"]).convert("RGB")
+    else:
+        img = Image.open(src).convert("RGB").resize(_options["target_size"])
+    draw_contours(img, polygons, outline="red", width=4)
+    img.save(os.path.join(_options["output"], "overlays", name + ".jpg"))
+
+
+def merge_progress(output):
+    """
+    Merges progress files of all chunks to one coverage.csv sorted by date.
+    :param str output: output folder of run
+    :return str: path to coverage.csv
+    """
+    rows = {}
+    for progress_file in glob.glob(os.path.join(output, "progress", "*.csv")):
+        with open(progress_file, newline="") as f:
+            for row in csv.DictReader(f):
+                rows[row["name"]] = row
+
+    coverage_path = os.path.join(output, "coverage.csv")
+    with open(coverage_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=PROGRESS_FIELDS)
+        writer.writeheader()
+        for name in sorted(rows):
+            writer.writerow(rows[name])
+    return coverage_path
+
+
+def run(images, weights, output, event="CH", start=None, end=None, batch_size=16, workers=None, chunk_size=256,
+        threads=None, threshold=0.1, target_size=(1024, 1024), epsilon=None, cropped=None, overlay_src=None,
+        overlay_ext=".jpg", pyramid=image_pyramid.PYRAMID_DIR, server_url=None):
+    """
+    Runs segmentation of all images in date range and writes results to output folder:
+    masks/ (binary masks), polygons/ (contours as json), progress/ (checkpoints) and coverage.csv.
+    :param str images: glob pattern of images
+    :param str weights: path to .h5 weights or .tflite model, not needed with server_url
+    :param str output: output folder
+    :param str event: "CH" or "AR"
+    :param datetime.date start: first date
+    :param datetime.date end: last date
+    :param int batch_size: number of images in one predict call
+    :param int workers: number of processes, defaults to number of CPU cores
+    :param int chunk_size: number of images in one chunk of work
+    :param int threads: tensorflow threads per worker, defaults to cores / workers
+    :param float threshold: probability threshold of mask
+    :param tuple target_size: size of image where polygons are drawn
+    :param float epsilon: tolerance of Douglas-Peucker simplification of polygons in pixels of mask, None means no simplification
+    :param bool cropped: images have white background out of disk, defaults to True for CH
+    :param str overlay_src: folder with images to draw overlays on, if None overlays are not rendered
+    :param str overlay_ext: extension of images in overlay_src
+    :param str pyramid: root folder of image pyramid (image_pyramid.py), None to always decode source images
+    :param str server_url: url of inference server (inference_server.py), model of event is used from server instead
+        of weights and requests of all workers are batched there
+    :return str: path to coverage.csv
+    """
+    workers = workers or os.cpu_count()
+    cropped = event == "CH" if cropped is None else cropped
+
+    for folder in ["masks", "polygons", "progress"] + (["overlays"] if overlay_src else []):
+        os.makedirs(os.path.join(output, folder), exist_ok=True)
+
+    # identity of weights is recorded, so archive (segmentation_archive.py) knows which model made results
+    if server_url:
+        from inference_server import InferenceClient
+
+        model_id = InferenceClient(server_url).model_id(event)
+    else:
+        model_id = weights_hash(weights)
+    check_run(output, model_id)
+    record_run(output, event, model_id)
+
+    paths = list_images(images, start, end)
+    done = read_progress(output)
+
+    # chunks are made from all images, so chunk ids stay the same after restart
+    chunks = []
+    for chunk_id, i in enumerate(range(0, len(paths), chunk_size)):
+        todo = [p for p in paths[i:i + chunk_size] if os.path.splitext(os.path.basename(p))[0] not in done]
+        if todo:
+            chunks.append((chunk_id, todo))
+
+    total = sum(len(todo) for _, todo in chunks)
+    print(f"{len(paths)} images in range, {len(paths) - total} already done, {total} to process")
+
+    options = {
+        "weights": weights,
+        "server_url": server_url,
+        "event": event,
+        "output": output,
+        "batch_size": batch_size,
+        "threads": threads or max(1, os.cpu_count() // workers),
+        "threshold": threshold,
+        "target_size": tuple(target_size),
+        "epsilon": epsilon,
+        "cropped": cropped,
+        "overlay_src": overlay_src,
+        "overlay_ext": overlay_ext,
+        "pyramid": pyramid,
+    }
+
+    if chunks:
+        # tensorflow is not fork safe, workers are spawned
+        context = multiprocessing.get_context("spawn")
+        processed = 0
+        with context.Pool(min(workers, len(chunks)), initializer=_init_worker, initargs=(options,)) as pool:
+            for n in pool.imap_unordered(_process_chunk, chunks):
+                processed += n
+                print(f"{processed}/{total} images")
+
+    return merge_progress(output)
+
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch segmentation of SOHO images with SCSS-Net")
+    parser.add_argument("--images", required=True, help='glob pattern of images, eg. "../data/imgs/imgs_171_96-21/*.png"')
+    parser.add_argument("--weights", default=None, help="path to .h5 weights or .tflite model")
+    parser.add_argument("--server-url", default=None,
+                        help="url of inference_server.py (eg. http://127.0.0.1:8765), used instead of --weights")
+    parser.add_argument("--output", required=True, help="output folder")
+    parser.add_argument("--event", choices=["CH", "AR"], default="CH")
+    parser.add_argument("--start", type=_parse_date, help="first date, YYYY-MM-DD")
+    parser.add_argument("--end", type=_parse_date, help="last date, YYYY-MM-DD")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=None, help="tensorflow threads per worker")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--target-size", type=int, default=1024)
+    parser.add_argument("--epsilon", type=float, default=None, help="polygon simplification tolerance in mask pixels")
+    parser.add_argument("--overlay-src", default=None, help="folder with images to draw overlays on")
+    parser.add_argument("--overlay-ext", default=".jpg")
+    parser.add_argument("--pyramid", default=image_pyramid.PYRAMID_DIR, help="root folder of image pyramid")
+    parser.add_argument("--no-pyramid", action="store_true", help="always decode source images")
+    args = parser.parse_args()
+    if not args.weights and not args.server_url:
+        parser.error("one of --weights and --server-url is required")
+
+    coverage_path = run(
+        args.images,
+        args.weights,
+        args.output,
+        event=args.event,
+        start=args.start,
+        end=args.end,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        threads=args.threads,
+        threshold=args.threshold,
+        target_size=(args.target_size, args.target_size),
+        epsilon=args.epsilon,
+        overlay_src=args.overlay_src,
+        overlay_ext=args.overlay_ext,
+        pyramid=None if args.no_pyramid else args.pyramid,
+        server_url=args.server_url,
+    )
+    print(f"coverage saved to {coverage_path}")
+
+
+if __name__ == "__main__":
+    main()
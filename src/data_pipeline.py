@@ -0,0 +1,126 @@
+import glob
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import image_loader
+
+"""
+Streaming input pipeline for training SCSS-Net with tf.data. Image/mask pairs are decoded in parallel, cached as uint8,
+shuffled, augmented in memory with 90/180/270 degree rotations and flips and prefetched, so rotated copies of images
+do not have to be saved to disk with prep_utils.rotate_imgs().
+
+example:
+    img_paths, mask_paths = pair_paths("../data/train_test_data/CH_train_imgs/*.png",
+                                       "../data/train_test_data/CH_train_masks/*.png")
+    train_ds, val_ds = train_val_datasets(img_paths, mask_paths, batch_size=BATCH_SIZE)
+    model.fit(train_ds, validation_data=val_ds, epochs=EPOCHS, callbacks=[callback_checkpoint])
+"""
+
+IMG_SIZE = 256
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+def pair_paths(imgs_pattern, masks_pattern):
+    """
+    Pairs images with masks by filename, images without mask are skipped.
+    :param str imgs_pattern: glob pattern of images
+    :param str masks_pattern: glob pattern of masks
+    :return tuple: (list of image paths, list of mask paths), sorted by filename
+    """
+    masks = {os.path.basename(path): path for path in glob.glob(masks_pattern)}
+    img_paths = []
+    mask_paths = []
+    for path in sorted(glob.glob(imgs_pattern)):
+        name = os.path.basename(path)
+        if name in masks:
+            img_paths.append(path)
+            mask_paths.append(masks[name])
+    return img_paths, mask_paths
+
+
+def _decode(path, img_size):
+    # decoded and resized by image_loader (PIL, antialiased bicubic), the same as inputs of inference and notebooks,
+    # PIL releases GIL while decoding, so parallel map still decodes in parallel. Cached as uint8, 4x less memory than
+    # float32
+    img = tf.numpy_function(lambda p: image_loader.load(p.decode(), img_size)[..., None], [path], tf.uint8)
+    img.set_shape((img_size, img_size, 1))
+    return img
+
+
+def _normalize(img, mask):
+    return tf.cast(img, tf.float32) / 255, tf.cast(mask, tf.float32) / 255
+
+
+def augment(img, mask):
+    """
+    Rotates image and mask by random multiple of 90 degrees and randomly flips them, the same way for both.
+    :param tf.Tensor img: image of shape (height, width, 1)
+    :param tf.Tensor mask: mask of shape (height, width, 1)
+    :return tuple: augmented (img, mask)
+    """
+    k = tf.random.uniform((), 0, 4, dtype=tf.int32)
+    img = tf.image.rot90(img, k)
+    mask = tf.image.rot90(mask, k)
+
+    flip = tf.random.uniform(()) < 0.5
+    img = tf.cond(flip, lambda: tf.image.flip_left_right(img), lambda: img)
+    mask = tf.cond(flip, lambda: tf.image.flip_left_right(mask), lambda: mask)
+    return img, mask
+
+
+def make_dataset(img_paths, mask_paths, batch_size=20, img_size=IMG_SIZE, augmentation=True, shuffle=True, cache=True,
+                 seed=42):
+    """
+    Creates dataset of normalized (img, mask) batches, which can be passed directly to model.fit().
+    :param list img_paths: paths to images
+    :param list mask_paths: paths to masks, in the same order as images
+    :param int batch_size: size of batch
+    :param int img_size: images and masks are resized to (img_size, img_size)
+    :param bool augmentation: whether to apply random rotations and flips
+    :param bool shuffle: whether to shuffle dataset every epoch
+    :param cache: True to cache decoded images in memory, path (str) to cache them in file, False to decode every epoch
+    :param int seed: seed of shuffling
+    :return tf.data.Dataset: dataset of (img, mask) batches of shape (batch_size, img_size, img_size, 1)
+    """
+    if len(img_paths) != len(mask_paths):
+        raise ValueError(f"number of images ({len(img_paths)}) and masks ({len(mask_paths)}) differs")
+
+    dataset = tf.data.Dataset.from_tensor_slices((list(img_paths), list(mask_paths)))
+    dataset = dataset.map(lambda img, mask: (_decode(img, img_size), _decode(mask, img_size)),
+                          num_parallel_calls=AUTOTUNE)
+
+    if cache:
+        dataset = dataset.cache(cache if isinstance(cache, str) else "")
+    if shuffle:
+        dataset = dataset.shuffle(len(img_paths), seed=seed, reshuffle_each_iteration=True)
+    if augmentation:
+        dataset = dataset.map(augment, num_parallel_calls=AUTOTUNE)
+
+    dataset = dataset.map(_normalize, num_parallel_calls=AUTOTUNE)
+    return dataset.batch(batch_size).prefetch(AUTOTUNE)
+
+
+def train_val_datasets(img_paths, mask_paths, val_split=0.2, batch_size=20, img_size=IMG_SIZE, augmentation=True,
+                       seed=123):
+    """
+    Splits pairs to training and validation dataset. Validation dataset is not augmented nor shuffled.
+    :param list img_paths: paths to images
+    :param list mask_paths: paths to masks, in the same order as images
+    :param float val_split: part of pairs used for validation
+    :param int batch_size: size of batch
+    :param int img_size: images and masks are resized to (img_size, img_size)
+    :param bool augmentation: whether to augment training dataset
+    :param int seed: seed of split
+    :return tuple: (train dataset, validation dataset)
+    """
+    idx = np.random.RandomState(seed).permutation(len(img_paths))
+    n_val = int(len(img_paths) * val_split)
+    val_idx, train_idx = idx[:n_val], idx[n_val:]
+
+    train_ds = make_dataset([img_paths[i] for i in train_idx], [mask_paths[i] for i in train_idx], batch_size,
+                            img_size, augmentation=augmentation, shuffle=True, seed=seed)
+    val_ds = make_dataset([img_paths[i] for i in val_idx], [mask_paths[i] for i in val_idx], batch_size,
+                          img_size, augmentation=False, shuffle=False)
+    return train_ds, val_ds
@@ -0,0 +1,199 @@
+import argparse
+import bisect
+import glob
+import json
+import os
+
+import numpy as np
+
+import image_loader
+
+"""
+Packs directories of images (train/test images and masks, 1996-2021 archives) to uint8 shards in .npy format,
+which are opened as memory maps. Images are decoded and resized only once, loading is then zero-copy and processes
+reading the same shards share pages of operating system cache.
+
+example (run from src folder):
+    python dataset_shards.py --images "../data/train_test_data/CH_train_imgs/*.png" --output ../data/shards/ --name CH_train_imgs
+    python dataset_shards.py --images "../data/train_test_data/CH_train_masks/*.png" --output ../data/shards/ --name CH_train_masks
+
+    imgs = ShardedDataset("../data/shards/", "CH_train_imgs")
+    x = imgs[0:100]                                   # numpy view, no copy
+    x_2003 = imgs.date_range("2003-01-01", "2003-12-31")
+"""
+
+IMG_SIZE = 256
+
+
+def _date(path):
+    date = os.path.basename(path).split("_")[0]
+    if len(date) != 8 or not date.isdigit():
+        return None
+    return f"{date[:4]}-{date[4:6]}-{date[6:]}"
+
+
+def pack(paths, output, name, img_size=IMG_SIZE, shard_size=4096, workers=None):
+    """
+    Decodes images and writes them to uint8 shards <name>_00000.npy, ... and index <name>_index.json.
+    Images are sorted by filename, which also sorts them by date.
+    :param list paths: paths to images
+    :param str output: output folder
+    :param str name: name of dataset
+    :param int img_size: images are resized to (img_size, img_size)
+    :param int shard_size: number of images in one shard
+    :param int workers: number of decoding threads
+    :return str: path to index file
+    """
+    os.makedirs(output, exist_ok=True)
+    paths = sorted(paths, key=os.path.basename)
+
+    shards = []
+    for shard_id, start in enumerate(range(0, len(paths), shard_size)):
+        shard_paths = paths[start:start + shard_size]
+        shard_name = f"{name}_{shard_id:05d}.npy"
+        shard = np.lib.format.open_memmap(os.path.join(output, shard_name), mode="w+", dtype=np.uint8,
+                                          shape=(len(shard_paths), img_size, img_size))
+        # images are decoded directly into memory map
+        image_loader.load_batch(shard_paths, img_size, out=shard, workers=workers)
+        shard.flush()
+        del shard
+        shards.append({"file": shard_name, "size": len(shard_paths)})
+
+    index = {
+        "name": name,
+        "img_size": img_size,
+        "shards": shards,
+        "filenames": [os.path.basename(path) for path in paths],
+        "dates": [_date(path) for path in paths],
+    }
+    index_path = os.path.join(output, f"{name}_index.json")
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+    return index_path
+
+
+class ShardedDataset:
+    """
+    Read-only access to shards created by pack(). Items are uint8 arrays of shape (img_size, img_size),
+    float normalization is left to the model input.
+    """
+
+    def __init__(self, directory, name):
+        """
+        :param str directory: folder with shards
+        :param str name: name of dataset used in pack()
+        """
+        with open(os.path.join(directory, f"{name}_index.json")) as f:
+            index = json.load(f)
+
+        self.directory = directory
+        self.filenames = index["filenames"]
+        self.dates = index["dates"]
+        self.img_size = index["img_size"]
+        self._files = [shard["file"] for shard in index["shards"]]
+        self._offsets = [int(offset) for offset in np.cumsum([0] + [shard["size"] for shard in index["shards"]])]
+        self._shards = [None] * len(self._files)
+        self._positions = {filename: i for i, filename in enumerate(self.filenames)}
+        # date queries need every filename to start with date, otherwise dates are not sorted
+        self._has_dates = all(date is not None for date in self.dates)
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def _shard(self, shard_id):
+        # shards are opened lazily, only touched pages are read from disk
+        if self._shards[shard_id] is None:
+            self._shards[shard_id] = np.load(os.path.join(self.directory, self._files[shard_id]), mmap_mode="r")
+        return self._shards[shard_id]
+
+    def __getitem__(self, key):
+        """
+        :param key: index (int) or slice with step 1
+        :return numpy.array: view of one image or of images in slice, slice over more shards is copied
+        """
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("only slices with step 1 are supported")
+            return self.slice(start, stop)
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(f"index {key} out of range")
+        shard_id = bisect.bisect_right(self._offsets, key) - 1
+        return self._shard(shard_id)[key - self._offsets[shard_id]]
+
+    def iter_slices(self, start, stop):
+        """
+        Yields zero-copy views of images in range, one view per shard.
+        :param int start: first index
+        :param int stop: index after last image
+        :return: generator of numpy.array of shape (n, img_size, img_size)
+        """
+        shard_id = bisect.bisect_right(self._offsets, start) - 1
+        while start < stop and shard_id < len(self._files):
+            offset = self._offsets[shard_id]
+            end = min(stop, self._offsets[shard_id + 1])
+            yield self._shard(shard_id)[start - offset:end - offset]
+            start = end
+            shard_id += 1
+
+    def slice(self, start, stop):
+        """
+        Images in range, view if range is in one shard, copy otherwise.
+        :param int start: first index
+        :param int stop: index after last image
+        :return numpy.array: images of shape (n, img_size, img_size)
+        """
+        views = list(self.iter_slices(start, stop))
+        if len(views) == 1:
+            return views[0]
+        if not views:
+            return np.empty((0, self.img_size, self.img_size), dtype=np.uint8)
+        return np.concatenate(views)
+
+    def index_range(self, start_date, end_date):
+        """
+        Indexes of images in date range, images are sorted by date, so it is one continuous range.
+        :param str start_date: first date in format %Y-%m-%d
+        :param str end_date: last date in format %Y-%m-%d
+        :return tuple: (start, stop)
+        """
+        if not self._has_dates:
+            raise ValueError("date range can not be used, some filenames do not start with date")
+        return bisect.bisect_left(self.dates, start_date), bisect.bisect_right(self.dates, end_date)
+
+    def date_range(self, start_date, end_date):
+        """
+        Images in date range, see slice().
+        :param str start_date: first date in format %Y-%m-%d
+        :param str end_date: last date in format %Y-%m-%d
+        :return numpy.array: images of shape (n, img_size, img_size)
+        """
+        return self.slice(*self.index_range(start_date, end_date))
+
+    def by_filename(self, filename):
+        """
+        :param str filename: filename of original image
+        :return numpy.array: view of image
+        """
+        return self[self._positions[filename]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack images to memory mapped uint8 shards")
+    parser.add_argument("--images", required=True, help="glob pattern of images")
+    parser.add_argument("--output", required=True, help="output folder")
+    parser.add_argument("--name", required=True, help="name of dataset")
+    parser.add_argument("--img-size", type=int, default=IMG_SIZE)
+    parser.add_argument("--shard-size", type=int, default=4096)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    index_path = pack(glob.glob(args.images), args.output, args.name, args.img_size, args.shard_size, args.workers)
+    print(f"index saved to {index_path}")
+
+
+if __name__ == "__main__":
+    main()
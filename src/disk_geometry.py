@@ -0,0 +1,178 @@
+import datetime
+from functools import lru_cache
+
+import ephem
+import numpy as np
+
+"""
+Geometry of Sun's disk on EIT images. Size of disk changes during year, because distance between SOHO and Sun changes.
+SOHO orbits L1 point, which is always ~1% closer to Sun than Earth, so Earth-Sun distance is used to scale the disk.
+Radius follows calibrated margins of cropped 195A images (crop_functions.margin_table()), so AR coverage and cropped
+CH images use the same disk.
+"""
+
+# disk measured on 1024x1024 images with base margins 132, 142, 143, 132 (see crop_suns_disk.ipynb)
+# on first day of year, when Earth-Sun distance is 0.9831 AU (same reference as in crop_functions.map())
+REFERENCE_SIZE = 1024
+REFERENCE_RADIUS = 374.75
+REFERENCE_DISTANCE = 0.9831
+# calibration of crop margins, every margin grows linearly by 14 px of 1024x1024 image until aphelion
+APHELION_DISTANCE = 1.0168
+MARGIN_GROWTH = 14
+
+FIRST_DATE = datetime.date(1996, 1, 1)
+LAST_DATE = datetime.date(2021, 12, 31)
+
+
+def sun_distance(date):
+    """
+    Computes Earth-Sun distance with ephem.
+    :param datetime.date date: date of observation
+    :return float: distance in AU
+    """
+    sun = ephem.Sun()
+    sun.compute(ephem.Date(date.strftime("%Y/%m/%d")))
+    return sun.earth_distance
+
+
+@lru_cache(maxsize=None)
+def distance_table(start=FIRST_DATE, end=LAST_DATE):
+    """
+    Precomputes Earth-Sun distance for every day in range, computed only once per process.
+    :param datetime.date start: first day of table
+    :param datetime.date end: last day of table
+    :return numpy.array: distances in AU, index is number of days from start
+    """
+    days = (end - start).days + 1
+    distances = np.empty(days, dtype=np.float64)
+    sun = ephem.Sun()
+    first = ephem.Date(start.strftime("%Y/%m/%d"))
+    for i in range(days):
+        sun.compute(ephem.Date(first + i))
+        distances[i] = sun.earth_distance
+    distances.setflags(write=False)
+    return distances
+
+
+def distances(start, end):
+    """
+    Earth-Sun distance for every day in range, slice of precomputed table if range is in 1996-2021.
+    :param datetime.date start: first day
+    :param datetime.date end: last day
+    :return numpy.array: distances in AU, index is number of days from start
+    """
+    if FIRST_DATE <= start and end <= LAST_DATE:
+        return distance_table()[(start - FIRST_DATE).days:(end - FIRST_DATE).days + 1]
+    return distance_table(start, end)
+
+
+def distance(date):
+    """
+    Earth-Sun distance for date, from precomputed table for 1996-2021 and computed with ephem outside of it.
+    :param datetime.date date: date of observation
+    :return float: distance in AU
+    """
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    if FIRST_DATE <= date <= LAST_DATE:
+        return float(distance_table()[(date - FIRST_DATE).days])
+    return sun_distance(date)
+
+
+def margin_growth(earth_distance):
+    """
+    Growth of margins of Sun's disk against margins at REFERENCE_DISTANCE, calibrated on cropped 195A images.
+    :param earth_distance: Earth-Sun distance in AU, float or numpy.array
+    :return: growth in pixels of REFERENCE_SIZE image, float or numpy.array
+    """
+    return np.interp(earth_distance, [REFERENCE_DISTANCE, APHELION_DISTANCE], [0, MARGIN_GROWTH])
+
+
+def disk_radius(date, size=256):
+    """
+    Radius of Sun's disk in pixels, the same disk as pieslice of crop_functions.margin_table().
+    :param datetime.date date: date of observation
+    :param int size: width (and height) of image in pixels
+    :return float: radius in pixels
+    """
+    return float(REFERENCE_RADIUS - margin_growth(distance(date))) * size / REFERENCE_SIZE
+
+
+@lru_cache(maxsize=64)
+def _disk_mask(size, radius, center):
+    yy, xx = np.ogrid[:size, :size]
+    cx, cy = center
+    mask = (xx - cx) ** 2 + (yy - cy) ** 2 <= radius ** 2
+    mask.setflags(write=False)
+    return mask
+
+
+def disk_mask(date, size=256, center=None):
+    """
+    Boolean mask of Sun's disk, masks are cached because radius changes only slightly between days.
+    :param datetime.date date: date of observation
+    :param int size: width (and height) of image in pixels
+    :param tuple center: (x, y) center of disk, if None center of image is used
+    :return numpy.array: read-only boolean array of shape (size, size)
+    """
+    if center is None:
+        center = ((size - 1) / 2, (size - 1) / 2)
+    return _disk_mask(size, round(disk_radius(date, size), 2), tuple(center))
+
+
+def disk_area(date, size=256):
+    """
+    Number of pixels on Sun's disk.
+    :param datetime.date date: date of observation
+    :param int size: width (and height) of image in pixels
+    :return int: area of disk in pixels
+    """
+    return int(np.count_nonzero(disk_mask(date, size)))
+
+
+def limb_weights(date, size=256, center=None, mu_min=0.1):
+    """
+    Weight map which corrects limb foreshortening, every pixel on disk is weighted by 1/mu, where mu is cosine of
+    heliocentric angle. Pixels out of disk have weight 0.
+    :param datetime.date date: date of observation
+    :param int size: width (and height) of image in pixels
+    :param tuple center: (x, y) center of disk, if None center of image is used
+    :param float mu_min: lower bound of mu, so weights near limb do not go to infinity
+    :return numpy.array: float32 array of shape (size, size)
+    """
+    if center is None:
+        center = ((size - 1) / 2, (size - 1) / 2)
+    radius = disk_radius(date, size)
+    yy, xx = np.ogrid[:size, :size]
+    r2 = ((xx - center[0]) ** 2 + (yy - center[1]) ** 2) / radius ** 2
+    mu = np.sqrt(np.clip(1.0 - r2, 0.0, 1.0))
+    weights = 1.0 / np.maximum(mu, mu_min)
+    weights[r2 > 1.0] = 0.0
+    return weights.astype(np.float32)
+
+
+def area_coverage(y_pred, disk, threshold=0.1, weights=None):
+    """
+    Area of disk covered by segmented event in %.
+    :param numpy.array y_pred: predicted mask
+    :param disk: area of disk in pixels (int) or boolean mask of disk (numpy.array), with mask only pixels on disk are counted
+    :param float threshold: pixels with higher probability belong to event
+    :param numpy.array weights: optional weight map from limb_weights(), used instead of counting pixels
+    :return float: area coverage rounded to 2 decimals
+    """
+    predicted = np.asarray(y_pred).reshape(np.shape(y_pred)[0], np.shape(y_pred)[1]) > threshold
+
+    if isinstance(disk, np.ndarray):
+        predicted &= disk
+        disk_size = weights[disk].sum() if weights is not None else np.count_nonzero(disk)
+    else:
+        disk_size = weights.sum() if weights is not None else disk
+
+    if weights is not None:
+        predicted_size = weights[predicted].sum()
+    else:
+        predicted_size = np.count_nonzero(predicted)
+
+    if disk_size == 0:
+        return 0.0
+    return round(float(predicted_size / disk_size) * 100, 2)
@@ -0,0 +1,357 @@
+import argparse
+import csv
+import datetime
+import multiprocessing
+import os
+
+import numpy as np
+from PIL import Image
+
+import batch_inference
+import image_pyramid
+from export_model import weights_hash
+
+"""
+Dual-event inference of SCSS-Net. CH and AR models have the same architecture and differ only in weights, so both are
+put into one multi-output keras graph and segmented with one predict call. For every date the cropped 195A image
+(input of CH model) and the 171A image (input of AR model) are decoded once, result contains both masks, both contour
+sets and label mask / overlay with both events.
+
+Archive-wide run writes output of every event in the layout of batch_inference.py (<output>/CH/, <output>/AR/ with
+masks/, polygons/, progress/, coverage.csv and run.json with identity of weights), so it can be imported with
+segmentation_archive.py, and label masks of both events to <output>/labels/.
+
+example (run from src folder):
+    python dual_inference.py --ch-images "../data/imgs/imgs_195_cropped_96-21/*.png"
+        --ar-images "../data/imgs/imgs_171_96-21/*.png" --ch-weights ../modeling/ch_model.h5
+        --ar-weights ../modeling/ar_model.h5 --output ../data/predictions_dual/ --workers 4
+"""
+
+IMG_SIZE = 256
+EVENTS = ("CH", "AR")
+# values of label mask, pixel of both events has value 3
+LABELS = {"CH": 1, "AR": 2}
+COLORS = {"CH": "cyan", "AR": "red"}
+
+_model = None
+_options = None
+
+
+def _is_tflite(path):
+    return path is not None and str(path).endswith(".tflite")
+
+
+class DualModel:
+    """
+    CH and AR models with one predict call. Keras models are fused to one graph with two inputs and two outputs,
+    TensorFlow Lite interpreters can not be fused, they run one after another. Models of single events stay available
+    in models, so one process does not need another copy of weights for single-event predictions.
+    """
+
+    def __init__(self, ch_weights, ar_weights, num_threads=None, img_size=IMG_SIZE):
+        """
+        :param str ch_weights: path to .h5 weights or .tflite model of CH, None keeps random weights
+        :param str ar_weights: path to .h5 weights or .tflite model of AR, None keeps random weights
+        :param int num_threads: number of CPU threads of TensorFlow Lite interpreters
+        :param int img_size: size of input image
+        """
+        from export_model import build_keras_model, load_model
+
+        if _is_tflite(ch_weights) or _is_tflite(ar_weights):
+            self.models = {"CH": load_model(ch_weights, num_threads) if ch_weights else build_keras_model(None),
+                           "AR": load_model(ar_weights, num_threads) if ar_weights else build_keras_model(None)}
+            self.fused = None
+        else:
+            self.models = {"CH": build_keras_model(ch_weights, img_size), "AR": build_keras_model(ar_weights, img_size)}
+            self.fused = fuse(self.models["CH"], self.models["AR"], img_size)
+
+    def predict_on_batch(self, x_ch, x_ar):
+        """
+        :param numpy.array x_ch: normalized cropped 195A images of shape (n, 256, 256, 1)
+        :param numpy.array x_ar: normalized 171A images of shape (n, 256, 256, 1), the same n as x_ch
+        :return tuple: predictions of CH and AR, both of shape (n, 256, 256, 1)
+        """
+        if self.fused is None:
+            return (np.asarray(self.models["CH"].predict_on_batch(x_ch)),
+                    np.asarray(self.models["AR"].predict_on_batch(x_ar)))
+        y_ch, y_ar = self.fused.predict_on_batch([x_ch, x_ar])
+        return np.asarray(y_ch), np.asarray(y_ar)
+
+
+def fuse(ch_model, ar_model, img_size=IMG_SIZE):
+    """
+    Puts two keras models into one graph, layers and weights are shared with original models.
+    :param tf.keras.Model ch_model: SCSS-Net of CH
+    :param tf.keras.Model ar_model: SCSS-Net of AR
+    :param int img_size: size of input image
+    :return tf.keras.Model: model with inputs [x_ch, x_ar] and outputs [y_ch, y_ar]
+    """
+    from tensorflow import keras
+
+    x_ch = keras.Input((img_size, img_size, 1), name="ch_input")
+    x_ar = keras.Input((img_size, img_size, 1), name="ar_input")
+    return keras.Model(inputs=[x_ch, x_ar], outputs=[ch_model(x_ch), ar_model(x_ar)], name="scss_net_dual")
+
+
+def label_mask(y_ch, y_ar, threshold=0.1):
+    """
+    Label mask of both events, see LABELS.
+    :param numpy.array y_ch: prediction of CH of shape (height, width[, 1])
+    :param numpy.array y_ar: prediction of AR of the same shape
+    :param float threshold: probability threshold of masks
+    :return numpy.array: uint8 array of shape (height, width)
+    """
+    y_ch = np.asarray(y_ch).reshape(np.shape(y_ch)[0], np.shape(y_ch)[1])
+    y_ar = np.asarray(y_ar).reshape(y_ch.shape)
+    labels = (y_ch > threshold).astype(np.uint8) * LABELS["CH"]
+    labels |= (y_ar > threshold).astype(np.uint8) * LABELS["AR"]
+    return labels
+
+
+def contours(y_ch, y_ar, target_size=(1024, 1024), threshold=0.1, approximation="simple", epsilon=None):
+    """
+    Contours of predictions of both events in one pass.
+    :param numpy.array y_ch: predictions of CH of shape (n, height, width, 1)
+    :param numpy.array y_ar: predictions of AR of the same shape
+    :param tuple target_size: size of image where polygons are drawn
+    :param float threshold: probability threshold, see utils.create_contours_batch()
+    :param str approximation: chain approximation of cv2.findContours
+    :param float epsilon: tolerance of polygon simplification in pixels of prediction
+    :return tuple: lists of polygons of every image for CH and AR
+    """
+    from utils import create_contours_batch
+
+    polygons = create_contours_batch(np.concatenate([y_ch, y_ar]), target_size, threshold, approximation, epsilon)
+    return polygons[:len(y_ch)], polygons[len(y_ch):]
+
+
+def draw_label_overlay(img, polygons, width=4):
+    """
+    Draws contours of both events on one image, colors are in COLORS.
+    :param PIL.Image img: image to draw on, it is changed in place
+    :param dict polygons: event -> polygons of event
+    :param int width: width of contours
+    :return PIL.Image: the same image
+    """
+    from utils import draw_contours
+
+    for event in EVENTS:
+        draw_contours(img, polygons.get(event, []), outline=COLORS[event], width=width)
+    return img
+
+
+def pair_images(ch_pattern, ar_pattern, start=None, end=None):
+    """
+    Pairs CH and AR images of the same date, dates without both images are skipped.
+    :param str ch_pattern: glob pattern of cropped 195A images
+    :param str ar_pattern: glob pattern of 171A images
+    :param datetime.date start: first date
+    :param datetime.date end: last date
+    :return list: sorted list of (date, CH path, AR path), one pair per date (the last image of the day)
+    """
+    ar_paths = {batch_inference.get_date(path): path for path in batch_inference.list_images(ar_pattern, start, end)}
+    ch_paths = {batch_inference.get_date(path): path for path in batch_inference.list_images(ch_pattern, start, end)}
+    return [(date, ch_paths[date], ar_paths[date]) for date in sorted(ch_paths.keys() & ar_paths.keys())]
+
+
+def _name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _init_worker(options):
+    global _model, _options
+
+    import tensorflow as tf
+
+    if options["threads"]:
+        tf.config.threading.set_intra_op_parallelism_threads(options["threads"])
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    _model = DualModel(options["ch_weights"], options["ar_weights"], num_threads=options["threads"])
+    _options = options
+
+
+def _process_chunk(chunk):
+    chunk_id, pairs = chunk
+
+    output = _options["output"]
+    threshold = _options["threshold"]
+    writers = {}
+    files = []
+    try:
+        for event in EVENTS:
+            progress_path = os.path.join(output, event, "progress", f"chunk_{chunk_id:05d}.csv")
+            new_file = not os.path.exists(progress_path)
+            files.append(open(progress_path, "a", newline=""))
+            writers[event] = csv.DictWriter(files[-1], fieldnames=batch_inference.PROGRESS_FIELDS)
+            if new_file:
+                writers[event].writeheader()
+
+        batches = zip(batch_inference.iter_batches([ch for _, ch, _ in pairs], _options["batch_size"],
+                                                   pyramid=_options["pyramid"]),
+                      batch_inference.iter_batches([ar for _, _, ar in pairs], _options["batch_size"],
+                                                   pyramid=_options["pyramid"]))
+        for (ch_paths, x_ch), (ar_paths, x_ar) in batches:
+            y_ch, y_ar = _model.predict_on_batch(x_ch, x_ar)
+            ch_polygons, ar_polygons = contours(y_ch, y_ar, _options["target_size"], threshold,
+                                                epsilon=_options["epsilon"])
+
+            for i, (ch_path, ar_path) in enumerate(zip(ch_paths, ar_paths)):
+                rows = {
+                    "CH": batch_inference.save_result(os.path.join(output, "CH"), ch_path, x_ch[i], y_ch[i],
+                                                      ch_polygons[i], threshold, cropped=True),
+                    "AR": batch_inference.save_result(os.path.join(output, "AR"), ar_path, x_ar[i], y_ar[i],
+                                                      ar_polygons[i], threshold, cropped=False),
+                }
+                date = rows["CH"]["date"]
+                Image.fromarray(label_mask(y_ch[i], y_ar[i], threshold)).save(
+                    os.path.join(output, "labels", date + ".png"))
+
+                if _options["overlay_src"]:
+                    _save_overlay(date, _name(ch_path), {"CH": ch_polygons[i], "AR": ar_polygons[i]})
+
+                # both rows are written only when all files of date are complete
+                for event in EVENTS:
+                    writers[event].writerow(rows[event])
+
+            for f in files:
+                f.flush()
+                os.fsync(f.fileno())
+    finally:
+        for f in files:
+            f.close()
+
+    return len(pairs)
+
+
+def _save_overlay(date, ch_name, polygons):
+    # uncropped 195A image has the same name as cropped one
+    src = os.path.join(_options["overlay_src"], ch_name + _options["overlay_ext"])
+    if _options["target_size"] == (image_pyramid.DISPLAY_SIZE, image_pyramid.DISPLAY_SIZE):
+        img = image_pyramid.open_display(src, _options["pyramid"]).convert("RGB")
+    else:
+        img = Image.open(src).convert("RGB").resize(_options["target_size"])
+    draw_label_overlay(img, polygons)
+    img.save(os.path.join(_options["output"], "overlays", date + ".jpg"))
+
+
+def run(ch_images, ar_images, ch_weights, ar_weights, output, start=None, end=None, batch_size=16, workers=None,
+        chunk_size=256, threads=None, threshold=0.1, target_size=(1024, 1024), epsilon=None, overlay_src=None,
+        overlay_ext=".jpg", pyramid=image_pyramid.PYRAMID_DIR):
+    """
+    Runs segmentation of both events for all dates in range, one pass of pipeline per date. Arguments are the same as
+    in batch_inference.run().
+    :param str ch_images: glob pattern of cropped 195A images
+    :param str ar_images: glob pattern of 171A images
+    :param str ch_weights: path to .h5 weights or .tflite model of CH
+    :param str ar_weights: path to .h5 weights or .tflite model of AR
+    :param str output: output folder
+    :param str overlay_src: folder with uncropped 195A images to draw overlays of both events on, None skips overlays
+    :return dict: event -> path to coverage.csv
+    """
+    workers = workers or os.cpu_count()
+
+    folders = ["labels"] + (["overlays"] if overlay_src else [])
+    folders += [os.path.join(event, folder) for event in EVENTS for folder in ["masks", "polygons", "progress"]]
+    for folder in folders:
+        os.makedirs(os.path.join(output, folder), exist_ok=True)
+
+    # identity of weights of every event is recorded like in batch_inference.run(), both are checked before any is
+    # written, so resumed run with other weights of one event fails without touching output
+    model_ids = {"CH": weights_hash(ch_weights), "AR": weights_hash(ar_weights)}
+    for event in EVENTS:
+        batch_inference.check_run(os.path.join(output, event), model_ids[event])
+    for event in EVENTS:
+        batch_inference.record_run(os.path.join(output, event), event, model_ids[event])
+
+    pairs = pair_images(ch_images, ar_images, start, end)
+    done = {event: batch_inference.read_progress(os.path.join(output, event)) for event in EVENTS}
+
+    # chunks are made from all pairs, so chunk ids stay the same after restart
+    chunks = []
+    for chunk_id, i in enumerate(range(0, len(pairs), chunk_size)):
+        todo = [(date, ch, ar) for date, ch, ar in pairs[i:i + chunk_size]
+                if _name(ch) not in done["CH"] or _name(ar) not in done["AR"]]
+        if todo:
+            chunks.append((chunk_id, todo))
+
+    total = sum(len(todo) for _, todo in chunks)
+    print(f"{len(pairs)} dates with both images in range, {len(pairs) - total} already done, {total} to process")
+
+    options = {
+        "ch_weights": ch_weights,
+        "ar_weights": ar_weights,
+        "output": output,
+        "batch_size": batch_size,
+        "threads": threads or max(1, os.cpu_count() // workers),
+        "threshold": threshold,
+        "target_size": tuple(target_size),
+        "epsilon": epsilon,
+        "overlay_src": overlay_src,
+        "overlay_ext": overlay_ext,
+        "pyramid": pyramid,
+    }
+
+    if chunks:
+        # tensorflow is not fork safe, workers are spawned
+        context = multiprocessing.get_context("spawn")
+        processed = 0
+        with context.Pool(min(workers, len(chunks)), initializer=_init_worker, initargs=(options,)) as pool:
+            for n in pool.imap_unordered(_process_chunk, chunks):
+                processed += n
+                print(f"{processed}/{total} dates")
+
+    return {event: batch_inference.merge_progress(os.path.join(output, event)) for event in EVENTS}
+
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dual-event (CH and AR) batch segmentation of SOHO images")
+    parser.add_argument("--ch-images", required=True, help="glob pattern of cropped 195A images")
+    parser.add_argument("--ar-images", required=True, help="glob pattern of 171A images")
+    parser.add_argument("--ch-weights", required=True, help="CH model, .h5 weights or .tflite model")
+    parser.add_argument("--ar-weights", required=True, help="AR model, .h5 weights or .tflite model")
+    parser.add_argument("--output", required=True, help="output folder")
+    parser.add_argument("--start", type=_parse_date, help="first date, YYYY-MM-DD")
+    parser.add_argument("--end", type=_parse_date, help="last date, YYYY-MM-DD")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=None, help="tensorflow threads per worker")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--target-size", type=int, default=1024)
+    parser.add_argument("--epsilon", type=float, default=None, help="polygon simplification tolerance in mask pixels")
+    parser.add_argument("--overlay-src", default=None, help="folder with uncropped 195A images to draw overlays on")
+    parser.add_argument("--overlay-ext", default=".jpg")
+    parser.add_argument("--pyramid", default=image_pyramid.PYRAMID_DIR, help="root folder of image pyramid")
+    parser.add_argument("--no-pyramid", action="store_true", help="always decode source images")
+    args = parser.parse_args()
+
+    coverage_paths = run(
+        args.ch_images,
+        args.ar_images,
+        args.ch_weights,
+        args.ar_weights,
+        args.output,
+        start=args.start,
+        end=args.end,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        threads=args.threads,
+        threshold=args.threshold,
+        target_size=(args.target_size, args.target_size),
+        epsilon=args.epsilon,
+        overlay_src=args.overlay_src,
+        overlay_ext=args.overlay_ext,
+        pyramid=None if args.no_pyramid else args.pyramid,
+    )
+    for event, coverage_path in coverage_paths.items():
+        print(f"{event} coverage saved to {coverage_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+"""
+Vectorized evaluation of segmentations. Per-image Dice, IoU, precision, recall and area error are computed for whole
+batch at once from four counts per image (intersection, true area, predicted area). Masks can be float (soft metrics,
+same values as metrics.dice_np and metrics.iou_np), thresholded boolean or bit-packed with np.packbits(axis=-1).
+Batches can be streamed with MetricAccumulator, so whole archive can be scored chunk by chunk.
+"""
+
+METRICS = ["dice", "iou", "precision", "recall", "area_error"]
+
+# number of set bits in every byte value
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _flat(masks):
+    masks = np.asarray(masks)
+    return masks.reshape(masks.shape[0], -1)
+
+
+def popcount(packed):
+    """
+    Number of set bits of every bit-packed mask.
+    :param numpy.array packed: uint8 array of shape (n, ...) from np.packbits
+    :return numpy.array: int64 counts of shape (n,)
+    """
+    return _POPCOUNT[_flat(packed)].sum(axis=1, dtype=np.int64)
+
+
+def counts(y_true, y_pred, threshold=None, packed=False):
+    """
+    Intersection, true area and predicted area of every image.
+    :param numpy.array y_true: masks of shape (n, height, width[, 1])
+    :param numpy.array y_pred: predictions of shape (n, height, width[, 1])
+    :param float threshold: threshold of both y_true and y_pred, None uses values as they are (soft or boolean masks)
+    :param bool packed: masks are bit-packed with np.packbits(axis=-1)
+    :return tuple: (intersection, area_true, area_pred), arrays of shape (n,)
+    """
+    if packed:
+        y_true, y_pred = _flat(y_true), _flat(y_pred)
+        return popcount(y_true & y_pred), popcount(y_true), popcount(y_pred)
+
+    if threshold is not None:
+        y_true, y_pred = _flat(y_true) > threshold, _flat(y_pred) > threshold
+    else:
+        y_true, y_pred = _flat(y_true), _flat(y_pred)
+
+    if y_true.dtype == bool and y_pred.dtype == bool:
+        return ((y_true & y_pred).sum(axis=1, dtype=np.int64), y_true.sum(axis=1, dtype=np.int64),
+                y_pred.sum(axis=1, dtype=np.int64))
+
+    # einsum sums products without allocating full size temporary array
+    y_true, y_pred = y_true.astype(np.float32, copy=False), y_pred.astype(np.float32, copy=False)
+    return (np.einsum("ij,ij->i", y_true, y_pred, dtype=np.float64), y_true.sum(axis=1, dtype=np.float64),
+            y_pred.sum(axis=1, dtype=np.float64))
+
+
+def scores(intersection, area_true, area_pred, smooth=1.0):
+    """
+    Metrics computed from counts, Dice and IoU use the same smoothing as metrics.dice_np and metrics.iou_np.
+    :param numpy.array intersection: intersection of every image
+    :param numpy.array area_true: area of true mask of every image
+    :param numpy.array area_pred: area of predicted mask of every image
+    :param float smooth: smoothing added to numerator and denominator
+    :return dict: metric name -> numpy.array of shape (n,)
+    """
+    intersection = np.asarray(intersection, dtype=np.float64)
+    area_true = np.asarray(area_true, dtype=np.float64)
+    area_pred = np.asarray(area_pred, dtype=np.float64)
+    return {
+        "dice": 2 * (intersection + smooth) / (area_true + area_pred + smooth),
+        "iou": (intersection + smooth) / (area_true + area_pred - intersection + smooth),
+        "precision": (intersection + smooth) / (area_pred + smooth),
+        "recall": (intersection + smooth) / (area_true + smooth),
+        # relative difference of predicted area, positive means predicted area is bigger
+        "area_error": (area_pred - area_true) / (area_true + smooth),
+    }
+
+
+def per_image_scores(y_true, y_pred, threshold=None, packed=False, smooth=1.0):
+    """
+    Metrics of every image in batch.
+    :param numpy.array y_true: masks of shape (n, height, width[, 1])
+    :param numpy.array y_pred: predictions of shape (n, height, width[, 1])
+    :param float threshold: threshold of masks, None for soft metrics
+    :param bool packed: masks are bit-packed with np.packbits(axis=-1)
+    :param float smooth: smoothing
+    :return dict: metric name -> numpy.array of shape (n,)
+    """
+    return scores(*counts(y_true, y_pred, threshold, packed), smooth=smooth)
+
+
+class MetricAccumulator:
+    """
+    Collects counts of chunks of images, so metrics of archive can be computed without holding all masks in memory.
+    """
+
+    def __init__(self, threshold=0.5, packed=False, smooth=1.0):
+        """
+        :param float threshold: threshold of masks, None for soft metrics
+        :param bool packed: masks are bit-packed with np.packbits(axis=-1)
+        :param float smooth: smoothing
+        """
+        self.threshold = threshold
+        self.packed = packed
+        self.smooth = smooth
+        self._names = []
+        self._counts = []
+
+    def update(self, y_true, y_pred, names=None):
+        """
+        Adds chunk of images.
+        :param numpy.array y_true: masks of shape (n, height, width[, 1])
+        :param numpy.array y_pred: predictions of shape (n, height, width[, 1])
+        :param list names: names of images (eg. filenames), if None index is used
+        """
+        chunk = np.stack(counts(y_true, y_pred, self.threshold, self.packed), axis=1)
+        if names is None:
+            start = sum(len(c) for c in self._counts)
+            names = range(start, start + len(chunk))
+        self._names.extend(names)
+        self._counts.append(chunk)
+
+    def table(self, sort_by="dice", ascending=False):
+        """
+        Metrics of every image.
+        :param str sort_by: metric to sort by
+        :param bool ascending: sort order, False puts the best images first (area_error is sorted by absolute value,
+            smallest error is the best)
+        :return pandas.DataFrame: table indexed by name with counts and metrics
+        """
+        all_counts = np.concatenate(self._counts) if self._counts else np.zeros((0, 3))
+        table = pd.DataFrame(all_counts, columns=["intersection", "area_true", "area_pred"], index=self._names)
+        for metric, values in scores(*all_counts.T, smooth=self.smooth).items():
+            table[metric] = values.astype(np.float32)
+        if sort_by == "area_error":
+            return table.sort_values(sort_by, ascending=not ascending, key=np.abs)
+        return table.sort_values(sort_by, ascending=ascending)
+
+    def summary(self):
+        """
+        Aggregate metrics, mean over images (macro) and metrics from summed counts (micro).
+        :return dict: {"macro": {metric: value}, "micro": {metric: value}, "n_imgs": int}
+        """
+        all_counts = np.concatenate(self._counts) if self._counts else np.zeros((0, 3))
+        per_image = scores(*all_counts.T, smooth=self.smooth)
+        total = scores(*all_counts.sum(axis=0)[:, None], smooth=self.smooth)
+        return {
+            "macro": {metric: float(np.mean(per_image[metric])) for metric in METRICS},
+            "micro": {metric: float(total[metric][0]) for metric in METRICS},
+            "n_imgs": len(all_counts),
+        }
+
+
+def evaluate(chunks, threshold=0.5, packed=False, smooth=1.0, sort_by="dice"):
+    """
+    Scores stream of chunks.
+    :param chunks: iterable of (y_true, y_pred) or (y_true, y_pred, names)
+    :param float threshold: threshold of masks, None for soft metrics
+    :param bool packed: masks are bit-packed with np.packbits(axis=-1)
+    :param float smooth: smoothing
+    :param str sort_by: metric to sort table by, best first
+    :return tuple: (pandas.DataFrame table, dict summary)
+    """
+    accumulator = MetricAccumulator(threshold, packed, smooth)
+    for chunk in chunks:
+        accumulator.update(*chunk)
+    return accumulator.table(sort_by), accumulator.summary()
@@ -0,0 +1,175 @@
+import argparse
+import glob
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+import image_loader
+
+"""
+Export of trained SCSS-Net to TensorFlow Lite for CPU inference. Exported .tflite model can be loaded with load_model()
+everywhere, where .h5 weights are used (webapp, batch inference), backend is selected by extension of file.
+
+example (run from src folder):
+    python export_model.py --weights ../modeling/ch_model.h5 --output ../modeling/ch_model_fp16.tflite --quantization float16
+    python export_model.py --weights ../modeling/ar_model.h5 --output ../modeling/ar_model_int8.tflite
+        --quantization int8 --calibration "../data/train_test_data/AR_train_imgs/*.png"
+"""
+
+IMG_SIZE = 256
+QUANTIZATIONS = ("none", "dynamic", "float16", "int8")
+
+
+def build_keras_model(weights, img_size=IMG_SIZE):
+    """
+    Builds SCSS-Net with parameters used in this project and loads trained weights.
+    :param str weights: path to .h5 weights, None keeps random weights (benchmarks)
+    :param int img_size: size of input image
+    :return tf.keras.Model: model with loaded weights
+    """
+    from model_scss_net import scss_net
+
+    model = scss_net((img_size, img_size, 1), filters=32, layers=4, batch_norm=True, drop_prob=0.5)
+    if weights is not None:
+        model.load_weights(weights)
+    return model
+
+
+def load_images(pattern, n_imgs=None, img_size=IMG_SIZE):
+    """
+    Loads images as normalized float32 array.
+    :param str pattern: glob pattern of images
+    :param int n_imgs: maximal number of images, if None all images are loaded
+    :param int img_size: images are resized to (img_size, img_size)
+    :return numpy.array: images of shape (n_imgs, img_size, img_size, 1)
+    """
+    paths = sorted(glob.glob(pattern))[:n_imgs]
+    return image_loader.normalize(image_loader.load_batch(paths, img_size))
+
+
+def export_tflite(weights, output, quantization="float16", calibration_images=None):
+    """
+    Converts trained SCSS-Net to TensorFlow Lite model.
+    :param str weights: path to .h5 weights
+    :param str output: path to .tflite file
+    :param str quantization: "none", "dynamic" (int8 weights), "float16" (float16 weights) or "int8" (int8 weights and activations)
+    :param numpy.array calibration_images: normalized images of shape (n, 256, 256, 1), required for "int8"
+    :return str: path to .tflite file
+    """
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"quantization has to be one of {QUANTIZATIONS}, got {quantization}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(build_keras_model(weights))
+
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if calibration_images is None:
+            raise ValueError("int8 quantization needs calibration_images")
+
+        def representative_dataset():
+            for image in calibration_images:
+                yield [image[None].astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # input and output stay float32, so model is drop-in replacement of keras model
+
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+    return output
+
+
+class TFLiteModel:
+    """
+    TensorFlow Lite interpreter with predict_on_batch() of keras model, so it can be used instead of it.
+    Interpreter is not thread safe, calls are serialized with lock.
+    """
+
+    def __init__(self, path, num_threads=None):
+        """
+        :param str path: path to .tflite model
+        :param int num_threads: number of CPU threads of interpreter, if None all cores are used
+        """
+        import tensorflow as tf
+
+        self.path = path
+        self._interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads or os.cpu_count())
+        self._input = self._interpreter.get_input_details()[0]["index"]
+        self._output = self._interpreter.get_output_details()[0]["index"]
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, x):
+        """
+        Predicts masks of batch of images.
+        :param numpy.array x: normalized images of shape (n, 256, 256, 1)
+        :return numpy.array: predicted masks of shape (n, 256, 256, 1)
+        """
+        x = np.asarray(x, dtype=np.float32)
+        with self._lock:
+            # interpreter has fixed input shape, it is resized only when batch size changes
+            if x.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input, list(x.shape))
+                self._interpreter.allocate_tensors()
+                self._batch_size = x.shape[0]
+            self._interpreter.set_tensor(self._input, x)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output).copy()
+
+    def predict(self, x, **kwargs):
+        return self.predict_on_batch(x)
+
+
+def weights_hash(path):
+    """
+    Identity of weights file, results made with the same weights (webapp cache, archive, batch runs) share it.
+    :param str path: path to .h5 weights or .tflite model
+    :return str: first 16 characters of sha1 of file
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def load_model(path, num_threads=None):
+    """
+    Loads SCSS-Net for inference, backend is selected by extension of file: .tflite for TensorFlow Lite,
+    otherwise keras model with .h5 weights.
+    :param str path: path to .h5 weights or .tflite model
+    :param int num_threads: number of CPU threads of TensorFlow Lite interpreter
+    :return: model with predict_on_batch() method
+    """
+    if path.endswith(".tflite"):
+        return TFLiteModel(path, num_threads)
+    return build_keras_model(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export SCSS-Net to TensorFlow Lite")
+    parser.add_argument("--weights", required=True, help="path to .h5 weights")
+    parser.add_argument("--output", required=True, help="path to .tflite file")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="float16")
+    parser.add_argument("--calibration", default=None, help="glob pattern of images for int8 calibration")
+    parser.add_argument("--calibration-size", type=int, default=200)
+    args = parser.parse_args()
+
+    calibration_images = None
+    if args.calibration:
+        calibration_images = load_images(args.calibration, args.calibration_size)
+
+    export_tflite(args.weights, args.output, args.quantization, calibration_images)
+    print(f"model saved to {args.output} ({os.path.getsize(args.output) / 1024 ** 2:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
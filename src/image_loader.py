@@ -0,0 +1,137 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+"""
+Shared loader of grayscale model inputs, replaces np.array(Image.open(p).convert("L").resize((IMG_SIZE, IMG_SIZE))).
+
+Images are decoded as uint8 into preallocated batch buffers in thread pool (PIL releases GIL while decoding),
+conversion to float32 is left to normalize(), right before model input.
+
+With reduce=True images are reduced already while decoding: JPEG decoder is put to draft mode, so it decodes only
+luminance at 1/2, 1/4 or 1/8 of resolution (DCT scaling), other formats are first reduced by integer factor and only
+then resampled. Reduced decode gives slightly different pixel values than full decode followed by bicubic resize (mean
+difference is below one gray level, larger only at noisy pixels and sharp edges), so it is only opt-in (previews,
+benchmarks). Default reduce=False reproduces old idiom exactly, model inputs and masks are the same as in training.
+
+example:
+    x = normalize(load_batch(glob.glob("../data/train_test_data/CH_test_imgs/*.png"), IMG_SIZE))
+
+    for paths, batch in iter_batches(paths, batch_size=32):
+        y_pred = model.predict_on_batch(normalize(batch))
+"""
+
+IMG_SIZE = 256
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+        return _executor
+
+
+def open_reduced(path, img_size=IMG_SIZE, reduce=False):
+    """
+    Opens image as grayscale image of size (img_size, img_size).
+    :param str path: path to image
+    :param int img_size: size of output image
+    :param bool reduce: reduce resolution while decoding (faster, pixels differ slightly), False gives the same result
+        as .convert("L").resize()
+    :return PIL.Image: image in mode "L"
+    """
+    img = Image.open(path)
+    if reduce and img.format == "JPEG":
+        # decoder outputs only luminance at the smallest scale which is still at least img_size
+        img.draft("L", (img_size, img_size))
+    if img.mode != "L":
+        img = img.convert("L")
+    if img.size != (img_size, img_size):
+        # reducing_gap first reduces image by integer factor with box filter, bicubic resampling then works on small image
+        img = img.resize((img_size, img_size), Image.BICUBIC, reducing_gap=2.0 if reduce else None)
+    return img
+
+
+def load(path, img_size=IMG_SIZE, reduce=False):
+    """
+    :param str path: path to image
+    :param int img_size: size of output image
+    :param bool reduce: reduce resolution while decoding
+    :return numpy.array: uint8 array of shape (img_size, img_size)
+    """
+    return np.asarray(open_reduced(path, img_size, reduce), dtype=np.uint8)
+
+
+def load_batch(paths, img_size=IMG_SIZE, out=None, workers=None, reduce=False):
+    """
+    Decodes images in parallel into one uint8 buffer.
+    :param list paths: paths to images
+    :param int img_size: size of output images
+    :param numpy.array out: preallocated uint8 buffer of shape (>= len(paths), img_size, img_size[, 1]), eg. memory map
+    :param int workers: number of decoding threads, None uses shared thread pool of module
+    :param bool reduce: reduce resolution while decoding
+    :return numpy.array: uint8 array of shape (len(paths), img_size, img_size, 1), view of out if it was provided
+    """
+    if out is None:
+        out = np.empty((len(paths), img_size, img_size, 1), dtype=np.uint8)
+    batch = out[:len(paths)]
+    target = batch.reshape(len(paths), img_size, img_size)
+
+    def decode_into(i):
+        target[i] = open_reduced(paths[i], img_size, reduce)
+
+    if workers == 1 or len(paths) <= 1:
+        for i in range(len(paths)):
+            decode_into(i)
+    elif workers is None:
+        list(_get_executor().map(decode_into, range(len(paths))))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(decode_into, range(len(paths))))
+    return batch
+
+
+def iter_batches(paths, batch_size, img_size=IMG_SIZE, workers=None, reduce=False):
+    """
+    Generator of uint8 batches, next batch is decoded in background while current batch is used. Two buffers are
+    allocated and reused, so yielded batch is valid only until next batch is requested.
+    :param list paths: paths to images
+    :param int batch_size: size of batch
+    :param int img_size: size of output images
+    :param int workers: number of decoding threads of every batch, None uses shared thread pool
+    :param bool reduce: reduce resolution while decoding
+    :return: generator of (list of paths, uint8 numpy.array of shape (n, img_size, img_size, 1))
+    """
+    buffers = [np.empty((batch_size, img_size, img_size, 1), dtype=np.uint8) for _ in range(2)]
+    starts = list(range(0, len(paths), batch_size))
+    # one background thread for whole batch, images of batch are decoded by pool of load_batch()
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        def submit(n):
+            batch_paths = paths[starts[n]:starts[n] + batch_size]
+            return batch_paths, prefetcher.submit(load_batch, batch_paths, img_size, buffers[n % 2], workers, reduce)
+
+        pending = submit(0) if starts else None
+        for n in range(len(starts)):
+            batch_paths, future = pending
+            batch = future.result()
+            pending = submit(n + 1) if n + 1 < len(starts) else None
+            yield batch_paths, batch
+
+
+def normalize(batch, out=None):
+    """
+    Converts uint8 images to float32 model input in range (0; 1), the same values as np.asarray(x, np.float32)/255.
+    :param numpy.array batch: uint8 images
+    :param numpy.array out: preallocated float32 buffer of the same shape
+    :return numpy.array: float32 images
+    """
+    if out is None:
+        out = np.empty(batch.shape, dtype=np.float32)
+    return np.divide(batch, np.float32(255), out=out)
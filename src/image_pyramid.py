@@ -0,0 +1,185 @@
+import argparse
+import glob
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import image_loader
+
+"""
+Precomputed renditions of archive images, so webapp and batch tools never decode and resample full-size images:
+
+    model   - 256x256 grayscale model input, stored as raw uint8 .npy (loading is one read, no decoding)
+    display - 1024x1024 image for overlays, stored as PNG for PNG sources (lossless 171A images stay lossless) and as
+              JPEG (quality 95) for other sources
+
+Renditions of image <archive>/<name>.<ext> are stored in <root>/<archive folder name>_<hash of archive path>/<level>/
+<name>.<npy|png|jpg>, so archives with the same folder name in different places do not share renditions.
+Rendition is used only if it is newer than source image, otherwise source image is decoded as before, so pyramid
+can be built incrementally while archive grows. Sources which already have display size are not duplicated, empty
+marker <name>.<png|jpg>.source is stored instead, so they count as up to date and display of them is the source.
+
+example (run from src folder):
+    python image_pyramid.py --images "../data/imgs/imgs_195_96-21/*.jpg" "../data/imgs/imgs_171_96-21/*.png"
+        "../data/imgs/imgs_195_cropped_96-21/*.png" --workers 8
+
+    x = load_model_input("../data/imgs/imgs_171_96-21/20020131_0113_eit171_1024.png")
+"""
+
+PYRAMID_DIR = "../data/pyramid/"
+MODEL_SIZE = 256
+DISPLAY_SIZE = 1024
+LEVELS = ("model", "display")
+
+
+def rendition_path(path, level, root=PYRAMID_DIR):
+    """
+    :param str path: path to source image
+    :param str level: "model" or "display"
+    :param str root: root folder of pyramid
+    :return str: path to rendition of image
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    archive = f"{os.path.basename(folder)}_{hashlib.sha1(folder.encode()).hexdigest()[:8]}"
+    name, ext = os.path.splitext(os.path.basename(path))
+    if level == "model":
+        ext = ".npy"
+    else:
+        ext = ".png" if ext.lower() == ".png" else ".jpg"
+    return os.path.join(root, archive, level, name + ext)
+
+
+def _source_marker(rendition):
+    # marker of display rendition which is the source image itself
+    return rendition + ".source"
+
+
+def _fresh_rendition(path, level, root):
+    # path of up to date rendition, source path if display rendition is the source, None if rendition is missing or old
+    if root is None:
+        return None
+    rendition = rendition_path(path, level, root)
+    candidates = [(rendition, rendition)]
+    if level == "display":
+        candidates.append((_source_marker(rendition), path))
+    for candidate, result in candidates:
+        try:
+            if os.stat(candidate).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                return result
+        except OSError:
+            pass
+    return None
+
+
+def _needs_display(img):
+    # source of display size is opened directly, copy would not decode faster
+    return img.size != (DISPLAY_SIZE, DISPLAY_SIZE)
+
+
+def build_renditions(path, root=PYRAMID_DIR, overwrite=False):
+    """
+    Creates missing or outdated renditions of one image.
+    :param str path: path to source image
+    :param str root: root folder of pyramid
+    :param bool overwrite: create renditions even if they are up to date
+    :return int: number of created renditions
+    """
+    levels = [level for level in LEVELS if overwrite or _fresh_rendition(path, level, root) is None]
+    if not levels:
+        return 0
+
+    img = Image.open(path)
+    created = 0
+    for level in levels:
+        rendition = rendition_path(path, level, root)
+        os.makedirs(os.path.dirname(rendition), exist_ok=True)
+        tmp = rendition + ".tmp"
+        if level == "model":
+            # full decode, the same input as image_loader gives to model without pyramid
+            with open(tmp, "wb") as f:
+                np.save(f, image_loader.load(path, MODEL_SIZE))
+        elif _needs_display(img):
+            display = img.resize((DISPLAY_SIZE, DISPLAY_SIZE))
+            if rendition.endswith(".png"):
+                display.save(tmp, format="PNG")
+            else:
+                if display.mode not in ("L", "RGB"):
+                    display = display.convert("RGB")
+                display.save(tmp, format="JPEG", quality=95)
+        else:
+            open(tmp, "wb").close()
+            rendition = _source_marker(rendition)
+        os.replace(tmp, rendition)
+        created += 1
+    return created
+
+
+def _build_task(task):
+    return build_renditions(*task)
+
+
+def build(paths, root=PYRAMID_DIR, workers=None, overwrite=False):
+    """
+    Creates renditions of all images in process pool, up to date renditions are skipped.
+    :param list paths: paths to source images
+    :param str root: root folder of pyramid
+    :param int workers: number of processes, defaults to number of CPU cores
+    :param bool overwrite: create all renditions again
+    :return int: number of created renditions
+    """
+    tasks = [(path, root, overwrite) for path in sorted(paths)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        created = sum(executor.map(_build_task, tasks, chunksize=32))
+    elapsed = time.perf_counter() - start
+    print(f"{created} renditions of {len(tasks)} images created in {elapsed:.1f} s")
+    return created
+
+
+def load_model_input(path, root=PYRAMID_DIR, img_size=MODEL_SIZE):
+    """
+    Grayscale model input of image, from pyramid if rendition is up to date, decoded from source image otherwise.
+    :param str path: path to source image
+    :param str root: root folder of pyramid, None to always decode source image
+    :param int img_size: size of model input
+    :return numpy.array: uint8 array of shape (img_size, img_size)
+    """
+    rendition = _fresh_rendition(path, "model", root) if img_size == MODEL_SIZE else None
+    if rendition is not None:
+        return np.load(rendition)
+    return image_loader.load(path, img_size)
+
+
+def open_display(path, root=PYRAMID_DIR):
+    """
+    Image of display size, from pyramid if rendition is up to date, decoded from source image otherwise.
+    :param str path: path to source image
+    :param str root: root folder of pyramid, None to always decode source image
+    :return PIL.Image: decoded image of size (DISPLAY_SIZE, DISPLAY_SIZE)
+    """
+    rendition = _fresh_rendition(path, "display", root)
+    img = Image.open(rendition if rendition is not None else path)
+    if img.size != (DISPLAY_SIZE, DISPLAY_SIZE):
+        return img.resize((DISPLAY_SIZE, DISPLAY_SIZE))
+    img.load()
+    return img
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build multi-resolution renditions of archive images")
+    parser.add_argument("--images", nargs="+", required=True, help="glob patterns of images")
+    parser.add_argument("--root", default=PYRAMID_DIR, help="root folder of pyramid")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    paths = [path for pattern in args.images for path in glob.glob(pattern)]
+    build(paths, args.root, args.workers, args.overwrite)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import http.client
+import json
+import queue
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+"""
+Local inference service of SCSS-Net shared by webapp sessions and batch jobs. One warm model per event (CH, AR) is kept
+in server process, concurrent requests are queued and coalesced to dynamic batches: batch is sent to model when it is
+full or when the oldest request waited max_latency_ms, so single user pays at most max_latency_ms for batching and
+many users share one predict call.
+
+Protocol (HTTP on localhost, raw float32 arrays, no serialization):
+    POST /predict/<event>  body: float32 images (n, 256, 256, 1), header X-Shape: n,256,256,1
+                           response: float32 predictions, header X-Shape
+    GET  /stats            json with number of requests and batches of every event
+    GET  /info             json with identity of weights of every event (export_model.weights_hash(), "random-..." for
+                           random weights), clients use it in keys of cached results
+
+example (run from src folder):
+    python inference_server.py --ch ../modeling/ch_model.h5 --ar ../modeling/ar_model.h5 --port 8765 --max-latency-ms 10
+
+    client = InferenceClient("http://127.0.0.1:8765")
+    y_pred = client.predict("CH", x)
+"""
+
+IMG_SIZE = 256
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests to batches and runs them in one worker thread.
+    """
+
+    def __init__(self, predict, max_batch_size=16, max_latency_ms=10.0):
+        """
+        :param callable predict: function (numpy.array batch) -> numpy.array predictions
+        :param int max_batch_size: maximal number of images in one predict call
+        :param float max_latency_ms: maximal time the oldest request waits for more requests
+        """
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.requests = 0
+        self.batches = 0
+        self.images = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, x):
+        """
+        :param numpy.array x: images of shape (n, height, width, 1), n can be bigger than max_batch_size
+        :return concurrent.futures.Future: future of predictions of shape (n, height, width, 1)
+        """
+        future = Future()
+        self._queue.put((x, future))
+        return future
+
+    def _collect(self):
+        # blocks for first request, then waits for more until batch is full or latency budget is spent
+        pending = [self._queue.get()]
+        size = len(pending[0][0])
+        deadline = time.perf_counter() + self.max_latency
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(request)
+            size += len(request[0])
+        return pending
+
+    def _loop(self):
+        while True:
+            pending = self._collect()
+            try:
+                x = np.concatenate([request[0] for request in pending])
+                y_pred = np.asarray(self.predict(x))
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            self.requests += len(pending)
+            self.batches += 1
+            self.images += len(x)
+            start = 0
+            for request, future in pending:
+                future.set_result(y_pred[start:start + len(request)])
+                start += len(request)
+
+    def stats(self):
+        """
+        :return dict: number of requests, batches, images and mean batch size
+        """
+        return {"requests": self.requests, "batches": self.batches, "images": self.images,
+                "mean_batch_size": self.images / self.batches if self.batches else 0.0,
+                "queued": self._queue.qsize()}
+
+
+def _handler(batchers, info):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                body = {event: batcher.stats() for event, batcher in batchers.items()}
+            elif self.path == "/info":
+                body = {event: {"weights": info.get(event)} for event in batchers}
+            else:
+                self._send(404, b"not found")
+                return
+            self._send(200, json.dumps(body).encode(), {"Content-Type": "application/json"})
+
+        def do_POST(self):
+            event = self.path.rsplit("/", 1)[-1]
+            if not self.path.startswith("/predict/") or event not in batchers:
+                self._send(404, f"unknown event {event}".encode())
+                return
+            try:
+                shape = tuple(int(size) for size in self.headers["X-Shape"].split(","))
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                x = np.frombuffer(body, dtype=np.float32).reshape(shape)
+                y_pred = batchers[event].submit(x).result()
+            except Exception as e:
+                self._send(500, str(e).encode())
+                return
+            y_pred = np.ascontiguousarray(y_pred, dtype=np.float32)
+            self._send(200, y_pred.tobytes(), {"Content-Type": "application/octet-stream",
+                                               "X-Shape": ",".join(str(size) for size in y_pred.shape)})
+
+        def log_message(self, format, *args):
+            # one line per request would flood the console
+            pass
+
+    return Handler
+
+
+def serve(models, host="127.0.0.1", port=8765, max_batch_size=16, max_latency_ms=10.0, warm_up=True, info=None):
+    """
+    Starts inference server, blocks until interrupted.
+    :param dict models: event -> model with predict_on_batch() method
+    :param dict info: event -> identity of weights of model, returned by GET /info
+    :param str host: host, keep localhost, server has no authentication
+    :param int port: port
+    :param int max_batch_size: maximal number of images in one predict call
+    :param float max_latency_ms: maximal time the oldest request waits for more requests
+    :param bool warm_up: run one dummy batch through every model before server accepts requests
+    """
+    server = make_server(models, host, port, max_batch_size, max_latency_ms, warm_up, info)
+    print(f"serving {', '.join(models)} on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def make_server(models, host="127.0.0.1", port=8765, max_batch_size=16, max_latency_ms=10.0, warm_up=True, info=None):
+    """
+    Creates inference server without starting it, see serve(). Port 0 selects free port.
+    :return http.server.ThreadingHTTPServer: server, call serve_forever() to start it
+    """
+    batchers = {}
+    for event, model in models.items():
+        if warm_up:
+            model.predict_on_batch(np.zeros((1, IMG_SIZE, IMG_SIZE, 1), dtype=np.float32))
+        batchers[event] = MicroBatcher(model.predict_on_batch, max_batch_size, max_latency_ms)
+
+    server = ThreadingHTTPServer((host, port), _handler(batchers, info or {}))
+    server.daemon_threads = True
+    server.batchers = batchers
+    return server
+
+
+class InferenceClient:
+    """
+    Client of inference server, every thread keeps its own keep-alive connection.
+    """
+
+    def __init__(self, url, timeout=60.0):
+        """
+        :param str url: url of server, eg. http://127.0.0.1:8765
+        :param float timeout: timeout of one request in seconds
+        """
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._local.connection
+
+    def _request(self, method, path, body=None, headers=None):
+        # connection closed by server is opened again once
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                return response, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def predict(self, event, x):
+        """
+        :param str event: "CH" or "AR"
+        :param numpy.array x: normalized images of shape (n, 256, 256, 1)
+        :return numpy.array: predictions of shape (n, 256, 256, 1)
+        """
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        response, body = self._request("POST", f"/predict/{event}", x.tobytes(),
+                                       {"X-Shape": ",".join(str(size) for size in x.shape),
+                                        "Content-Type": "application/octet-stream"})
+        if response.status != 200:
+            raise RuntimeError(f"inference server returned {response.status}: {body.decode(errors='replace')}")
+        shape = tuple(int(size) for size in response.getheader("X-Shape").split(","))
+        return np.frombuffer(body, dtype=np.float32).reshape(shape)
+
+    def stats(self):
+        """
+        :return dict: event -> statistics of micro-batcher
+        """
+        response, body = self._request("GET", "/stats")
+        return json.loads(body)
+
+    def info(self):
+        """
+        :return dict: event -> {"weights": identity of weights served for event}
+        """
+        response, body = self._request("GET", "/info")
+        if response.status != 200:
+            raise RuntimeError(f"inference server returned {response.status}: {body.decode(errors='replace')}")
+        return json.loads(body)
+
+    def model_id(self, event):
+        """
+        :param str event: "CH" or "AR"
+        :return str: identity of weights of event in server, see export_model.weights_hash()
+        """
+        model_id = self.info().get(event, {}).get("weights")
+        if model_id is None:
+            raise RuntimeError(f"inference server does not serve {event} model")
+        return model_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local micro-batching inference server of SCSS-Net")
+    parser.add_argument("--ch", default=None, help='CH model, .h5 weights, .tflite model or "random"')
+    parser.add_argument("--ar", default=None, help='AR model, .h5 weights, .tflite model or "random"')
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-latency-ms", type=float, default=10.0)
+    parser.add_argument("--threads", type=int, default=None, help="TensorFlow Lite threads")
+    args = parser.parse_args()
+
+    from export_model import build_keras_model, load_model, weights_hash
+
+    models = {}
+    info = {}
+    for event, path in [("CH", args.ch), ("AR", args.ar)]:
+        if path == "random":
+            # random weights, for load tests without trained models
+            models[event] = build_keras_model(None)
+            # new random weights on every start, results of older start are not reused
+            info[event] = f"random-{uuid.uuid4().hex[:8]}"
+        elif path:
+            models[event] = load_model(path, args.threads)
+            info[event] = weights_hash(path)
+    if not models:
+        parser.error("at least one of --ch and --ar is required")
+
+    serve(models, args.host, args.port, args.max_batch_size, args.max_latency_ms, info=info)
+
+
+if __name__ == "__main__":
+    main()
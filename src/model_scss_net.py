@@ -1,10 +1,12 @@
 
+import numpy as np
 from tensorflow import keras
 from keras.models import Model
 from keras.layers import (
     BatchNormalization,
     Conv2D,
     Conv2DTranspose,
+    SeparableConv2D,
     MaxPooling2D,
     Dropout,
     UpSampling2D,
@@ -14,7 +16,10 @@ from keras.layers import (
 )
 
 
-def conv2_block(inputs, filters, batch_norm=True):
+DECODERS = ("transpose", "bilinear")
+
+
+def conv2_block(inputs, filters, batch_norm=True, separable=False):
     """   Convolution block used in encoder (left-side) of neural network.
 
     Args:
@@ -24,12 +29,17 @@ def conv2_block(inputs, filters, batch_norm=True):
 
         batch_norm (bool, optional): to determine usage of batch noramlization. Defaults to True.
 
+        separable (bool, optional): to use depthwise-separable convolutions. Defaults to False.
+
     Returns:
         numpy.array: output tensor
     """
     tensor = inputs
     for block in range(2):
-        tensor = Conv2D(filters=filters, kernel_size=(3, 3), padding="same")(tensor)
+        if separable:
+            tensor = SeparableConv2D(filters=filters, kernel_size=(3, 3), padding="same")(tensor)
+        else:
+            tensor = Conv2D(filters=filters, kernel_size=(3, 3), padding="same")(tensor)
         if batch_norm:
             tensor = BatchNormalization()(tensor)
         tensor = Activation("relu")(tensor)
@@ -58,10 +68,14 @@ def deconv2_block(inputs, filters, batch_norm=True):
     return tensor
 
 
-def scss_net(input_shape, filters, layers=4, batch_norm=True, drop_prob=0.0):
+def scss_net(input_shape, filters, layers=4, batch_norm=True, drop_prob=0.0, separable=False, width_multiplier=1.0,
+             decoder="transpose"):
     """using tensorflow functional API, customizes U-Net[1] architecture for segmentation of solar active regions.
     [1]: https://arxiv.org/abs/1505.04597
 
+    Default arguments build the original SCSS-Net, so trained weights can be loaded. Other arguments build variants
+    with less FLOPs for CPU inference, they have to be trained (see benchmarks/architecture_report.py).
+
     Args:
         input_shape (numpy.array): input shape of image (height, width, depth)
 
@@ -73,9 +87,20 @@ def scss_net(input_shape, filters, layers=4, batch_norm=True, drop_prob=0.0):
 
         drop_prob (float, optional): dropout probability. Defaults to 0.0.
 
+        separable (bool, optional): depthwise-separable convolutions in encoder and decoder. Defaults to False.
+
+        width_multiplier (float, optional): number of filters of every layer is multiplied by it. Defaults to 1.0.
+
+        decoder (str, optional): "transpose" - nearest upsampling and transposed convolutions (original),
+        "bilinear" - bilinear upsampling and regular convolutions. Defaults to "transpose".
+
     Returns:
         tf.keras.Model: model of SCSS-Net. Ready to use with eg. model.compile() and model.fit() and model.predict() or model.evaluate()
     """
+    if decoder not in DECODERS:
+        raise ValueError(f"decoder has to be one of {DECODERS}, got {decoder}")
+
+    filters = max(1, int(round(filters * width_multiplier)))
     dropout = drop_prob != 0.0
     inputs = Input(shape=input_shape, name="input_tensor")
     tensor = inputs
@@ -85,22 +110,29 @@ def scss_net(input_shape, filters, layers=4, batch_norm=True, drop_prob=0.0):
     for layer in range(layers):
         if dropout and layer >= 2:
             tensor = Dropout(drop_prob)(tensor)
-        tensor = conv2_block(tensor, filters, batch_norm)
+        tensor = conv2_block(tensor, filters, batch_norm, separable)
         encoder_layers.append(tensor)
         tensor = MaxPooling2D((2, 2))(tensor)
         filters = filters * 2  # double filters for each layer
     if dropout:
         tensor = Dropout(drop_prob)(tensor)
-    tensor = conv2_block(tensor, filters, batch_norm)  # Last encoder layer
+    tensor = conv2_block(tensor, filters, batch_norm, separable)  # Last encoder layer
 
     # Decoder
     for ii, layer in enumerate(reversed(encoder_layers)):
         if dropout and ii < 2:
             tensor = Dropout(drop_prob)(tensor)
         filters = filters // 2  # decrease filters for each layer
-        tensor = UpSampling2D((2, 2))(tensor)
+        if decoder == "bilinear":
+            tensor = UpSampling2D((2, 2), interpolation="bilinear")(tensor)
+        else:
+            tensor = UpSampling2D((2, 2))(tensor)
         tensor = concatenate([tensor, layer])  # skip connection
-        tensor = deconv2_block(tensor, filters, batch_norm)
+        if decoder == "transpose" and not separable:
+            tensor = deconv2_block(tensor, filters, batch_norm)
+        else:
+            # transposed convolutions have stride 1, so regular convolutions compute the same kind of mapping
+            tensor = conv2_block(tensor, filters, batch_norm, separable)
 
     outputs = Conv2D(filters=1, kernel_size=(1, 1), padding="same")(tensor) 
     outputs = Activation("sigmoid")(outputs)
@@ -108,3 +140,43 @@ def scss_net(input_shape, filters, layers=4, batch_norm=True, drop_prob=0.0):
     model = Model(inputs=inputs, outputs=outputs)
 
     return model
+
+
+def fold_batch_norm(model):
+    """   Folds batch normalization layers of trained model into preceding convolutions for inference.
+    Every BatchNormalization is replaced by identity and weights of its convolution are scaled, so predictions
+    stay the same and inference skips normalization. Folded model can not be trained anymore.
+
+    Args:
+        model (tf.keras.Model): trained model from scss_net()
+
+    Returns:
+        tf.keras.Model: model with folded weights
+    """
+    def clone(layer):
+        if isinstance(layer, BatchNormalization):
+            return Activation("linear", name=layer.name)
+        return layer.__class__.from_config(layer.get_config())
+
+    folded = keras.models.clone_model(model, clone_function=clone)
+
+    # batch normalization follows convolution which produced its input
+    producers = {id(layer.output): layer for layer in model.layers}
+    norms = {producers[id(layer.input)].name: layer for layer in model.layers if isinstance(layer, BatchNormalization)}
+
+    for layer, folded_layer in zip(model.layers, folded.layers):
+        if isinstance(layer, BatchNormalization) or not layer.weights:
+            continue
+        weights = layer.get_weights()
+        norm = norms.get(layer.name)
+        if norm is not None:
+            gamma, beta, mean, variance = norm.get_weights()
+            scale = gamma / np.sqrt(variance + norm.epsilon)
+            # output channels are last axis of kernel, except of transposed convolution (kh, kw, out, in)
+            shape = [1] * weights[-2].ndim
+            shape[-2 if isinstance(layer, Conv2DTranspose) else -1] = -1
+            weights[-2] = weights[-2] * scale.reshape(shape)
+            weights[-1] = (weights[-1] - mean) * scale + beta
+        folded_layer.set_weights(weights)
+
+    return folded
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import numpy as np
 from PIL import Image, ImageDraw
 from tqdm import tqdm
@@ -6,23 +8,83 @@ from tqdm import tqdm
 def crop_limb(img, limb_mask, bg_color=None):
     """
     Crops image background according to provided mask.
-    :param PIL.Image img: image to crop
-    :param PIL.Image limb_mask: binary mask
+    :param img: image to crop, PIL.Image or numpy.array (numpy array is cropped in place)
+    :param limb_mask: packed mask from limb_mask() or disk_mask(), boolean numpy.array or PIL.Image with white disk
     :param list bg_color: background color of cropped image
-    :return PIL.Image: cropped image
+    :return: cropped image, same type as img
     """
     if bg_color is None:
         bg_color = [255, 255, 255]
-    mask = np.array(limb_mask)
+    if isinstance(limb_mask, Image.Image):
+        limb_mask = (np.asarray(limb_mask.convert("RGB")) == 255).all(2)
+
+    if isinstance(img, np.ndarray):
+        return apply_limb_mask(img, limb_mask, bg_color)
+
     img = np.array(img)
-    img[(mask[:, :, 0:3] != [255, 255, 255]).any(2)] = bg_color
+    apply_limb_mask(img, limb_mask, bg_color)
     cropped = Image.fromarray(img)
     return cropped
 
 
+@lru_cache(maxsize=16)
+def _disk_mask(img_size, bbox):
+    mask = Image.new("1", img_size, 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse(list(bbox), fill=1)
+    packed = np.packbits(np.asarray(mask), axis=1)
+    packed.setflags(write=False)
+    return packed
+
+
+def disk_mask(img_size, bbox):
+    """
+    Creates mask of disk inscribed in bounding box. Mask is packed to 1 bit per pixel and cached, so the same mask
+    is shared by all images of the same size and disk.
+    :param tuple img_size: (width, height) of image
+    :param tuple bbox: (left, top, right, bottom) of disk
+    :return numpy.array: read-only packed mask of shape (height, ceil(width / 8)), use apply_limb_mask() to apply it
+    """
+    return _disk_mask(tuple(img_size), tuple(bbox))
+
+
+def limb_mask(img_size=(4096, 4096), radius=1645, center=None):
+    """
+    Creates packed mask of sun's disk according to provided radius of sun, see disk_mask().
+    :param tuple img_size: (width, height) of sun image
+    :param int radius: solar radius
+    :param tuple center: (x, y) center of sun, if None center of image is used
+    :return numpy.array: read-only packed mask of shape (height, ceil(width / 8))
+    """
+    if center is None:
+        center = (img_size[0] // 2, img_size[1] // 2)
+    return disk_mask(img_size, (center[0] - radius, center[1] - radius, center[0] + radius, center[1] + radius))
+
+
+def apply_limb_mask(img, mask, bg_color=255, block_rows=256):
+    """
+    Sets pixels out of disk to background color in place. Packed mask is unpacked only in blocks of rows,
+    so no full size temporary array is allocated.
+    :param numpy.array img: uint8 image of shape (height, width) or (height, width, channels)
+    :param numpy.array mask: packed mask from disk_mask() or boolean mask of shape (height, width)
+    :param bg_color: background color, number or list with value for each channel
+    :param int block_rows: number of rows unpacked at once
+    :return numpy.array: the same img
+    """
+    height, width = img.shape[:2]
+    packed = mask.dtype != bool
+    for row in range(0, height, block_rows):
+        block = mask[row:row + block_rows]
+        if packed:
+            block = np.unpackbits(block, axis=1, count=width).view(bool)
+        img[row:row + block_rows][~block] = bg_color
+    return img
+
+
 def rotate_imgs(imgs_list, extension="png", path=None):
     """
     Rotates imgs in 90, 180 and 270 degrees and saves them to file.
+    Rotations can be done in memory during training with data_pipeline.make_dataset() instead.
     :param list imgs_list: list of paths to img provided by by glob module
     :param str extension: extension of images
     :param str path: path where to save images, if None img is save to same path as original image
@@ -35,33 +97,24 @@ def rotate_imgs(imgs_list, extension="png", path=None):
             path = img.replace(f".{extension}", "").split("\\")[0]
         img = Image.open(img)
         for angle in angles:
-            img = img.rotate(angle)
-            img.save(f"{path}/{fname}_r{angle}.{extension}")
+            # every angle is applied to the original image, not to the previous rotation
+            rotated = img.rotate(angle)
+            rotated.save(f"{path}/{fname}_r{angle}.{extension}")
 
 
 def create_limb_mask(img_size=(4096, 4096), radius=1645, name="limb_mask.png"):
     """
-    Create limb mask according to provided radius of sun.
+    Create limb mask according to provided radius of sun and save it to file. Masks for cropping do not have
+    to be saved, use limb_mask() instead.
     :param tuple img_size: size of sun image
     :param int radius: solar radius
     :param str name: name of limb mask file
     :return:
     """
-    limb_mask = Image.new("RGB", img_size, (0, 0, 0))
-    draw = ImageDraw.Draw(limb_mask)
-    draw.arc(
-        [
-            img_size[0] // 2 - radius,
-            img_size[1] // 2 - radius,
-            img_size[0] // 2 + radius,
-            img_size[1] // 2 + radius,
-        ],
-        start=0,
-        end=360,
-        fill=(255, 255, 255),
-        width=img_size[0] // 2,
-    )
-    limb_mask.save(name)
+    mask = np.unpackbits(limb_mask(img_size, radius), axis=1, count=img_size[0]).view(bool)
+    limb_mask_img = np.zeros((img_size[1], img_size[0], 3), dtype=np.uint8)
+    limb_mask_img[mask] = 255
+    Image.fromarray(limb_mask_img).save(name)
 
 
 def create_labels_img(coord_list, name, flip=True):
@@ -0,0 +1,368 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+"""
+Compact archive of segmentation results of one event (CH or AR). Results are stored in compressed columnar chunks
+(np.savez_compressed), every column is a separate member of chunk, so scanning coverage of 1996 - 2021 does not
+decompress masks nor polygons. Columns of chunk:
+
+    dates        - "YYYY-MM-DD", one row per date
+    masks        - bit-packed binary masks, shape (n, height, width / 8)
+    coverage     - area coverage of Sun's disk in %
+    disk_area    - area of Sun's disk in pixels of mask
+    n_regions    - number of polygons
+    points       - points of all polygons of chunk, shape (n_points, 2)
+    poly_offsets - polygon i is points[poly_offsets[i]:poly_offsets[i + 1]]
+    row_offsets  - polygons of row j are poly_offsets[row_offsets[j]:row_offsets[j + 1]]
+    mask_width   - width of masks before bit-packing
+    polygon_size - (width, height) of image in which polygon coordinates are given
+
+Chunks are never rewritten on append, new dates go to new chunk and index.json maps every date to (chunk, row).
+Chunk without any date in index is deleted, compact() rewrites live rows of partly replaced chunks. Every chunk records
+identity of weights it was made with (sha1 from export_model.weights_hash()), read() with weights skips dates made by
+other weights, so archive of old model is not shown after retraining.
+
+example (run from src folder):
+    python segmentation_archive.py --run ../data/predictions_ar/ --archive ../data/archive/AR/
+
+    archive = SegmentationArchive("../data/archive/AR/")
+    result = archive.read("2012-01-26", weights=weights_hash("../modeling/ar_model.h5"))
+    coverage = archive.scan("1996-01-01", "2021-12-31", columns=("coverage",))
+"""
+
+COLUMNS = ["dates", "masks", "coverage", "disk_area", "n_regions", "points", "poly_offsets", "row_offsets"]
+STATS = ["coverage", "disk_area", "n_regions"]
+
+
+class SegmentationArchive:
+    """
+    Append-only archive of segmentation results with date index.
+    """
+
+    def __init__(self, directory, cached_chunks=4):
+        """
+        :param str directory: folder of archive, it is created if it does not exist
+        :param int cached_chunks: number of recently read chunk columns kept in memory
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cached_chunks = cached_chunks
+        self._load_index()
+
+    def _load_index(self):
+        index_path = os.path.join(self.directory, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+        else:
+            index = {"chunks": [], "dates": {}}
+        self._chunks = index["chunks"]
+        self._dates = index["dates"]
+        self._sorted_dates = sorted(self._dates)
+
+    def _save_index(self):
+        index_path = os.path.join(self.directory, "index.json")
+        with open(index_path + ".tmp", "w") as f:
+            json.dump({"chunks": self._chunks, "dates": self._dates}, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    def __len__(self):
+        return len(self._dates)
+
+    def __contains__(self, date):
+        return _date_str(date) in self._dates
+
+    def dates(self):
+        """
+        :return list: all archived dates in format %Y-%m-%d, sorted
+        """
+        return list(self._sorted_dates)
+
+    def append(self, dates, masks, polygons, coverage, disk_area, polygon_size=(1024, 1024), weights=None):
+        """
+        Writes results of dates to new chunk. Dates which are already in archive are replaced in index, chunks
+        without any date left are deleted.
+        :param list dates: dates (datetime.date or string %Y-%m-%d)
+        :param numpy.array masks: binary masks of shape (n, height, width[, 1]), bool or thresholded uint8
+        :param list polygons: for every date list of polygons (arrays of shape (n_points, 2) or lists of tuples)
+        :param list coverage: area coverage of every date in %
+        :param list disk_area: area of Sun's disk of every date in pixels of mask
+        :param tuple polygon_size: (width, height) of image in which polygon coordinates are given
+        :param str weights: identity of weights results were made with, see export_model.weights_hash()
+        :return str: name of new chunk
+        """
+        dates = [_date_str(date) for date in dates]
+        masks = np.asarray(masks)
+        masks = masks.reshape(masks.shape[0], masks.shape[1], masks.shape[2]).astype(bool, copy=False)
+
+        points = []
+        poly_offsets = [0]
+        row_offsets = [0]
+        for row_polygons in polygons:
+            for polygon in row_polygons:
+                polygon = np.asarray(polygon, dtype=np.float32).reshape(-1, 2)
+                points.append(polygon)
+                poly_offsets.append(poly_offsets[-1] + len(polygon))
+            row_offsets.append(len(poly_offsets) - 1)
+
+        with self._lock:
+            name = f"chunk_{len(self._chunks):05d}.npz"
+            np.savez_compressed(
+                os.path.join(self.directory, name),
+                dates=np.array(dates),
+                masks=np.packbits(masks, axis=-1),
+                mask_width=np.array(masks.shape[2]),
+                polygon_size=np.asarray(polygon_size, dtype=np.int32),
+                coverage=np.asarray(coverage, dtype=np.float32),
+                disk_area=np.asarray(disk_area, dtype=np.int32),
+                n_regions=np.diff(row_offsets).astype(np.int32),
+                points=np.concatenate(points) if points else np.zeros((0, 2), dtype=np.float32),
+                poly_offsets=np.asarray(poly_offsets, dtype=np.int64),
+                row_offsets=np.asarray(row_offsets, dtype=np.int64),
+            )
+            self._chunks.append({"file": name, "first": min(dates), "last": max(dates), "weights": weights})
+            for row, date in enumerate(dates):
+                self._dates[date] = [len(self._chunks) - 1, row]
+            self._sorted_dates = sorted(self._dates)
+            dead = self._dead_chunks()
+            for chunk_id in dead:
+                self._chunks[chunk_id]["file"] = None
+            # index is saved before files are removed, so it never points to deleted chunk
+            self._save_index()
+            self._forget(dead)
+        return name
+
+    def _live_rows(self):
+        rows = {}
+        for date, (chunk_id, row) in self._dates.items():
+            rows.setdefault(chunk_id, []).append(row)
+        return rows
+
+    def _dead_chunks(self):
+        live = self._live_rows()
+        return [chunk_id for chunk_id, chunk in enumerate(self._chunks)
+                if chunk["file"] is not None and chunk_id not in live]
+
+    def _forget(self, chunk_ids):
+        for chunk_id in chunk_ids:
+            name = f"chunk_{chunk_id:05d}.npz"
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            for column in COLUMNS:
+                self._cache.pop((chunk_id, column), None)
+
+    def compact(self, min_live=1.0):
+        """
+        Rewrites chunks in which part of dates was replaced by newer results, live rows of every such chunk are
+        appended as new chunk and the old chunk is deleted.
+        :param float min_live: chunks with smaller fraction of live rows are rewritten, 1.0 rewrites every partly
+            replaced chunk
+        :return int: number of rewritten chunks
+        """
+        rewritten = 0
+        for chunk_id, rows in sorted(self._live_rows().items()):
+            chunk = self._chunks[chunk_id]
+            n_rows = len(self._column(chunk_id, "dates"))
+            if len(rows) >= n_rows or len(rows) / n_rows >= min_live:
+                continue
+            results = [self.read(self._column(chunk_id, "dates")[row]) for row in sorted(rows)]
+            self.append([result["date"] for result in results], np.stack([result["mask"] for result in results]),
+                        [result["polygons"] for result in results], [result["coverage"] for result in results],
+                        [result["disk_area"] for result in results], results[0]["polygon_size"], chunk["weights"])
+            rewritten += 1
+        return rewritten
+
+    def _column(self, chunk_id, column):
+        key = (chunk_id, column)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        # only requested member of npz is decompressed
+        with np.load(os.path.join(self.directory, self._chunks[chunk_id]["file"])) as chunk:
+            value = chunk[column]
+            if column == "masks":
+                value = (value, int(chunk["mask_width"]))
+            elif column == "points":
+                value = (value, tuple(int(size) for size in chunk["polygon_size"]))
+
+        with self._lock:
+            self._cache[key] = value
+            while len(self._cache) > self._cached_chunks * len(COLUMNS):
+                self._cache.popitem(last=False)
+        return value
+
+    def _polygons(self, chunk_id, row):
+        points, _ = self._column(chunk_id, "points")
+        poly_offsets = self._column(chunk_id, "poly_offsets")
+        row_offsets = self._column(chunk_id, "row_offsets")
+        return [points[poly_offsets[i]:poly_offsets[i + 1]] for i in range(row_offsets[row], row_offsets[row + 1])]
+
+    def read(self, date, mask=True, polygons=True, weights=None):
+        """
+        Reads results of one date, columns of recently read chunks are kept in memory, so neighbouring dates are
+        read without decompression.
+        :param date: datetime.date or string %Y-%m-%d
+        :param bool mask: whether to read mask
+        :param bool polygons: whether to read polygons
+        :param str weights: identity of current weights, results made with other weights are not returned,
+            None returns results of any weights
+        :return dict: "date", "coverage", "disk_area", "n_regions", "weights" and optionally "mask" (bool array),
+            "polygons" (list of float32 arrays) and "polygon_size", None if date is not archived
+        """
+        location = self._dates.get(_date_str(date))
+        if location is None:
+            return None
+        chunk_id, row = location
+        chunk_weights = self._chunks[chunk_id].get("weights")
+        if weights is not None and chunk_weights != weights:
+            return None
+
+        result = {"date": _date_str(date), "weights": chunk_weights}
+        for column in STATS:
+            result[column] = self._column(chunk_id, column)[row].item()
+        if mask:
+            packed, width = self._column(chunk_id, "masks")
+            result["mask"] = np.unpackbits(packed[row], axis=-1, count=width).astype(bool)
+        if polygons:
+            result["polygons"] = self._polygons(chunk_id, row)
+            result["polygon_size"] = self._column(chunk_id, "points")[1]
+        return result
+
+    def scan(self, start=None, end=None, columns=("coverage",)):
+        """
+        Reads statistics of all dates in range, only chunks overlapping range are opened and only requested columns
+        are decompressed.
+        :param start: first date (datetime.date or string %Y-%m-%d), None from first archived date
+        :param end: last date (datetime.date or string %Y-%m-%d), None to last archived date
+        :param tuple columns: columns from STATS
+        :return dict: "dates" (numpy array of datetime64[D]) and requested columns, sorted by date
+        """
+        start = "0000-00-00" if start is None else _date_str(start)
+        end = "9999-99-99" if end is None else _date_str(end)
+
+        selected = []
+        for chunk_id, chunk in enumerate(self._chunks):
+            if chunk["file"] is None or chunk["last"] < start or chunk["first"] > end:
+                continue
+            chunk_dates = self._column(chunk_id, "dates")
+            # only rows which are still in index, replaced dates are skipped
+            rows = [row for row, date in enumerate(chunk_dates)
+                    if start <= date <= end and self._dates.get(date) == [chunk_id, row]]
+            if rows:
+                selected.append((chunk_id, np.asarray(rows)))
+
+        dates = np.concatenate([self._column(chunk_id, "dates")[rows] for chunk_id, rows in selected] or [[]])
+        result = {"dates": dates}
+        for column in columns:
+            result[column] = np.concatenate([self._column(chunk_id, column)[rows] for chunk_id, rows in selected] or
+                                            [np.zeros(0, dtype=np.float32)])
+
+        order = np.argsort(dates, kind="stable")
+        return {column: values[order] if column != "dates" else values[order].astype("datetime64[D]")
+                for column, values in result.items()}
+
+    def append_predictions(self, dates, y_pred, disk_area, threshold=0.1, polygon_size=(1024, 1024), epsilon=None,
+                           weights=None):
+        """
+        Archives batch of SCSS-Net predictions, masks are thresholded, contours are created with
+        utils.create_contours_batch() and coverage is computed with disk_geometry.area_coverage().
+        :param list dates: date of every prediction
+        :param numpy.array y_pred: predictions of shape (n, height, width[, 1])
+        :param list disk_area: area of Sun's disk of every prediction in pixels of prediction
+        :param float threshold: probability threshold of mask
+        :param tuple polygon_size: size of image in which polygons will be drawn
+        :param float epsilon: tolerance of polygon simplification in pixels of prediction, None means no simplification
+        :param str weights: identity of weights of predictions, see export_model.weights_hash()
+        :return str: name of new chunk
+        """
+        # utils pulls in tensorflow through metrics, it is needed only when predictions are archived
+        import disk_geometry
+        from utils import create_contours_batch
+
+        y_pred = np.asarray(y_pred)
+        polygons = create_contours_batch(y_pred, polygon_size, threshold=threshold, epsilon=epsilon)
+        coverage = [disk_geometry.area_coverage(prediction, disk, threshold=threshold)
+                    for prediction, disk in zip(y_pred, disk_area)]
+        return self.append(dates, y_pred.reshape(y_pred.shape[:3]) > threshold, polygons, coverage, disk_area,
+                           polygon_size, weights)
+
+    def import_batch_run(self, output, chunk_by="year", polygon_size=(1024, 1024), weights=None):
+        """
+        Imports results of batch_inference.py run (masks/, polygons/ and coverage.csv), one chunk per year.
+        Imported dates replace older results, so reimport of the same run does not grow archive.
+        :param str output: output folder of batch_inference.py run
+        :param str chunk_by: "year" or "month"
+        :param tuple polygon_size: target_size of batch_inference.py run
+        :param str weights: identity of weights of run, defaults to the one recorded in run.json of output
+        :return int: number of imported dates
+        """
+        if weights is None and os.path.exists(os.path.join(output, "run.json")):
+            with open(os.path.join(output, "run.json")) as f:
+                weights = json.load(f).get("weights")
+
+        with open(os.path.join(output, "coverage.csv"), newline="") as f:
+            rows = sorted(csv.DictReader(f), key=lambda row: row["name"])
+
+        key_length = 4 if chunk_by == "year" else 7
+        groups = OrderedDict()
+        for row in rows:
+            # one result per date, the last image of the day
+            groups.setdefault(row["date"][:key_length], OrderedDict())[row["date"]] = row
+
+        imported = 0
+        for group in groups.values():
+            dates, masks, polygons, coverage, disk_area = [], [], [], [], []
+            for date, row in group.items():
+                dates.append(date)
+                masks.append(np.asarray(Image.open(os.path.join(output, "masks", row["name"] + ".png"))) > 0)
+                with open(os.path.join(output, "polygons", row["name"] + ".json")) as f:
+                    polygons.append(json.load(f))
+                coverage.append(float(row["area_coverage"]))
+                disk_area.append(int(row["disk_area"]))
+            self.append(dates, np.stack(masks), polygons, coverage, disk_area, polygon_size, weights)
+            imported += len(dates)
+        self.compact()
+        return imported
+
+
+def _date_str(date):
+    if isinstance(date, (datetime.date, datetime.datetime)):
+        return date.strftime("%Y-%m-%d")
+    return str(date)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import batch_inference.py results to segmentation archive")
+    parser.add_argument("--run", required=True, help="output folder of batch_inference.py")
+    parser.add_argument("--archive", required=True, help="folder of archive")
+    parser.add_argument("--chunk-by", choices=["year", "month"], default="year")
+    parser.add_argument("--target-size", type=int, default=1024, help="target size of batch_inference.py run")
+    parser.add_argument("--weights", default=None,
+                        help="weights of run (.h5 or .tflite), defaults to the identity recorded in run.json of run")
+    args = parser.parse_args()
+
+    weights = None
+    if args.weights:
+        from export_model import weights_hash
+        weights = weights_hash(args.weights)
+    imported = SegmentationArchive(args.archive).import_batch_run(args.run, args.chunk_by,
+                                                                  (args.target_size, args.target_size), weights)
+    print(f"{imported} dates imported to {args.archive}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import numpy as np
+from PIL import Image
+
+from model_scss_net import scss_net
+
+"""
+Tiled inference of SCSS-Net on high resolution images (1024 or 2048 px). SCSS-Net is fully convolutional, so the same
+weights can be used on tiles of any size divisible by 2 ** layers. Overlapping tiles are blended with smooth window,
+so there are no seams on borders of tiles. Only one batch of tiles and two full size float32 accumulators are in memory.
+
+Note: model was trained on whole disk downscaled to 256 px, on 1024/2048 px tiles features of the Sun are bigger than
+during training, results should be validated against the 256 px path before use.
+"""
+
+
+def build_tiled_model(weights, tile_size=256, filters=32, layers=4):
+    """
+    Builds SCSS-Net for tiles of provided size and loads trained weights.
+    :param str weights: path to .h5 weights
+    :param int tile_size: size of tile, has to be divisible by 2 ** layers
+    :param int filters: number of filters of first layer
+    :param int layers: number of layers
+    :return tf.keras.Model: model with loaded weights
+    """
+    if tile_size % 2 ** layers != 0:
+        raise ValueError(f"tile_size has to be divisible by {2 ** layers}, got {tile_size}")
+
+    model = scss_net((tile_size, tile_size, 1), filters=filters, layers=layers, batch_norm=True, drop_prob=0.5)
+    model.load_weights(weights)
+    return model
+
+
+def blend_window(tile_size, overlap):
+    """
+    Weight window of tile, weights rise linearly from border to the inner part of tile over overlap pixels.
+    Minimal weight is above zero, so pixels on border of image (covered by one tile only) are kept.
+    :param int tile_size: size of tile
+    :param int overlap: overlap of neighbouring tiles
+    :return numpy.array: float32 window of shape (tile_size, tile_size)
+    """
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        edge = (np.arange(overlap, dtype=np.float32) + 1) / (overlap + 1)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge[::-1]
+    return np.outer(ramp, ramp)
+
+
+def tile_positions(length, tile_size, overlap):
+    """
+    Start positions of tiles along one axis, last tile is aligned to the end of image.
+    :param int length: size of image along axis
+    :param int tile_size: size of tile
+    :param int overlap: overlap of neighbouring tiles
+    :return list: start positions
+    """
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    positions = list(range(0, length - tile_size, stride))
+    positions.append(length - tile_size)
+    return positions
+
+
+def tiled_predict(model, image, tile_size=256, overlap=64, batch_size=8):
+    """
+    Predicts mask of high resolution image tile by tile.
+    :param tf.keras.Model model: model built with build_tiled_model() for the same tile_size
+    :param numpy.array image: normalized image of shape (height, width) or (height, width, 1)
+    :param int tile_size: size of tile
+    :param int overlap: overlap of neighbouring tiles, bigger overlap gives smoother blending but more tiles
+    :param int batch_size: number of tiles in one predict call, bounds peak memory
+    :return numpy.array: predicted mask of shape (height, width, 1)
+    """
+    if overlap >= tile_size:
+        raise ValueError("overlap has to be smaller than tile_size")
+
+    image = np.asarray(image, dtype=np.float32).reshape(image.shape[0], image.shape[1])
+    height, width = image.shape
+
+    # images smaller than tile are padded with edge values
+    pad_h, pad_w = max(0, tile_size - height), max(0, tile_size - width)
+    if pad_h or pad_w:
+        image = np.pad(image, ((0, pad_h), (0, pad_w)), mode="edge")
+
+    window = blend_window(tile_size, overlap)
+    prediction = np.zeros(image.shape, dtype=np.float32)
+    weights = np.zeros(image.shape, dtype=np.float32)
+
+    positions = [(y, x) for y in tile_positions(image.shape[0], tile_size, overlap)
+                 for x in tile_positions(image.shape[1], tile_size, overlap)]
+    batch = np.empty((batch_size, tile_size, tile_size, 1), dtype=np.float32)
+
+    for i in range(0, len(positions), batch_size):
+        batch_positions = positions[i:i + batch_size]
+        for j, (y, x) in enumerate(batch_positions):
+            batch[j, :, :, 0] = image[y:y + tile_size, x:x + tile_size]
+
+        y_pred = np.asarray(model.predict_on_batch(batch[:len(batch_positions)]))
+
+        for j, (y, x) in enumerate(batch_positions):
+            prediction[y:y + tile_size, x:x + tile_size] += y_pred[j, :, :, 0] * window
+            weights[y:y + tile_size, x:x + tile_size] += window
+
+    prediction /= weights
+    return prediction[:height, :width, None]
+
+
+def load_image(path, size=1024):
+    """
+    Loads image in grayscale, resized to (size, size) and normalized to (0; 1).
+    :param str path: path to image
+    :param int size: size of image
+    :return numpy.array: image of shape (size, size, 1)
+    """
+    img = Image.open(path).convert("L").resize((size, size))
+    return (np.asarray(img, dtype=np.float32) / 255)[:, :, None]
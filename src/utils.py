@@ -1,8 +1,9 @@
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageDraw
 from metrics import dice_np, iou_np
+from evaluation import per_image_scores
 
 
 def plot_imgs(imgs, masks, predictions=None, n_imgs=10):
@@ -103,11 +104,8 @@ def plot_top(imgs, y_true, y_pred, best=True, n_imgs=10):
     :param int n_imgs: number of images to plot
     :return matplotlib.pyplot: pyplot of images side by side
     """
-    dice_list = []
-    for y_t, y_p in zip(y_true, y_pred):
-        dice_coef = round(dice_np(y_t, y_p), 4)
-        dice_list.append(dice_coef)
-    dice_list = np.array(dice_list)
+    # dice of all images at once, same values as dice_np
+    dice_list = np.round(per_image_scores(y_true, y_pred)["dice"], 4)
     # Sort list by dice_coef
     idx = dice_list.argsort()
     imgs = imgs[idx]
@@ -120,39 +118,96 @@ def plot_top(imgs, y_true, y_pred, best=True, n_imgs=10):
         return plot_imgs(imgs[:n_imgs], y_true[:n_imgs], y_pred[:n_imgs])
 
 
-def create_contours(y_pred, target_size=(4096, 4096)):
+CHAIN_APPROXIMATIONS = {
+    "none": cv2.CHAIN_APPROX_NONE,
+    "simple": cv2.CHAIN_APPROX_SIMPLE,
+    "tc89_l1": cv2.CHAIN_APPROX_TC89_L1,
+    "tc89_kcos": cv2.CHAIN_APPROX_TC89_KCOS,
+}
+
+
+def _mask_contours(mask, target_size, approximation, epsilon):
+    """
+    Contours of one binary uint8 mask scaled to target size as float32 arrays.
+    """
+    height, width = mask.shape[:2]
+    scale = np.array([target_size[0] / width, target_size[1] / height], dtype=np.float32)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_TREE, CHAIN_APPROXIMATIONS[approximation])
+    polygons = []
+    for contour in contours:
+        if epsilon:
+            # Douglas-Peucker simplification, epsilon is in pixels of mask
+            contour = cv2.approxPolyDP(contour, epsilon, True)
+        points = contour.reshape(-1, 2).astype(np.float32) * scale
+        # To make sure that polygon is fully connected
+        polygons.append(np.concatenate([points, points[:1]]))
+    return polygons
+
+
+def create_contours_batch(y_preds, target_size=(4096, 4096), threshold=0.5, approximation="simple", epsilon=None):
+    """
+    Create contours of batch of predictions. Predictions are thresholded into one reused buffer and contour points
+    are scaled with numpy, polygons are returned as compact arrays.
+    :param numpy.array y_preds: predictions of shape (n, height, width[, 1])
+    :param target_size: size of image we will draw these coordinates
+    :param float threshold: pixels with higher value belong to mask, None keeps every pixel that is nonzero after
+        conversion to uint8 (behaviour of create_contours())
+    :param str approximation: chain approximation of cv2.findContours, one of CHAIN_APPROXIMATIONS
+    :param float epsilon: tolerance of Douglas-Peucker simplification in pixels of prediction, None means no simplification
+    :return list: for every prediction list of float32 arrays of shape (n_points, 2) with x and y coordinates
+    """
+    y_preds = np.asarray(y_preds)
+    y_preds = y_preds.reshape(y_preds.shape[0], y_preds.shape[1], y_preds.shape[2])
+    if threshold is None:
+        threshold = 1 / 255 - 1e-7
+
+    buffer = np.empty(y_preds.shape[1:], dtype=bool)
+    batch_polygons = []
+    for y_pred in y_preds:
+        np.greater(y_pred, threshold, out=buffer)
+        batch_polygons.append(_mask_contours(buffer.view(np.uint8), target_size, approximation, epsilon))
+    return batch_polygons
+
+
+def create_contours(y_pred, target_size=(4096, 4096), approximation="none", epsilon=None, as_array=False):
     """
     Create contours coordinates from binary mask.
     :param numpy.array y_pred: array of binary mask
     :param target_size: size of image we will draw these coordinates
+    :param str approximation: chain approximation of cv2.findContours, one of CHAIN_APPROXIMATIONS
+    :param float epsilon: tolerance of Douglas-Peucker simplification in pixels of mask, None means no simplification
+    :param bool as_array: return polygons as float32 arrays of shape (n_points, 2) instead of lists of tuples
     :return list: list containing list of tuples with x and y coordinates [[(x,y), (x,y)]]
     """
     # (w, h)
     if isinstance(y_pred, Image.Image):
-        mask = np.array(y_pred)
+        polygons = _mask_contours(np.array(y_pred), target_size, approximation, epsilon)
     elif isinstance(y_pred, np.ndarray):
-        one = y_pred.reshape((y_pred.shape[0], y_pred.shape[1])) * 255
-        one = np.array(one, dtype=np.uint8)
-        mask = np.stack((one, one, one), axis=-1)
-        mask = cv2.cvtColor(mask, cv2.COLOR_RGB2GRAY)
+        polygons = create_contours_batch(y_pred[None], target_size, None, approximation, epsilon)[0]
     else:
         raise TypeError(
             f"Expected class: {np.ndarray} or {Image.Image} but got {type(y_pred)}"
         )
 
-    width = mask.shape[1]
-    height = mask.shape[0]
+    if as_array:
+        return polygons
+    return [[tuple(point) for point in polygon.tolist()] for polygon in polygons]
 
-    contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-    polygons = []
-    for object in contours:
-        coords = []
-        for i, point in enumerate(object):
-            new_x = (int(point[0][0]) - 0) / (width - 0) * (target_size[0] - 0) - 0
-            new_y = (int(point[0][1]) - 0) / (height - 0) * (target_size[1] - 0) - 0
-            coords.append((new_x, new_y))
-            # To make sure that polygon is fully connected
-            if i == len(object) - 1:
-                coords.append(coords[0])
-        polygons.append(coords)
-    return polygons
+
+def draw_contours(img, polygons, outline="red", width=4):
+    """
+    Draws contours from create_contours() or create_contours_batch() on image.
+    :param PIL.Image img: image to draw on, it is changed in place
+    :param list polygons: list of polygons, arrays or lists of tuples
+    :param outline: color of contours
+    :param int width: width of contours
+    :return PIL.Image: the same image
+    """
+    draw = ImageDraw.Draw(img)
+    for polygon in polygons:
+        if isinstance(polygon, np.ndarray):
+            # flat list of coordinates is accepted by all Pillow versions
+            polygon = polygon.ravel().tolist()
+        draw.polygon(polygon, outline=outline, width=width)
+    return img
@@ -0,0 +1,250 @@
+import bisect
+import datetime
+import json
+import os
+import threading
+
+import settings as Settings
+
+# (event, cropped) -> (directory, extension) of image archive
+ARCHIVES = {
+    ("CH", False): (Settings.IMAGES_195, ".jpg"),
+    ("CH", True): (Settings.IMAGES_195_CROPPED, ".png"),
+    ("AR", False): (Settings.IMAGES_171, ".png"),
+}
+
+DATE_FORMAT = "%Y%m%d"
+
+
+def archive_key(event, cropped=False):
+    """returns key of archive in ARCHIVES. Cropped images are only available for "CH" event, for "AR" 171A images are used.
+
+    Args:
+        event (string): "CH" or "AR"
+
+        cropped (bool, optional): whether to use cropped images. Defaults to False.
+
+    Returns:
+        tuple: (event, cropped)
+    """
+    return (event, cropped and event == "CH")
+
+
+def date_from_filename(filename):
+    """get date from image filename, example: 20020131_0113_eit195_1024.jpg -> 20020131
+
+    Args:
+        filename (string): name of image file
+
+    Returns:
+        string: date in format %Y%m%d or None if filename does not start with date
+    """
+    date_str = filename.split("_")[0]
+    if len(date_str) != 8 or not date_str.isdigit():
+        return None
+    return date_str
+
+
+class ImageCatalog:
+    """index of images in all archives by (date, event, cropped). Index is stored in json file and refreshed
+    only when modification time of archive directory changes (new images were added or removed).
+    """
+
+    def __init__(self, archives=None, index_path=None):
+        """
+        Args:
+            archives (dict, optional): (event, cropped) -> (directory, extension). Defaults to ARCHIVES.
+
+            index_path (string, optional): path to json file where index is persisted. Defaults to Settings.CATALOG_INDEX.
+        """
+        self.archives = ARCHIVES if archives is None else archives
+        self.index_path = Settings.CATALOG_INDEX if index_path is None else index_path
+        self._lock = threading.Lock()
+        # key -> {"mtime": int, "files": {date: filename}}
+        self._index = {}
+        # key -> sorted list of dates, used for range queries
+        self._dates = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        for key, (directory, extension) in self.archives.items():
+            entry = stored.get(self._name(key))
+            if entry is None or entry.get("directory") != directory:
+                continue
+            self._index[key] = entry
+            self._dates[key] = sorted(entry["files"])
+
+    def _save(self):
+        stored = {self._name(key): entry for key, entry in self._index.items()}
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # read only data folder, index will be kept only in memory
+            pass
+
+    @staticmethod
+    def _name(key):
+        event, cropped = key
+        return f"{event}_cropped" if cropped else event
+
+    def _refresh(self, key):
+        """rescan archive directory if its modification time changed since last scan.
+        Only names of files are listed, dates are parsed only for new files.
+        """
+        directory, extension = self.archives[key]
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        entry = self._index.get(key)
+        if entry is not None and entry["mtime"] == mtime:
+            return
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None and entry["mtime"] == mtime:
+                return
+
+            known = {} if entry is None else {name: date for date, name in entry["files"].items()}
+            files = {}
+            if mtime is not None:
+                for name in sorted(os.listdir(directory)):
+                    if not name.endswith(extension):
+                        continue
+                    date = known.get(name) or date_from_filename(name)
+                    if date is not None:
+                        # more images from one day -> keep the last one
+                        files[date] = name
+
+            self._index[key] = {"directory": directory, "mtime": mtime, "files": files}
+            self._dates[key] = sorted(files)
+            self._save()
+
+    def lookup(self, date, event, cropped=False):
+        """finds path to image of provided date
+
+        Args:
+            date (datetime.date): date of image
+
+            event (string): "CH" or "AR"
+
+            cropped (bool, optional): whether to look for cropped image. Defaults to False.
+
+        Returns:
+            string: path to image or None if there is no image for this date
+        """
+        key = archive_key(event, cropped)
+        self._refresh(key)
+        name = self._index[key]["files"].get(date.strftime(DATE_FORMAT))
+        if name is None:
+            return None
+        return self.archives[key][0] + name
+
+    def dates(self, event, cropped=False, start=None, end=None):
+        """returns all dates with available image in range <start, end>
+
+        Args:
+            event (string): "CH" or "AR"
+
+            cropped (bool, optional): whether to look for cropped images. Defaults to False.
+
+            start (datetime.date, optional): first date of range. Defaults to None (from first image).
+
+            end (datetime.date, optional): last date of range. Defaults to None (to last image).
+
+        Returns:
+            list: sorted list of datetime.date
+        """
+        key = archive_key(event, cropped)
+        self._refresh(key)
+        dates = self._dates[key]
+        lo = 0 if start is None else bisect.bisect_left(dates, start.strftime(DATE_FORMAT))
+        hi = len(dates) if end is None else bisect.bisect_right(dates, end.strftime(DATE_FORMAT))
+        return [datetime.datetime.strptime(d, DATE_FORMAT).date() for d in dates[lo:hi]]
+
+    def nearest(self, date, event, cropped=False):
+        """finds nearest date with available image
+
+        Args:
+            date (datetime.date): date to start from
+
+            event (string): "CH" or "AR"
+
+            cropped (bool, optional): whether to look for cropped images. Defaults to False.
+
+        Returns:
+            datetime.date: nearest date with image or None if archive is empty
+        """
+        key = archive_key(event, cropped)
+        self._refresh(key)
+        dates = self._dates[key]
+        if not dates:
+            return None
+
+        i = bisect.bisect_left(dates, date.strftime(DATE_FORMAT))
+        candidates = [datetime.datetime.strptime(dates[j], DATE_FORMAT).date() for j in (i - 1, i) if 0 <= j < len(dates)]
+        return min(candidates, key=lambda d: abs(d - date))
+
+    def shift(self, date, event, steps, cropped=False):
+        """moves provided number of available images forward or backward from date, days without images are skipped
+
+        Args:
+            date (datetime.date): date to start from
+
+            event (string): "CH" or "AR"
+
+            steps (int): how many images to move, negative number moves backward
+
+            cropped (bool, optional): whether to look for cropped images. Defaults to False.
+
+        Returns:
+            datetime.date: date of image, first or last available date if steps go beyond archive
+        """
+        key = archive_key(event, cropped)
+        self._refresh(key)
+        dates = self._dates[key]
+        if not dates or steps == 0:
+            return date
+
+        date_str = date.strftime(DATE_FORMAT)
+        i = bisect.bisect_left(dates, date_str)
+        if i < len(dates) and dates[i] == date_str:
+            i = i + steps
+        elif steps > 0:
+            i = i + steps - 1
+        else:
+            i = i + steps
+
+        i = min(max(i, 0), len(dates) - 1)
+        return datetime.datetime.strptime(dates[i], DATE_FORMAT).date()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """returns image catalog shared by whole process
+
+    Returns:
+        ImageCatalog: catalog of images
+    """
+    global _catalog
+
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ImageCatalog()
+
+    return _catalog
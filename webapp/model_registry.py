@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+import numpy as np
+import sys
+
+sys.path.append('../src/')
+
+import settings as Settings
+import profiling
+
+IMG_SIZE = 256
+# identity of models in inference server is asked again after this many seconds, server can be restarted with new weights
+MODEL_ID_TTL_S = 30.0
+
+# weights of trained SCSS-Net models for each event
+MODEL_WEIGHTS = {
+    "CH": Settings.CH_MODEL_WEIGHTS,
+    "AR": Settings.AR_MODEL_WEIGHTS,
+}
+
+# process-wide state, this module is imported only once per streamlit server, so models are shared by all sessions
+_models = {}
+_locks = {event: threading.Lock() for event in MODEL_WEIGHTS}
+_dual_model = None
+_dual_lock = threading.Lock()
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+_client = None
+# event -> (mtime, size, identity) of local weights, (time of request, identity) in inference server
+_model_ids = {}
+
+
+def get_client():
+    """returns client of inference server from settings, models then run in server process shared by all sessions
+    and batch jobs, requests of concurrent sessions are batched together there
+
+    Returns:
+        inference_server.InferenceClient: client, None if Settings.INFERENCE_SERVER_URL is not set
+    """
+    global _client
+    if Settings.INFERENCE_SERVER_URL is None:
+        return None
+    if _client is None:
+        from inference_server import InferenceClient
+
+        _client = InferenceClient(Settings.INFERENCE_SERVER_URL)
+    return _client
+
+
+def model_id(event):
+    """returns identity of weights which segment provided event, it is part of keys of result_cache and archived
+    results of other weights are not shown. With inference server identity is asked from server, so local weights
+    file is not needed and results of server weights are not mixed with results of local weights.
+
+    Args:
+        event (string): "CH" or "AR"
+
+    Returns:
+        string: identity of weights, see export_model.weights_hash()
+    """
+    client = get_client()
+    if client is not None:
+        cached = _model_ids.get(("server", event))
+        if cached is None or time.monotonic() - cached[0] > MODEL_ID_TTL_S:
+            cached = (time.monotonic(), client.model_id(event))
+            _model_ids[("server", event)] = cached
+        return cached[1]
+
+    from export_model import weights_hash
+
+    # weights are hashed again only when file changes
+    stat = os.stat(MODEL_WEIGHTS[event])
+    cached = _model_ids.get(event)
+    if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+        cached = (stat.st_mtime_ns, stat.st_size, weights_hash(MODEL_WEIGHTS[event]))
+        _model_ids[event] = cached
+    return cached[2]
+
+
+@profiling.timed("model_build")
+def build_model(event):
+    """builds SCSS-Net model and loads trained weights for provided event. If weights in settings are .tflite file
+    exported with export_model.py, TensorFlow Lite backend is used instead of keras.
+    tensorflow/keras is imported here and not at the top of the module, so first page paint of webapp does not wait for it.
+
+    Args:
+        event (string): "CH" or "AR"
+
+    Returns:
+        model with predict_on_batch() method (tf.keras.Model or export_model.TFLiteModel)
+    """
+    from export_model import load_model
+
+    return load_model(MODEL_WEIGHTS[event])
+
+
+@profiling.timed("model_build")
+def build_dual_model():
+    """builds CH and AR models fused to one graph (src/dual_inference.py), so both events are segmented
+    with one predict call
+
+    Returns:
+        dual_inference.DualModel: model with predict_on_batch(x_ch, x_ar) method
+    """
+    from dual_inference import DualModel
+
+    return DualModel(MODEL_WEIGHTS["CH"], MODEL_WEIGHTS["AR"])
+
+
+def get_dual_model():
+    """returns fused model of both events, it is built at most once per process
+
+    Returns:
+        dual_inference.DualModel: model with predict_on_batch(x_ch, x_ar) method
+    """
+    global _dual_model
+
+    if _dual_model is None:
+        with _dual_lock:
+            if _dual_model is None:
+                _dual_model = build_dual_model()
+    return _dual_model
+
+
+def get_model(event):
+    """returns SCSS-Net model for provided event. Model is built at most once per process,
+    every next call returns the same model. With Settings.DUAL_EVENT model of event is taken from fused model,
+    so weights are not loaded twice.
+
+    Args:
+        event (string): "CH" or "AR"
+
+    Returns:
+        tf.keras.Model: SCSS-Net model with loaded weights
+    """
+    if Settings.DUAL_EVENT:
+        return get_dual_model().models[event]
+
+    model = _models.get(event)
+    if model is not None:
+        return model
+
+    # only one thread builds the model, others wait for it
+    with _locks[event]:
+        if event not in _models:
+            _models[event] = build_model(event)
+
+    return _models[event]
+
+
+def predict(event, x):
+    """makes prediction with SCSS-Net model of provided event, in this process or in inference server
+    (src/inference_server.py) if Settings.INFERENCE_SERVER_URL is set.
+
+    Args:
+        event (string): "CH" or "AR"
+
+        x (numpy.array): normalized images of shape (n_imgs, IMG_SIZE, IMG_SIZE, 1)
+
+    Returns:
+        numpy.array: predicted masks of shape (n_imgs, IMG_SIZE, IMG_SIZE, 1)
+    """
+    client = get_client()
+    if client is not None:
+        with profiling.stage("predict_remote"):
+            return client.predict(event, x)
+
+    model = get_model(event)
+    # predict_on_batch skips the dataset/callback machinery of predict(), which is pure overhead for a few images
+    with profiling.stage("predict"):
+        return np.asarray(model.predict_on_batch(x))
+
+
+def predict_dual(x_ch, x_ar):
+    """makes prediction of both events with one predict call of fused model, in inference server
+    both requests are sent to their micro-batchers
+
+    Args:
+        x_ch (numpy.array): normalized cropped 195A images of shape (n_imgs, IMG_SIZE, IMG_SIZE, 1)
+
+        x_ar (numpy.array): normalized 171A images of the same shape
+
+    Returns:
+        tuple: predicted masks of CH and AR, both of shape (n_imgs, IMG_SIZE, IMG_SIZE, 1)
+    """
+    client = get_client()
+    if client is not None:
+        with profiling.stage("predict_remote"):
+            return client.predict("CH", x_ch), client.predict("AR", x_ar)
+
+    model = get_dual_model()
+    with profiling.stage("predict_dual"):
+        return model.predict_on_batch(x_ch, x_ar)
+
+
+def is_ready(event):
+    """check if model for provided event is already built
+
+    Args:
+        event (string): "CH" or "AR"
+
+    Returns:
+        bool: True if model is built and loaded
+    """
+    if Settings.DUAL_EVENT:
+        return _dual_model is not None
+    return event in _models
+
+
+def _warm_up(events):
+    dummy = np.zeros((1, IMG_SIZE, IMG_SIZE, 1), dtype=np.float32)
+    if Settings.DUAL_EVENT:
+        try:
+            predict_dual(dummy, dummy)
+        except Exception as e:
+            print(f"warm up of dual model failed: {e}")
+        return
+    for event in events:
+        try:
+            predict(event, dummy)
+        except Exception as e:
+            # warm up is only optimization, model will be built again on first real request
+            print(f"warm up of {event} model failed: {e}")
+
+
+def warm_up(events=("CH", "AR")):
+    """builds models in background thread and runs one dummy batch through them, so first segmentation
+    does not pay for graph build and weights load. Calling this function more times starts only one thread.
+
+    Args:
+        events (tuple, optional): events which models should be warmed up. Defaults to ("CH", "AR").
+
+    Returns:
+        threading.Thread: thread which warms up models, None if inference server is used
+    """
+    global _warmup_thread
+
+    if get_client() is not None:
+        # models are kept warm by inference server
+        return None
+
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_warm_up, args=(events,), name="scss-warmup", daemon=True)
+            _warmup_thread.start()
+
+    return _warmup_thread
@@ -0,0 +1,165 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import image_catalog
+import settings as Settings
+
+
+class Prefetcher:
+    """loads images (and segmentations) of neighbouring days in background threads, so moving with
+    previous/next day buttons shows already prepared results. Results are kept in bounded in-memory LRU cache.
+    """
+
+    def __init__(self, loader, days=None, max_entries=None, workers=2):
+        """
+        Args:
+            loader (callable): function loader(date, event, segment) -> (Image, area_coverage)
+
+            days (int, optional): how many days before and after current date to prefetch. Defaults to Settings.PREFETCH_DAYS.
+
+            max_entries (int, optional): size of cache. Defaults to Settings.PREFETCH_CACHE_SIZE.
+
+            workers (int, optional): number of background threads. Defaults to 2.
+        """
+        self.loader = loader
+        self.days = Settings.PREFETCH_DAYS if days is None else days
+        self.max_entries = Settings.PREFETCH_CACHE_SIZE if max_entries is None else max_entries
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._futures = {}
+        self._wanted = set()
+
+    def _store(self, key, result):
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _run(self, key):
+        # user could move away before this task started, then the work is not needed anymore
+        with self._lock:
+            if key not in self._wanted:
+                self._futures.pop(key, None)
+                return None
+
+        try:
+            result = self.loader(*key)
+            self._store(key, result)
+            return result
+        finally:
+            with self._lock:
+                self._futures.pop(key, None)
+
+    def get(self, date, event, segment):
+        """returns result for provided date. If result is prefetched it is returned from cache, if it is just
+        being prefetched it waits for it, otherwise it is loaded in calling thread.
+
+        Args:
+            date (datetime.date): date of image
+
+            event (string): "CH" or "AR"
+
+            segment (bool): whether to make segmentation
+
+        Returns:
+            tuple: result of loader, (Image, area_coverage)
+        """
+        key = (date, event, segment)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            future = self._futures.get(key)
+
+        if future is not None:
+            # future can be cancelled by update() of other rerun any time before it starts, then result is loaded here
+            try:
+                result = future.result()
+            except CancelledError:
+                result = None
+            if result is not None:
+                return result
+
+        result = self.loader(*key)
+        self._store(key, result)
+        return result
+
+    def put(self, date, event, segment, result):
+        """stores result loaded elsewhere (eg. by segmentation_jobs), so next get() or peek() returns it
+
+        Args:
+            date (datetime.date): date of image
+
+            event (string): "CH" or "AR"
+
+            segment (bool): whether result is segmentation
+
+            result (tuple): result of loader, (Image, area_coverage)
+        """
+        self._store((date, event, segment), result)
+
+    def peek(self, date, event, segment):
+        """returns already prefetched result without loading it
+
+        Args:
+            date (datetime.date): date of image
+
+            event (string): "CH" or "AR"
+
+            segment (bool): whether result is segmentation
+
+        Returns:
+            tuple: result of loader, None if it is not in cache
+        """
+        key = (date, event, segment)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def update(self, date, event, segment):
+        """moves prefetching window to provided date. Work for dates out of new window is cancelled.
+
+        Args:
+            date (datetime.date): currently shown date
+
+            event (string): "CH" or "AR"
+
+            segment (bool): whether to make segmentation
+        """
+        catalog = image_catalog.get_catalog()
+        # nearest days first, so they are ready sooner
+        steps = [step for day in range(1, self.days + 1) for step in (day, -day)]
+        keys = []
+        for step in steps:
+            neighbour = catalog.shift(date, event, step)
+            key = (neighbour, event, segment)
+            if neighbour != date and key not in keys:
+                keys.append(key)
+
+        with self._lock:
+            self._wanted = set(keys)
+            self._wanted.add((date, event, segment))
+
+            self._cancel_unwanted()
+
+            for key in keys:
+                if key not in self._cache and key not in self._futures:
+                    self._futures[key] = self._executor.submit(self._run, key)
+
+    def cancel(self):
+        """cancels all prefetching which has not started yet
+        """
+        with self._lock:
+            self._wanted = set()
+            self._cancel_unwanted()
+
+    def _cancel_unwanted(self):
+        # running tasks can not be cancelled, they are only stored to cache when they finish
+        for key, future in list(self._futures.items()):
+            if key not in self._wanted and future.cancel():
+                del self._futures[key]
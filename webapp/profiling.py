@@ -0,0 +1,296 @@
+import datetime
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+import settings as Settings
+
+
+class Profiler:
+    """records wall time and memory of named stages of webapp (image lookup, decode, model build, predict, contours, ...).
+    Stages can be nested, their names are joined with "/" (eg. "segmentation/segment/predict"). Recent samples of every
+    stage are kept in memory for percentiles, every finished stage is also appended as one json line to trace file.
+
+    Memory of stage is reported as peak of resident memory of process during stage above resident memory at its start.
+    Resident memory is sampled by background thread while any stage runs, so it includes native allocations of
+    TensorFlow which tracemalloc does not see, but also memory of stages running at the same time in other threads.
+    Optionally peak of memory allocated by python and numpy during stage is reported too (tracemalloc, slows
+    allocations down, off by default).
+    """
+
+    def __init__(self, trace_path=None, window=500, trace_memory=False, max_trace_bytes=64 * 1024 * 1024,
+                 rss_interval=0.01):
+        """
+        Args:
+            trace_path (string, optional): json lines file where stages are exported, None disables export. Defaults to None.
+
+            window (int, optional): number of recent samples of every stage kept for percentiles. Defaults to 500.
+
+            trace_memory (bool, optional): whether to measure allocations with tracemalloc. Defaults to False.
+
+            max_trace_bytes (int, optional): trace file is rotated to <trace_path>.1 when it gets bigger. Defaults to 64 MB.
+
+            rss_interval (float, optional): period of sampling of resident memory in seconds. Defaults to 0.01.
+        """
+        self.trace_path = trace_path
+        self.window = window
+        self.trace_memory = trace_memory
+        self.max_trace_bytes = max_trace_bytes
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._local = threading.local()
+        self._rss = _RSSSampler(rss_interval)
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if trace_path:
+            os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name):
+        """context manager which measures stage, exceptions are recorded and raised again
+
+        Args:
+            name (string): name of stage
+        """
+        stack = self._stack()
+        path = "/".join([frame["path"] for frame in stack[-1:]] + [name])
+        frame = {"path": path, "alloc_start": None, "alloc_peak": 0}
+
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # peak is global, keep peak of parent before it is reset for this stage
+            if stack:
+                stack[-1]["alloc_peak"] = max(stack[-1]["alloc_peak"], peak)
+            frame["alloc_start"] = current
+            tracemalloc.reset_peak()
+
+        stack.append(frame)
+        self._rss.start(frame)
+        error = None
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            wall_ms = (time.perf_counter() - start) * 1000
+            stack.pop()
+
+            rss = self._rss.stop(frame)
+            record = {
+                "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                "stage": path,
+                "wall_ms": round(wall_ms, 3),
+                "rss_peak_mb": round(frame["rss_peak"] - frame["rss_start"], 2),
+                "rss_mb": round(rss, 1),
+                "thread": threading.current_thread().name,
+            }
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame["alloc_peak"])
+                record["alloc_peak_mb"] = round((peak - frame["alloc_start"]) / 1024 ** 2, 2)
+                if stack:
+                    stack[-1]["alloc_peak"] = max(stack[-1]["alloc_peak"], peak)
+            if error:
+                record["error"] = error
+            self._record(record)
+
+    def _record(self, record):
+        with self._lock:
+            samples = self._samples.get(record["stage"])
+            if samples is None:
+                samples = self._samples[record["stage"]] = deque(maxlen=self.window)
+            samples.append(record)
+
+            if self.trace_path:
+                try:
+                    if os.path.exists(self.trace_path) and os.path.getsize(self.trace_path) > self.max_trace_bytes:
+                        os.replace(self.trace_path, self.trace_path + ".1")
+                    with open(self.trace_path, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+                except OSError as e:
+                    # profiling must never break the page
+                    print(f"trace export failed: {e}")
+
+    def summary(self):
+        """percentiles of recent samples of every stage
+
+        Returns:
+            list: one dict per stage with "stage", "count", "p50_ms", "p90_ms", "p99_ms", "max_ms" and "rss_peak_mb"
+            (and "alloc_peak_mb" if allocations are traced), sorted by stage name
+        """
+        with self._lock:
+            samples = {stage: list(records) for stage, records in self._samples.items()}
+        return [_summarize(stage, records) for stage, records in sorted(samples.items())]
+
+    def reset(self):
+        """drops recent samples, trace file is kept
+        """
+        with self._lock:
+            self._samples.clear()
+
+
+class _RSSSampler:
+    # samples resident memory of process while any stage runs and keeps peak of every running stage
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._frames = {}
+        self._active = threading.Event()
+        self._thread = None
+
+    def start(self, frame):
+        rss = _rss_mb()
+        frame["rss_start"] = frame["rss_peak"] = rss
+        with self._lock:
+            self._frames[id(frame)] = frame
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="rss-sampler", daemon=True)
+                self._thread.start()
+            self._active.set()
+
+    def stop(self, frame):
+        rss = _rss_mb()
+        with self._lock:
+            self._frames.pop(id(frame), None)
+            frame["rss_peak"] = max(frame["rss_peak"], rss)
+        return rss
+
+    def _loop(self):
+        while True:
+            # thread sleeps without polling when no stage runs
+            self._active.wait()
+            rss = _rss_mb()
+            with self._lock:
+                if not self._frames:
+                    self._active.clear()
+                    continue
+                for frame in self._frames.values():
+                    frame["rss_peak"] = max(frame["rss_peak"], rss)
+            time.sleep(self.interval)
+
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / 1024 ** 2 if hasattr(os, "sysconf") else 0
+
+
+def _rss_mb():
+    # current resident memory, /proc on linux, psutil elsewhere if it is installed
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    except ImportError:
+        # peak instead of current memory, per stage peak is then reported only for stages which raise it
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # linux reports kilobytes, macOS bytes
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _summarize(stage, records):
+    wall = np.array([record["wall_ms"] for record in records])
+    p50, p90, p99 = np.percentile(wall, [50, 90, 99])
+    summary = {
+        "stage": stage,
+        "count": len(records),
+        "p50_ms": round(float(p50), 2),
+        "p90_ms": round(float(p90), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(wall.max()), 2),
+        "rss_peak_mb": round(max(record["rss_peak_mb"] for record in records), 2),
+    }
+    if "alloc_peak_mb" in records[0]:
+        summary["alloc_peak_mb"] = round(max(record.get("alloc_peak_mb", 0) for record in records), 2)
+    return summary
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """returns process-wide profiler configured in settings, it is shared by all sessions
+
+    Returns:
+        Profiler: profiler
+    """
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler(Settings.PROFILE_TRACE_FILE, Settings.PROFILE_WINDOW, Settings.PROFILE_MEMORY)
+        return _profiler
+
+
+def stage(name):
+    """measures stage with process-wide profiler, see Profiler.stage()
+
+    Args:
+        name (string): name of stage
+
+    Returns:
+        context manager
+    """
+    return get_profiler().stage(name)
+
+
+def timed(name):
+    """decorator which measures every call of function as stage, see Profiler.stage()
+
+    Args:
+        name (string): name of stage
+
+    Returns:
+        decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def read_traces(path):
+    """reads trace file exported by Profiler and computes percentiles of every stage,
+    so traces from production can be compared between versions
+
+    Args:
+        path (string): path to trace file
+
+    Returns:
+        list: summaries of stages, see Profiler.summary()
+    """
+    samples = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            samples.setdefault(record["stage"], []).append(record)
+    return [_summarize(stage, records) for stage, records in sorted(samples.items())]
+
+
+if __name__ == "__main__":
+    # python profiling.py ../data/cache/traces.jsonl
+    for summary in read_traces(sys.argv[1] if len(sys.argv) > 1 else Settings.PROFILE_TRACE_FILE):
+        print(f"{summary['stage']:<45} n={summary['count']:<6} p50={summary['p50_ms']:>9.2f} ms "
+              f"p90={summary['p90_ms']:>9.2f} ms p99={summary['p99_ms']:>9.2f} ms "
+              f"rss peak={summary['rss_peak_mb']:>7.1f} MB")
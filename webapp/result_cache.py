@@ -0,0 +1,174 @@
+import hashlib
+import io
+import os
+import pickle
+import threading
+
+import numpy as np
+from PIL import Image
+
+import settings as Settings
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """computes sha1 hash of file content
+
+    Args:
+        path (string): path to file
+
+        chunk_size (int, optional): how many bytes to read at once. Defaults to 1 MB.
+
+    Returns:
+        string: hex digest of file
+    """
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """on disk cache of segmentation results. Every entry is one pickle file named
+    <event>_<model id>_<image hash>.pkl, so results made with older weights are never served.
+    When total size of cache exceeds max_bytes, least recently used entries are removed.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        """
+        Args:
+            directory (string, optional): where to store entries. Defaults to Settings.RESULT_CACHE_DIR.
+
+            max_bytes (int, optional): maximal size of cache on disk. Defaults to Settings.RESULT_CACHE_MAX_BYTES.
+        """
+        self.directory = Settings.RESULT_CACHE_DIR if directory is None else directory
+        self.max_bytes = Settings.RESULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        # event -> identity of model used in last key, entries of other identities are removed when it changes
+        self._model_ids = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _invalidate(self, event, model_id):
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.startswith(f"{event}_") and not name.startswith(f"{event}_{model_id}_"):
+                    self._remove(name)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def key(self, event, image_path, model_id):
+        """creates key of entry from content of input image and identity of model, stale entries of event are removed
+        when identity of model changed
+
+        Args:
+            event (string): "CH" or "AR"
+
+            image_path (string): path to image used as input of model
+
+            model_id (string): identity of weights, see model_registry.model_id()
+
+        Returns:
+            string: key of entry
+        """
+        if self._model_ids.get(event) != model_id:
+            self._invalidate(event, model_id)
+            self._model_ids[event] = model_id
+        return f"{event}_{model_id}_{file_hash(image_path)}"
+
+    def get(self, key):
+        """loads entry from cache
+
+        Args:
+            key (string): key from key()
+
+        Returns:
+            dict: entry with keys "mask", "polygons", "overlay" and "area_coverage", or None if entry is not cached
+        """
+        path = os.path.join(self.directory, key + ".pkl")
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        # modification time is used as time of last usage for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        entry["mask"] = entry["mask"].astype(np.float32)
+        entry["overlay"] = Image.open(io.BytesIO(entry["overlay"]))
+        return entry
+
+    def put(self, key, mask, polygons, overlay, area_coverage):
+        """saves entry to cache and evicts least recently used entries if cache is too big
+
+        Args:
+            key (string): key from key()
+
+            mask (numpy.array): predicted probability mask
+
+            polygons (list): polygons from utils.create_contours
+
+            overlay (PIL.Image): image with drawn contours
+
+            area_coverage (float): area coverage of event in %
+        """
+        buffer = io.BytesIO()
+        overlay.save(buffer, format="PNG")
+        entry = {
+            "mask": np.asarray(mask, dtype=np.float16),
+            "polygons": polygons,
+            "overlay": buffer.getvalue(),
+            "area_coverage": area_coverage,
+        }
+
+        path = os.path.join(self.directory, key + ".pkl")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for dir_entry in os.scandir(self.directory):
+                if not dir_entry.name.endswith(".pkl"):
+                    continue
+                stat = dir_entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, dir_entry.name))
+                total += stat.st_size
+
+            # oldest used first
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(name)
+                total -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """returns result cache shared by whole process
+
+    Returns:
+        ResultCache: cache of segmentation results
+    """
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+
+    return _cache
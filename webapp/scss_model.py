@@ -1,28 +1,68 @@
-from PIL import Image, ImageDraw
+from PIL import Image
 # from ImageDataAugmentor.image_data_augmentor import *
 import numpy as np
+import datetime
 import sys
 
 sys.path.append('../src/')
 
-from model_scss_net import scss_net
-from utils import create_contours
+import disk_geometry
+import image_pyramid
 import os
+import threading
 import settings as Settings
+import model_registry
+import profiling
+import result_cache
+import segmentation_archive
 
 IMG_SIZE = 256
 
+_archives = {}
+_archives_lock = threading.Lock()
 
-def start_segmentation(path, event):
+
+def get_archive(event):
+    """returns archive of precomputed segmentations of event, archive is opened only once per process
+
+    Args:
+        event (string): "CH" or "AR"
+
+    Returns:
+        SegmentationArchive: archive, None if archive of event was not built
+    """
+    directory = os.path.join(Settings.ARCHIVE_DIR, event)
+    if not os.path.exists(os.path.join(directory, "index.json")):
+        return None
+
+    with _archives_lock:
+        if event not in _archives:
+            _archives[event] = segmentation_archive.SegmentationArchive(directory)
+        return _archives[event]
+
+
+@profiling.timed("segmentation")
+def start_segmentation(path, event, pair_path=None):
     """ for CH make segmentation with SCSS-Net model on CROPPED img and create contours of that segmentation on UNCROPPED EIT 195 image
     
         for AR make segmentation with SCSS-Net model on img and create contours of that segmentation on EIT 171 image
 
+        dates from segmentation archive (see get_archive()) are only drawn, other results are cached on disk
+        by content of image and weights of model, so revisited dates are not segmented again
+
+        with Settings.INFERENCE_SERVER_URL set, model runs in shared inference server instead of webapp process
+
+        with Settings.DUAL_EVENT and pair_path, both events of the date are segmented in one pass (see segment_dual())
+        and result of the other event is cached too
+
     Args:
         path (string): path to image to make prediction on (if event is CH path is to CROPPED 195 images, handled in webapp.py)
 
         event (string): "CH" or "AR"
 
+        pair_path (string, optional): path to image of the other event of the same date (CROPPED 195 image for CH,
+        171 image for AR). Defaults to None.
+
     Returns:
         Image: image with countour of segmentation on provided image
 
@@ -32,62 +72,212 @@ def start_segmentation(path, event):
     if "default" in path:
         return Image.open(path), 0.0
 
-    # select UNCROPPED 195A images or 171 images 
-    if event == "CH":
-        model_weights = "../modeling/ch_model.h5"
-        img_src = Settings.IMAGES_195
-        extention = ".jpg"
-    else:
-        model_weights = "../modeling/ar_model.h5"
-        img_src = Settings.IMAGES_171
-        extention = ".png"
+    cache = result_cache.get_cache()
+    # archived results of other weights (older model) are skipped, same identity as in keys of result cache
+    weights = model_registry.model_id(event)
+
+    archive = get_archive(event)
+    if archive is not None:
+        with profiling.stage("archive_read"):
+            archived = archive.read(date_from_path(path), mask=False, weights=weights)
+        if archived is not None:
+            scale = np.array([1024, 1024], dtype=np.float32) / archived["polygon_size"]
+            polygons = [polygon * scale for polygon in archived["polygons"]]
+            return draw_overlay(path, event, polygons), round(archived["coverage"], 2)
+
+    with profiling.stage("cache_get"):
+        key = cache.key(event, path, weights)
+        result = cache.get(key)
+
+    if result is None and Settings.DUAL_EVENT and pair_path is not None:
+        paths = {event: path, "AR" if event == "CH" else "CH": pair_path}
+        results = segment_dual(paths["CH"], paths["AR"])
+        with profiling.stage("cache_put"):
+            for pair_event in ("CH", "AR"):
+                pair_key = key if pair_event == event else cache.key(pair_event, paths[pair_event],
+                                                                     model_registry.model_id(pair_event))
+                cache.put(pair_key, **results[pair_event])
+        result = results[event]
+    elif result is None:
+        result = segment(path, event)
+        with profiling.stage("cache_put"):
+            cache.put(key, **result)
+
+    return result["overlay"], result["area_coverage"]
+
+
+@profiling.timed("segment")
+def segment(path, event):
+    """makes segmentation of image without using cache, see start_segmentation()
+
+    Args:
+        path (string): path to image to make prediction on
+
+        event (string): "CH" or "AR"
+
+    Returns:
+        dict: "mask" - predicted probability mask, "polygons" - contours of segmentation,
+        "overlay" - image with drawn contours, "area_coverage" - area coverage on Sun's disk in %
+    """
+
+    # utils pulls in tensorflow through metrics, import it only when segmentation is really needed
+    from utils import create_contours
 
     imgs_test = []
     imgs_test.append(path)
 
+    with profiling.stage("load_input"):
+        x_test = load_input(imgs_test)
+
+    # deep learning approach, model is built only once per process
+    y_pred = model_registry.predict(event, x_test)
+
+    # make annotations on imgs
+    # straight runs of contour are compressed to end points, drawn outline is the same
+    with profiling.stage("contours"):
+        annotations = create_contours(y_pred[0], target_size=(1024, 1024), approximation="simple", as_array=True)
+    img = draw_overlay(path, event, annotations)
+
+    area_coverage = coverage(path, event, x_test[0], y_pred[0])
+
+    return {"mask": y_pred[0], "polygons": annotations, "overlay": img, "area_coverage": area_coverage}
+
+
+@profiling.timed("segment_dual")
+def segment_dual(ch_path, ar_path):
+    """makes segmentation of both events of one date in one pass without using cache. Input images are decoded once,
+    both models run in one predict call and contours of both events are made together.
+
+    Args:
+        ch_path (string): path to CROPPED 195 image
+
+        ar_path (string): path to 171 image of the same date
+
+    Returns:
+        dict: "CH" and "AR" - results like segment()
+    """
+    import dual_inference
+
+    with profiling.stage("load_input"):
+        x_ch = load_input([ch_path])
+        x_ar = load_input([ar_path])
+
+    y_ch, y_ar = model_registry.predict_dual(x_ch, x_ar)
+
+    with profiling.stage("contours"):
+        # threshold None keeps every nonzero pixel like create_contours() in segment()
+        ch_polygons, ar_polygons = dual_inference.contours(y_ch, y_ar, target_size=(1024, 1024), threshold=None)
+        polygons = {"CH": ch_polygons[0], "AR": ar_polygons[0]}
+
+    results = {}
+    for event, path, x, y_pred in [("CH", ch_path, x_ch, y_ch), ("AR", ar_path, x_ar, y_ar)]:
+        results[event] = {"mask": y_pred[0], "polygons": polygons[event],
+                          "overlay": draw_overlay(path, event, polygons[event]),
+                          "area_coverage": coverage(path, event, x[0], y_pred[0])}
+    return results
+
+
+def load_input(paths):
+    """loads normalized inputs of model, precomputed 256 px renditions from image pyramid are used
+    and full-size image is decoded only if rendition is missing
+
+    Args:
+        paths (list): paths to images
+
+    Returns:
+        numpy.array: images of shape (n_imgs, IMG_SIZE, IMG_SIZE, 1)
+    """
     imgs_test_list = []
-    for image in imgs_test:
-        imgs_test_list.append(np.array(Image.open(image).convert("L").resize((IMG_SIZE, IMG_SIZE))))
+    for image in paths:
+        imgs_test_list.append(image_pyramid.load_model_input(image, Settings.PYRAMID_DIR, IMG_SIZE))
 
     x_test = np.asarray(imgs_test_list, dtype=np.float32)/255
 
-    x_test = x_test.reshape(x_test.shape[0], x_test.shape[1], x_test.shape[2], 1)
-
-    input_shape = x_test[0].shape
+    return x_test.reshape(x_test.shape[0], x_test.shape[1], x_test.shape[2], 1)
 
-    # deep learning approach
-    model = scss_net(
-        input_shape,
-        filters=32,
-        layers=4,
-        batch_norm=True,
-        drop_prob=0.5)
 
-    model.load_weights(model_weights)
+@profiling.timed("coverage")
+def coverage(path, event, x, y_pred):
+    """calculates event coverage area in %
 
-    y_pred = model.predict(x_test)
+    Args:
+        path (string): path to image prediction was made on
 
-    # make annotations on imgs
-    annotations = create_contours(y_pred[0], target_size=(1024, 1024))
-    image_name_clean = path[-29:-4]
-    img = Image.open(img_src + image_name_clean + extention).resize((1024, 1024))
-    draw = ImageDraw.Draw(img)
+        event (string): "CH" or "AR"
 
-    for annotation in annotations:
-        draw.polygon(annotation, outline="red", width=4)
+        x (numpy.array): normalized input of model
 
-    # calculating event coverage area in %
-    size = 0
-    for i in np.nditer(x_test):
-        if i < 0.95:
-            size = size + 1
-    predicted_area = [(1 * (pixel > 0.1)).sum() for pixel in y_pred]
+        y_pred (numpy.array): prediction of model
 
+    Returns:
+        float: area coverage on Sun's disk in %
+    """
     if event == "CH":
-        area_coverage = round((predicted_area[0]/size) * 100, 2)
+        # white background of CROPPED image is everything out of Sun's disk
+        disk = np.count_nonzero(x < 0.95)
         # note: 2012/01/26 - area coverage is 14.58%
     else:
-        # use average size if cannot compute size of disk on image
-        area_coverage = round((predicted_area[0]/28326) * 100, 2)
+        # 171A images are not cropped, size of disk is computed from Sun's distance on date of image
+        disk = disk_geometry.disk_area(date_from_path(path), IMG_SIZE)
+
+    return disk_geometry.area_coverage(y_pred, disk)
+
+
+@profiling.timed("draw_overlay")
+def draw_overlay(path, event, polygons):
+    """draws contours of segmentation on 1024x1024 image, UNCROPPED 195A image for CH and 171A image for AR
+
+    Args:
+        path (string): path to image prediction was made on
+
+        event (string): "CH" or "AR"
+
+        polygons (list): contours in coordinates of 1024x1024 image
+
+    Returns:
+        Image: image with drawn contours
+    """
+    from utils import draw_contours
+
+    img = image_pyramid.open_display(display_path(path, event), Settings.PYRAMID_DIR)
+    draw_contours(img, polygons, outline="red", width=4)
+    return img
+
 
-    return img, area_coverage
\ No newline at end of file
+def display_path(path, event):
+    """
+    Args:
+        path (string): path to image prediction was made on
+
+        event (string): "CH" or "AR"
+
+    Returns:
+        string: path to image contours are drawn on, UNCROPPED 195A image for CH and 171A image for AR
+    """
+    # select UNCROPPED 195A images or 171 images
+    if event == "CH":
+        img_src = Settings.IMAGES_195
+        extention = ".jpg"
+    else:
+        img_src = Settings.IMAGES_171
+        extention = ".png"
+
+    image_name_clean = path[-29:-4]
+    return img_src + image_name_clean + extention
+
+
+def date_from_path(path):
+    """
+    Args:
+        path (string): path to image, filename starts with date in format %Y%m%d
+
+    Returns:
+        datetime.date: date of image
+    """
+    return datetime.datetime.strptime(os.path.basename(path)[:8], "%Y%m%d").date()
+
+
+def warm_up():
+    """starts building SCSS-Net models in background, so they are ready before user asks for first segmentation
+    """
+    model_registry.warm_up()
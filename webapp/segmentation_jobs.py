@@ -0,0 +1,85 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import settings as Settings
+
+
+class SegmentationJobs:
+    """runs segmentations in background executor shared by all sessions, so page can show raw image immediately.
+    The same job (eg. date and events) requested by more sessions or reruns runs only once. Every session owns jobs it is
+    waiting for, job which is not wanted by any session anymore is cancelled if it has not started yet.
+    Finished or failed job stays here until all its owners release it, so rerun of session gets its result or error
+    instead of starting it again. Sessions store results in their prefetch.Prefetcher and segmentations are cached
+    on disk by result_cache, so repeated job is cheap.
+    """
+
+    def __init__(self, workers=1):
+        """
+        Args:
+            workers (int, optional): number of background threads, more threads only compete for CPU with model. Defaults to 1.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segmentation")
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._owners = {}
+
+    def submit(self, session_id, key, function):
+        """starts job if it is not running yet and makes session its owner. All other jobs of session
+        are released, so navigation to new date cancels waiting job of previous date.
+
+        Args:
+            session_id (string): id of session
+
+            key (tuple): arguments of function, eg. (date, events)
+
+            function (callable): function(*key) -> result, called only if job is new
+
+        Returns:
+            concurrent.futures.Future: future of result, also finished or failed one until it is released
+        """
+        with self._lock:
+            self._release(session_id, keep=key)
+            self._owners.setdefault(key, set()).add(session_id)
+            future = self._futures.get(key)
+            if future is None:
+                future = self._executor.submit(function, *key)
+                self._futures[key] = future
+            return future
+
+    def release(self, session_id):
+        """session does not wait for any job anymore, eg. segmentation was switched off
+
+        Args:
+            session_id (string): id of session
+        """
+        with self._lock:
+            self._release(session_id)
+
+    def _release(self, session_id, keep=None):
+        for key, owners in list(self._owners.items()):
+            if key == keep:
+                continue
+            owners.discard(session_id)
+            if not owners:
+                del self._owners[key]
+                # running job can not be stopped, its segmentation still ends in result cache
+                future = self._futures.pop(key, None)
+                if future is not None:
+                    future.cancel()
+
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+
+def get_jobs():
+    """returns process-wide job queue, it is shared by all sessions
+
+    Returns:
+        SegmentationJobs: job queue
+    """
+    global _jobs
+    with _jobs_lock:
+        if _jobs is None:
+            _jobs = SegmentationJobs(Settings.SEGMENTATION_WORKERS)
+        return _jobs
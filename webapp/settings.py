@@ -4,6 +4,39 @@ IMAGES_195="../data/imgs/imgs_195_96-21/"
 IMAGES_195_CROPPED="../data/imgs/imgs_195_cropped_96-21/"
 IMAGES_171="../data/imgs/imgs_171_96-21/"
 MISSING_IMAGE="../data/imgs/missing.jpg"
+CATALOG_INDEX="../data/imgs/catalog.json"
+# renditions built by src/image_pyramid.py
+PYRAMID_DIR="../data/pyramid/"
+
+CH_MODEL_WEIGHTS="../modeling/ch_model.h5"
+AR_MODEL_WEIGHTS="../modeling/ar_model.h5"
+
+# url of src/inference_server.py (eg. "http://127.0.0.1:8765"), None runs models in webapp process
+INFERENCE_SERVER_URL=None
+# CH and AR are segmented together in one pass (one graph, one predict call), result of the other event is cached,
+# so switching event of the same date is instant
+DUAL_EVENT=True
+
+RESULT_CACHE_DIR="../data/cache/segmentations/"
+RESULT_CACHE_MAX_BYTES=512 * 1024 * 1024
+
+# archives built by src/segmentation_archive.py, one folder per event (CH/, AR/)
+ARCHIVE_DIR="../data/archive/"
+
+PREFETCH_DAYS=3
+PREFETCH_CACHE_SIZE=16
+
+# segmentation runs in background and raw image is shown meanwhile, False blocks page until segmentation is done
+ASYNC_SEGMENTATION=True
+SEGMENTATION_WORKERS=1
+# page waits at most this many seconds for running segmentation before it reruns itself to refresh status
+SEGMENTATION_REFRESH_S=1.0
+
+# stage timings of webapp, see profiling.py, None disables export of traces
+PROFILE_TRACE_FILE="../data/cache/traces.jsonl"
+PROFILE_WINDOW=500
+# tracemalloc measures allocations of every stage, but slows down allocations
+PROFILE_MEMORY=False
 
 # IMAGES_195="/Users/majirky/Desktop/slnko/imgs_96_21/"
 # IMAGES_195_CROPPED="/Users/majirky/Desktop/slnko/imgs_cropped/"
@@ -1,13 +1,34 @@
 import streamlit as st
 import datetime
-from datetime import timedelta
-from PIL import Image
-import glob
+import uuid
+from concurrent.futures import wait
+import pandas as pd
+import image_catalog
+import prefetch
+import profiling
 import scss_model
+import segmentation_jobs
+# src folder is added to path by scss_model
+import image_pyramid
 import os
 import settings as Settings
 
 
+def diagnostics_panel():
+    """shows percentiles of recent stage timings of this server process in sidebar, see profiling.py
+    """
+    summary = profiling.get_profiler().summary()
+    if not summary:
+        st.sidebar.write("no stages recorded yet")
+        return
+
+    st.sidebar.dataframe(pd.DataFrame(summary).set_index("stage"))
+    if Settings.PROFILE_TRACE_FILE:
+        st.sidebar.caption(f"traces are exported to {Settings.PROFILE_TRACE_FILE}")
+    if st.sidebar.button("reset timings"):
+        profiling.get_profiler().reset()
+
+
 def make_room(n):
     """generates white space on streamlit site. Basically it is an aleternative to <br> from html.
 
@@ -18,6 +39,7 @@ def make_room(n):
         st.write("")
 
 
+@profiling.timed("find_image")
 def find_image(date, event, cropped=False):
     """Finds and returns the path to an image from ../data/___ file. based on the provided date and event, either "CH" to look for
     195A images (best to spot coronal holes) or "AR" to look for 171A images (best to spot active regions).
@@ -33,31 +55,65 @@ def find_image(date, event, cropped=False):
         string: path to image
     """
 
-    date = date.strftime('%Y%m%d')
+    # catalog is indexed only once and refreshed when new images arrive to archive, no glob on every rerun
+    path_to_img = image_catalog.get_catalog().lookup(date, event, cropped)
 
-    if event == "CH":
-        if cropped:
-            # Look for cropped 195A images
-            imgs = glob.glob(f"{Settings.IMAGES_195_CROPPED}*.png")
+    if not path_to_img:
+        path_to_img = Settings.MISSING_IMAGE
 
-        else:
-            # Look for standard 195A images
-            imgs = glob.glob(f"{Settings.IMAGES_195}*.jpg")
-    else:
-        # Look for 171A images for active regions
-        imgs = glob.glob(f"{Settings.IMAGES_171}*.png")
+    return path_to_img
 
 
-    path_to_img = ""
+@profiling.timed("load_image")
+def load_image(date, event, segment=False):
+    """loads image of provided date and event, optionally with segmentation made by SCSS-Net.
+    It is used as loader of prefetch.Prefetcher, so it can run in background thread.
 
-    for path in imgs:
-        if date in path:
-            path_to_img = path
+    Args:
+        date (datetime): date of image
 
-    if not path_to_img:
-        path_to_img = {Settings.MISSING_IMAGE}
+        event (string): "CH" or "AR"
 
-    return path_to_img
+        segment (bool, optional): whether to make segmentation of event. Defaults to False.
+
+    Returns:
+        Image: image to show
+
+        float: area coverage of segmented event in %, None if segmentation was not made
+    """
+    path_to_img = find_image(date, event)
+
+    if segment:
+        path_to_img_checked = find_image(date, event, cropped=True)
+        # if there is no image of selected date, segmentation is not happening
+        if "missing" not in path_to_img_checked:
+            pair_path = None
+            if Settings.DUAL_EVENT:
+                # image of the other event of this date, both events are segmented in one pass
+                pair_event = "AR" if event == "CH" else "CH"
+                pair_path = find_image(date, pair_event, cropped=True)
+                pair_path = None if "missing" in pair_path else pair_path
+            return scss_model.start_segmentation(path_to_img_checked, event, pair_path)
+
+    # 1024 px rendition from image pyramid, decoded now, so it is done in prefetching thread and not while page renders
+    with profiling.stage("decode_display"):
+        image = image_pyramid.open_display(path_to_img, Settings.PYRAMID_DIR)
+    return image, None
+
+
+def load_segmentations(date, events):
+    """loads segmentations of more events of one date, it is function of background jobs (segmentation_jobs.py).
+    With Settings.DUAL_EVENT the first event segments both events in one pass and the other is read from result cache.
+
+    Args:
+        date (datetime): date of image
+
+        events (tuple): events to segment, "CH" and/or "AR"
+
+    Returns:
+        dict: event -> (Image, area_coverage), see load_image()
+    """
+    return {event: load_image(date, event, segment=True) for event in events}
 
 
 class passDate:
@@ -132,6 +188,9 @@ def decrement_counter(decrement_value=0):
 
 st.set_page_config(page_title="DL on SOHO", layout="wide")
 
+# build models in background only once per process, next reruns return immediately
+scss_model.warm_up()
+
 st.title("Usage of deep learning for segmentation of selective events in solar corona")
 
 make_room(3)
@@ -176,11 +235,6 @@ with col1:
 
         st.button('<- Previous day', on_click=decrement_counter, kwargs=dict(decrement_value=1))
 
-        date_button = pass_date.getDate()
-        date = date_button + timedelta(days=st.session_state.count)
-        pass_date_back.setDate(date)
-        pass_date_back.setSwitch(True)
-
     make_room(2)
 
     event_option = st.selectbox(
@@ -191,26 +245,80 @@ with col1:
     else:
         event = "AR"
 
-    # img path load
-    path_to_img = find_image(date, event)
+    if option == "buttons":
+        # move by available images of selected event, so days without image are skipped
+        date_button = pass_date.getDate()
+        date = image_catalog.get_catalog().shift(date_button, event, st.session_state.count)
+        pass_date_back.setDate(date)
+        pass_date_back.setSwitch(True)
 
-    if st.checkbox(f'segment {event}'):
-        path_to_img_checked = find_image(date, event, cropped=True)
-        # scss model segemtnation
-        if "missing" in path_to_img_checked:
-            # if there is no image of selected date, segmentation is not happening
-            image = Image.open(path_to_img)
-            pass
-        else:
-            image, area_coverage = scss_model.start_segmentation(path_to_img_checked, event)
-            st.markdown(f"{event_option} on this image cover ***{area_coverage}%*** of Sun's disk")
+    segment = st.checkbox(f'segment {event}')
+
+    # each session has its own prefetcher, so moving of one user does not cancel work of others
+    if 'prefetcher' not in st.session_state:
+        st.session_state.prefetcher = prefetch.Prefetcher(load_image)
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+
+    job = None
+    if segment and Settings.ASYNC_SEGMENTATION:
+        result = st.session_state.prefetcher.peek(date, event, segment)
+        if result is None:
+            # segmentation runs in background, raw image is shown until it is done. Both events of date are segmented
+            # in one pass, so one job per date serves both events and switching event does not start another job
+            events = ("CH", "AR") if Settings.DUAL_EVENT else (event,)
+            job = segmentation_jobs.get_jobs().submit(st.session_state.session_id, (date, events), load_segmentations)
+            if job.done() and not job.cancelled() and job.exception() is None:
+                for job_event, job_result in job.result().items():
+                    st.session_state.prefetcher.put(date, job_event, segment, job_result)
+                result = job.result()[event]
+                job = None
+            else:
+                result = st.session_state.prefetcher.get(date, event, False)
+        image, area_coverage = result
+    else:
+        # this session waits for no segmentation, its queued jobs can be cancelled
+        segmentation_jobs.get_jobs().release(st.session_state.session_id)
+        image, area_coverage = st.session_state.prefetcher.get(date, event, segment)
 
+    if option == "buttons":
+        # prepare neighbouring days, so next click on buttons is instant
+        st.session_state.prefetcher.update(date, event, segment)
     else:
-        image = Image.open(path_to_img)
+        # user picks dates directly, neighbours are not needed
+        st.session_state.prefetcher.cancel()
+
+    coverage_text = st.empty()
+    if area_coverage is not None:
+        coverage_text.markdown(f"{event_option} on this image cover ***{area_coverage}%*** of Sun's disk")
 
 with colEMPTY:
     pass
 
 with col2:
-    st.image(image, caption='soho eit')
-
+    image_slot = st.empty()
+    image_slot.image(image, caption='soho eit')
+    status = st.empty()
+
+# diagnostics are rendered after page, so they include stages of this rerun, but before waiting for segmentation,
+# which ends with rerun of page
+if st.sidebar.checkbox("diagnostics"):
+    diagnostics_panel()
+
+if job is not None and not job.done():
+    # wait returns as soon as job is done, then rerun shows overlay from prefetcher. Waiting is bounded, so run ends
+    # regularly and user input is not blocked (navigation releases the job in the next run)
+    status.caption(f"segmenting {event}...")
+    wait([job], timeout=Settings.SEGMENTATION_REFRESH_S)
+
+if job is not None and not job.cancelled():
+    if job.done() and job.exception() is not None:
+        # failed job is not rerun, raw image stays shown
+        status.error(f"segmentation failed: {job.exception()}")
+    else:
+        if job.done():
+            for job_event, job_result in job.result().items():
+                st.session_state.prefetcher.put(date, job_event, segment, job_result)
+        # st.rerun replaced st.experimental_rerun in newer streamlit
+        rerun = getattr(st, "rerun", None) or st.experimental_rerun
+        rerun()